@@ -0,0 +1,120 @@
+import os
+import json
+import time
+from collections import OrderedDict
+import numpy as np
+
+class SemanticCache:
+    """
+    Caches generated answers and returns them for queries whose embedding is
+    close enough to a cached one, within the same scope (filters, mode...).
+    Entries are evicted LRU once max_entries is reached and expire after ttl seconds.
+    """
+    def __init__(self, threshold: float = None, max_entries: int = None, ttl: float = None):
+        self.enabled = os.getenv("RAG_CACHE_ENABLED", "true").lower() not in ("0", "false", "no")
+        self.threshold = threshold if threshold is not None else float(os.getenv("RAG_CACHE_THRESHOLD", "0.95"))
+        self.max_entries = max_entries or int(os.getenv("RAG_CACHE_MAX_ENTRIES", "512"))
+        self.ttl = ttl if ttl is not None else float(os.getenv("RAG_CACHE_TTL", "3600"))
+
+        # entry key -> (scope, normalized text, unit vector, value, created_at)
+        self._entries = OrderedDict()
+        self._next_key = 0
+        # Bumped on every invalidation. Answers computed against an older
+        # generation are not stored, so a query racing an ingest can't
+        # repopulate the cache with a stale answer.
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_scope(**parts) -> str:
+        return json.dumps(parts, sort_keys=True, default=str)
+
+    @staticmethod
+    def _normalize_text(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    def _expire(self):
+        if not self.ttl:
+            return
+        cutoff = time.monotonic() - self.ttl
+        # OrderedDict keeps insertion/recency order, but a recently used entry
+        # can still be old, so check every entry.
+        expired = [key for key, entry in self._entries.items() if entry[4] < cutoff]
+        for key in expired:
+            del self._entries[key]
+            self.evictions += 1
+
+    def get_exact(self, text: str, scope: str):
+        """
+        Cheap lookup by normalized text, usable before the query is embedded.
+        """
+        if not self.enabled:
+            return None
+        self._expire()
+        normalized = self._normalize_text(text)
+        for key, entry in self._entries.items():
+            if entry[0] == scope and entry[1] == normalized:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[3]
+        return None
+
+    def get(self, embedding: list, scope: str):
+        if not self.enabled:
+            return None
+        self._expire()
+
+        candidates = [(key, entry) for key, entry in self._entries.items() if entry[0] == scope]
+        if not candidates:
+            self.misses += 1
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= (np.linalg.norm(query) or 1.0)
+        matrix = np.stack([entry[2] for _, entry in candidates])
+        scores = matrix @ query
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        key, entry = candidates[best]
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[3]
+
+    def put(self, text: str, embedding: list, scope: str, value, generation: int = None):
+        if not self.enabled:
+            return
+        if generation is not None and generation != self.generation:
+            return
+
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= (np.linalg.norm(vector) or 1.0)
+        self._entries[self._next_key] = (scope, self._normalize_text(text), vector, value, time.monotonic())
+        self._next_key += 1
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        self._entries.clear()
+        self.generation += 1
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -1,14 +1,28 @@
 from __future__ import annotations
 import os
+import json
+import time
+import asyncio
+import hmac
 import shutil
-from fastapi import FastAPI, UploadFile, File, HTTPException
+import importlib
+from fastapi import FastAPI, UploadFile, File, Form, Header, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
-from rag_service import RAGService
 
-from memory_service import MemoryService
-from gemini_client import GeminiClient
+# rag_service and gemini_client pull in LangChain, pandas and the Gemini SDK;
+# they are imported when the services are created, off the event loop.
+from memory_service import MemoryService, MemoryWriteQueue
 from tavily_service import TavilyService
+from embedding_cache import get_embedding_cache
+from ingest_jobs import IngestJobManager
+from conversation_summary import ConversationSummarizer
+from llm_scheduler import LLMRateLimited, scheduler_stats
+from metrics import metrics, TimingMiddleware
+from db_pool import pool_stats
 
 def setup_cors(app: FastAPI, allow_all: bool = True) -> None:
     # If ALLOWED_ORIGINS is set, use it.
@@ -53,53 +67,150 @@ def setup_cors(app: FastAPI, allow_all: bool = True) -> None:
 app = FastAPI(title="Gemini RAG System", description="Lightweight RAG system using LangChain and Gemini")
 
 setup_cors(app)
+app.add_middleware(TimingMiddleware)
+
+# Context sources fetched alongside retrieval in /chat; a source that takes
+# longer than its timeout is skipped.
+MEMORY_SEARCH_TIMEOUT = float(os.getenv("MEMORY_SEARCH_TIMEOUT", "2"))
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "5"))
+CHAT_WEB_SEARCH = os.getenv("CHAT_WEB_SEARCH", "false").lower() in ("1", "true", "yes")
+# Update the /finalize summary in the background after each memory write
+SUMMARY_EAGER_REFRESH = os.getenv("SUMMARY_EAGER_REFRESH", "false").lower() in ("1", "true", "yes")
+# Services are created in the background so /healthz answers right away;
+# /readyz turns 200 once the required ones are up.
+STARTUP_BACKGROUND_INIT = os.getenv("STARTUP_BACKGROUND_INIT", "true").lower() not in ("0", "false", "no")
+READY_REQUIRED_SERVICES = [s.strip() for s in os.getenv("READY_REQUIRED_SERVICES", "rag").split(",") if s.strip()]
+# Open DB connections and prime embeddings/retrieval before reporting ready
+STARTUP_WARMUP = os.getenv("STARTUP_WARMUP", "false").lower() in ("1", "true", "yes")
+BATCH_MAX_QUERIES = int(os.getenv("RAG_BATCH_MAX_QUERIES", "100"))
+# Token for the admin endpoints that change the database (X-Admin-Token
+# header); unset, they are disabled
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
 
 # Initialize Services
 rag_service = None
 tavily_service = None
 memory_service = None
 gemini_client = None
+ingest_jobs = None
+memory_writes = None
+summarizer = None
 
-@app.on_event("startup")
-async def startup_event():
-    global rag_service, tavily_service, memory_service, gemini_client
-    try:
-        rag_service = RAGService(work_dir="./rag_storage")
-        print("RAG Service initialized successfully.")
-    except Exception as e:
-        print(f"Failed to initialize RAG Service: {e}")
+# Per service: state (pending, ready, degraded, disabled or failed),
+# seconds it took and the error if it failed
+service_states = {name: {"state": "pending"} for name in ("rag", "tavily", "memory", "gemini", "summarizer")}
+init_task = None
 
-    try:
-        tavily_service = TavilyService()
-        print("Tavily Service initialized.")
-    except Exception as e:
-        print(f"Failed to initialize Tavily Service: {e}")
+async def init_rag():
+    global rag_service, ingest_jobs
+    module = await asyncio.to_thread(importlib.import_module, "rag_service")
+    rag_service = await asyncio.to_thread(module.RAGService, work_dir="./rag_storage")
+    ingest_jobs = IngestJobManager(rag_service, upload_dir=os.path.join(rag_service.work_dir, "uploads"))
+    await ingest_jobs.start()
+    if STARTUP_WARMUP:
+        try:
+            warm_up = await rag_service.warm_up()
+            print(f"RAG Service warmed up: {warm_up}")
+        except Exception as e:
+            print(f"RAG Service warm-up failed: {e}")
 
-    try:
-        memory_service = MemoryService()
-        print("Memory Service initialized.")
-    except Exception as e:
-        print(f"Failed to initialize Memory Service: {e}")
+async def init_tavily():
+    global tavily_service
+    tavily_service = TavilyService()
+    if not tavily_service.client:
+        return "disabled"
+
+async def init_memory():
+    global memory_service, memory_writes
+    memory_service = await asyncio.to_thread(MemoryService)
+    memory_writes = MemoryWriteQueue(memory_service)
+    await memory_writes.start()
+    if not memory_service.memory:
+        return "degraded"
+
+async def init_gemini():
+    global gemini_client
+    module = await asyncio.to_thread(importlib.import_module, "gemini_client")
+    gemini_client = await asyncio.to_thread(module.GeminiClient)
 
+async def init_summarizer():
+    global summarizer
+    if not (memory_service and gemini_client):
+        return "disabled"
+    summarizer = ConversationSummarizer(memory_service, gemini_client)
+    if SUMMARY_EAGER_REFRESH and memory_writes:
+        memory_writes.on_write = summarizer.refresh
+
+async def start_service(name: str, init):
+    started = time.perf_counter()
     try:
-        gemini_client = GeminiClient()
+        state = await init() or "ready"
     except Exception as e:
-        print(f"Failed to initialize Gemini Client: {e}")
+        service_states[name] = {"state": "failed", "seconds": round(time.perf_counter() - started, 3), "error": str(e)}
+        print(f"Failed to initialize {name} service: {e}")
+        return
+    service_states[name] = {"state": state, "seconds": round(time.perf_counter() - started, 3)}
+    print(f"{name} service {state} in {service_states[name]['seconds']}s")
+
+async def initialize_services():
+    # Independent services come up concurrently; the summarizer needs memory and Gemini
+    await asyncio.gather(
+        start_service("rag", init_rag),
+        start_service("tavily", init_tavily),
+        start_service("memory", init_memory),
+        start_service("gemini", init_gemini),
+    )
+    await start_service("summarizer", init_summarizer)
+
+@app.on_event("startup")
+async def startup_event():
+    global init_task
+    init_task = asyncio.create_task(initialize_services())
+    if not STARTUP_BACKGROUND_INIT:
+        await init_task
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if init_task and not init_task.done():
+        init_task.cancel()
+    if memory_writes:
+        # Don't lose the interactions that are still buffered
+        await memory_writes.stop()
+    if ingest_jobs:
+        await ingest_jobs.stop()
+    if rag_service:
+        rag_service.close()
+    if tavily_service:
+        await tavily_service.close()
 
 class QueryRequest(BaseModel):
     text: str
     mode: str = "hybrid"
     filters: dict = None
     user_id: str = "default_user"
+    # Add Tavily web results to the context (defaults to CHAT_WEB_SEARCH)
+    web_search: bool = None
+
+class BatchQueryRequest(BaseModel):
+    queries: list[str]
+    mode: str = "hybrid"
+    filters: dict = None
 
 class SearchRequest(BaseModel):
     query: str
     max_results: int = 5
     search_depth: str = "basic"
 
-@app.post("/ingest")
-async def ingest_document(file: UploadFile = File(...)):
-    if not rag_service:
+@app.post("/ingest", status_code=202)
+async def ingest_document(file: UploadFile = File(...), source: str = Form(None), wait: bool = False):
+    """
+    Stores the upload and queues it for background ingestion. Returns the job
+    id right away; poll GET /ingest/{job_id} for progress. With ?wait=true the
+    request blocks until the job finishes (previous behaviour). The document
+    is stored under source (e.g. its path relative to the uploaded folder),
+    or under the upload's filename; re-ingesting the same source replaces it.
+    """
+    if not rag_service or not ingest_jobs:
         raise HTTPException(status_code=503, detail="RAG Service not initialized")
     
     if not rag_service._initialized:
@@ -110,19 +221,55 @@ async def ingest_document(file: UploadFile = File(...)):
     if ext not in allowed_extensions:
          pass
 
-    temp_file_path = f"temp_{file.filename}"
+    job = await queue_upload(file, source)
+    if job.state == "failed":
+        raise HTTPException(status_code=500, detail=job.error)
+
+    if wait:
+        await job.done.wait()
+        if job.state == "failed":
+            raise HTTPException(status_code=500, detail=job.error)
+
+    return job.to_dict()
+
+@app.post("/ingest/batch", status_code=202)
+async def ingest_documents(files: list[UploadFile] = File(...)):
+    """
+    Queues several files in one request; returns one job per file.
+    """
+    if not rag_service or not ingest_jobs:
+        raise HTTPException(status_code=503, detail="RAG Service not initialized")
+
+    # A file that can't be stored comes back as a failed job; the others are
+    # already queued, so the request itself doesn't fail
+    jobs = [await queue_upload(file) for file in files]
+    return {"jobs": [job.to_dict() for job in jobs]}
+
+async def queue_upload(file: UploadFile, source: str = None):
+    """
+    Stores the upload and queues its job. If the file can't be stored the
+    job is returned already failed, with the error.
+    """
+    job = ingest_jobs.create_job(file.filename, source)
     try:
-        with open(temp_file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
-        await rag_service.ingest_file(temp_file_path)
-        
-        return {"message": f"Successfully ingested {file.filename}"}
+        with open(job.file_path, "wb") as buffer:
+            await run_in_threadpool(shutil.copyfileobj, file.file, buffer)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        ingest_jobs.fail(job, f"Upload failed: {e}")
+        return job
+
+    ingest_jobs.enqueue(job)
+    return job
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    if not ingest_jobs:
+        raise HTTPException(status_code=503, detail="RAG Service not initialized")
+
+    job = ingest_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
 
 @app.post("/search")
 async def search_endpoint(request: SearchRequest):
@@ -135,42 +282,220 @@ async def search_endpoint(request: SearchRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def validate_mode(request: QueryRequest | BatchQueryRequest):
+    from rag_service import normalize_mode
+    try:
+        request.mode = normalize_mode(request.mode)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+async def fetch_source(name: str, awaitable, timeout: float):
+    # A slow or failing source is dropped instead of failing the whole answer
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        print(f"{name} timed out after {timeout}s, answering without it")
+    except Exception as e:
+        print(f"{name} failed, answering without it: {e}")
+    return None
+
+async def fetch_extra_context(request: QueryRequest) -> str:
+    """
+    Fetches the user's memories and, if requested, web search context,
+    concurrently. Runs alongside retrieval inside RAGService.
+    """
+    async def memories():
+        if not memory_service:
+            return None
+
+        async def search():
+            found = await run_in_threadpool(memory_service.search, request.text, user_id=request.user_id)
+            # Mem0 returns a list, or {"results": [...]} in newer versions
+            if isinstance(found, dict):
+                found = found.get("results", [])
+            return [m["memory"] for m in found]
+
+        return await fetch_source("Memory search", search(), MEMORY_SEARCH_TIMEOUT)
+
+    async def web_context():
+        web_search = request.web_search if request.web_search is not None else CHAT_WEB_SEARCH
+        if not web_search or not tavily_service or not tavily_service.client:
+            return None
+        return await fetch_source("Web search", tavily_service.get_search_context(request.text), WEB_SEARCH_TIMEOUT)
+
+    found_memories, found_web = await asyncio.gather(memories(), web_context())
+
+    sections = []
+    if found_memories:
+        sections.append("Relevant Memory:\n" + "\n".join(found_memories))
+    if found_web:
+        sections.append(f"Web Search Results:\n{found_web}")
+    return "\n\n".join(sections)
+
 @app.post("/chat")
 async def chat_endpoint(request: QueryRequest):
     if not rag_service:
         raise HTTPException(status_code=503, detail="RAG Service not initialized")
-    
-    # Retrieve context from memory
-    memory_context = ""
-    if memory_service:
-        memories = memory_service.search(request.text, user_id=request.user_id)
-        if memories:
-            memory_context = "\nRelevant Memory:\n" + "\n".join([m['memory'] for m in memories])
-
-    # Append memory to query (simple approach)
-    # Or we can pass it as history if LightRAG supports it better.
-    # For now, we prepend it to the text.
-    augmented_text = f"{memory_context}\nUser Query: {request.text}" if memory_context else request.text
-    
+
+    validate_mode(request)
+
     try:
-        response = await rag_service.query(augmented_text, mode=request.mode, filters=request.filters)
+        response = await rag_service.query(
+            request.text, mode=request.mode, filters=request.filters, extra_context=fetch_extra_context(request)
+        )
         
-        # Add interaction to memory
-        if memory_service:
-            memory_service.add(f"User: {request.text}\nAssistant: {response}", user_id=request.user_id)
+        # Add interaction to memory in the background
+        if memory_writes:
+            memory_writes.enqueue(f"User: {request.text}\nAssistant: {response}", user_id=request.user_id)
             
         return response
+    except LLMRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/chat/stream")
+async def chat_stream_endpoint(request: QueryRequest):
+    """
+    Streaming variant of /chat using Server-Sent Events.
+    Emits {"token": ...} events as the answer is generated, then a final
+    "done" event. The full interaction is saved to memory once the stream ends.
+    """
+    if not rag_service:
+        raise HTTPException(status_code=503, detail="RAG Service not initialized")
+
+    validate_mode(request)
+
+    parts = []
+    completed = False
+
+    async def event_stream():
+        nonlocal completed
+        try:
+            async for token in rag_service.query_stream(
+                request.text, mode=request.mode, filters=request.filters, extra_context=fetch_extra_context(request)
+            ):
+                parts.append(token)
+                yield f"data: {json.dumps({'token': token}, ensure_ascii=False)}\n\n"
+        except Exception as e:
+            yield f"event: error\ndata: {json.dumps({'detail': str(e)})}\n\n"
+            return
+
+        completed = True
+        yield "event: done\ndata: {}\n\n"
+
+    async def save_interaction():
+        # Runs after the response has been fully sent
+        if memory_writes and completed:
+            response = "".join(parts)
+            memory_writes.enqueue(f"User: {request.text}\nAssistant: {response}", user_id=request.user_id)
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=BackgroundTask(save_interaction),
+    )
+
 @app.post("/api/query")
 async def json_endpoint(request: QueryRequest):
     if not rag_service:
         raise HTTPException(status_code=503, detail="RAG Service not initialized")
-    
+
+    validate_mode(request)
     try:
         response = await rag_service.query_json(request.text, mode=request.mode, filters=request.filters)
         return response
+    except LLMRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/query/batch")
+async def batch_endpoint(request: BatchQueryRequest):
+    """
+    Answers several questions in one request. Results are streamed as
+    newline-delimited JSON, one {"index", ...} object per question in the
+    order they complete; a failed question carries "error" instead of an answer.
+    """
+    if not rag_service:
+        raise HTTPException(status_code=503, detail="RAG Service not initialized")
+    if len(request.queries) > BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_QUERIES} queries per batch")
+
+    validate_mode(request)
+
+    async def results():
+        async for index, result in rag_service.query_batch(request.queries, mode=request.mode, filters=request.filters):
+            yield json.dumps({"index": index, **result}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
+def collect_stats() -> dict:
+    stats = {"embedding_cache": get_embedding_cache().stats(), "llm_scheduler": scheduler_stats(), "db_pool": pool_stats()}
+    if rag_service:
+        stats["answer_cache"] = rag_service.answer_cache.stats()
+        stats["context_packing"] = rag_service.context_packer.stats()
+    if ingest_jobs:
+        stats["ingest_jobs"] = ingest_jobs.stats()
+    if memory_writes:
+        stats["memory_writes"] = memory_writes.stats()
+    if tavily_service:
+        stats["web_search"] = tavily_service.stats()
+    if summarizer:
+        stats["summaries"] = summarizer.stats()
+    return stats
+
+# /metrics exports the numbers in /stats as gauges (rag_<component>_<key>)
+metrics.add_collector("", collect_stats)
+
+@app.get("/stats")
+async def stats_endpoint():
+    return collect_stats()
+
+@app.get("/healthz")
+async def healthz():
+    # Liveness: the process is up and the event loop responds
+    return {"status": "ok", "services": service_states}
+
+@app.get("/readyz")
+async def readyz():
+    ready = all(service_states[name]["state"] in ("ready", "degraded") for name in READY_REQUIRED_SERVICES)
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "not_ready", "services": service_states},
+    )
+
+@app.get("/metrics")
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/admin/indexes")
+async def index_status_endpoint():
+    if not rag_service:
+        raise HTTPException(status_code=503, detail="RAG Service not initialized")
+
+    try:
+        return await rag_service.index_status()
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def require_admin(x_admin_token: str = Header(None)):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled (set ADMIN_TOKEN)")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post("/admin/reindex", dependencies=[Depends(require_admin)])
+async def reindex_endpoint():
+    """
+    Drops and rebuilds the vector and metadata indexes with the current settings.
+    """
+    if not rag_service:
+        raise HTTPException(status_code=503, detail="RAG Service not initialized")
+
+    try:
+        return await rag_service.rebuild_indexes()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -178,65 +503,21 @@ async def json_endpoint(request: QueryRequest):
 async def finalize_chat(user_id: str = "default_user"):
     """
     Generates a JSON with next steps based on the chat history.
+    Only the memories added since the last call are sent to Gemini, along
+    with the stored summary.
     """
-    if not memory_service or not gemini_client:
+    if not memory_service or not gemini_client or not summarizer:
         raise HTTPException(status_code=503, detail="Services not initialized")
     
     try:
-        # Get all memories for the user
-        # Note: get_all might return a lot, we might want to limit or summarize.
-        # Mem0's get_all returns list of dicts.
-        memories = memory_service.get_all(user_id=user_id)
-        history_text = "\n".join([m['memory'] for m in memories])
-        
-        prompt = f"""
-        Based on the following conversation history, generate a JSON object with the following specific structure in Spanish:
-        
-        History:
-        {history_text}
-        
-        Format:
-        {{
-            "resumen_conversacion": "Resumen detallado de la conversación",
-            "puntos_importantes": [
-                "Punto importante 1",
-                "Punto importante 2"
-            ],
-            "pasos_desarrollo": [
-                {{
-                    "descripcion": "Descripción del paso a seguir",
-                    "completado": false
-                }},
-                {{
-                    "descripcion": "Descripción del siguiente paso",
-                    "completado": false
-                }}
-            ]
-        }}
-        
-        Ensure 'completado' is always boolean false.
-        """
-        
-        response_text = await gemini_client.generate_content(
-            model_name="gemini-2.5-flash",
-            prompt=prompt
-        )
-        
-        # Clean up response to ensure valid JSON (simple heuristic)
-        # In production, use structured output or robust parsing.
-        import json
-        try:
-            # Try to find JSON block
-            start = response_text.find('{')
-            end = response_text.rfind('}') + 1
-            if start != -1 and end != -1:
-                json_str = response_text[start:end]
-                return json.loads(json_str)
-            else:
-                return {"error": "Could not parse JSON", "raw_response": response_text}
-        except Exception:
-             return {"error": "Could not parse JSON", "raw_response": response_text}
+        # Include the interactions still waiting in the write-behind queue
+        if memory_writes:
+            await memory_writes.flush(user_id)
+
+        return await summarizer.summarize(user_id)
 
+    except LLMRateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -0,0 +1,358 @@
+"""
+End-to-end benchmark of the API with local stand-ins for Gemini, Tavily
+and Mem0.
+
+Drives the app.py endpoints in-process (/ingest, /api/query, /chat,
+/finalize) with fake LLM, embedding, web search and memory backends whose
+latency is configurable, against the Postgres/pgvector database configured
+by the POSTGRES_* variables (e.g. the docker-compose one). Everything goes
+to a throwaway collection that is deleted at the end.
+
+Reports p50/p95/p99 latency and throughput per endpoint under concurrency,
+ingest chunks/sec over the documentos/ corpus and peak RSS.
+
+Usage:
+    python bench_app.py --requests 200 --concurrency 16 --json results.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import argparse
+import resource
+import tempfile
+from collections import defaultdict
+
+# Stand-ins don't need quota, and must not write to the real caches
+os.environ.setdefault("LLM_GENERATION_RPM", "0")
+os.environ.setdefault("LLM_GENERATION_TPM", "0")
+os.environ.setdefault("LLM_EMBEDDING_RPM", "0")
+os.environ.setdefault("LLM_EMBEDDING_TPM", "0")
+os.environ["EMBEDDING_CACHE_PATH"] = ""
+
+import httpx
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+import app
+from rag_service import RAGService
+from ingest_jobs import IngestJobManager
+from memory_service import MemoryWriteQueue
+from tavily_service import TavilyService
+from conversation_summary import ConversationSummarizer
+
+QUESTIONS = [
+    "¿Qué modalidades de selección de contratistas existen?",
+    "¿Cuáles son los principios de la contratación estatal?",
+    "¿Qué es la licitación pública y cuándo procede?",
+    "¿Cuándo procede la contratación directa?",
+    "¿Qué garantías se exigen en los contratos estatales?",
+    "¿Qué es el SECOP II y para qué sirve?",
+    "¿Cómo se publica un proceso de contratación en el SECOP?",
+    "¿Qué inhabilidades e incompatibilidades existen para contratar?",
+    "¿Qué es la selección abreviada de menor cuantía?",
+    "¿Qué medidas de apoyo al emprendimiento establece la Ley 2069 de 2020?",
+    "¿Cómo se liquidan los contratos estatales?",
+    "¿Qué es el registro único de proponentes?",
+    "¿Qué sanciones aplican por incumplimiento del contratista?",
+    "¿Qué es un acuerdo marco de precios?",
+    "¿Qué criterios de desempate existen entre ofertas?",
+    "¿Qué responsabilidad tienen los servidores públicos en la contratación?",
+]
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic hashed bag-of-words vectors, so similar texts still get
+    similar vectors and retrieval returns sensible chunks.
+    """
+    def __init__(self, dims: int, latency: float):
+        self.dims = dims
+        self.latency = latency
+
+    def _vector(self, text: str) -> list:
+        vector = np.zeros(self.dims, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[int(hashlib.md5(word.encode("utf-8")).hexdigest()[:8], 16) % self.dims] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        time.sleep(self.latency)
+        return self._vector(text)
+
+class FakeLLM:
+    # Answers after latency + token_latency per output token
+    def __init__(self, latency: float, token_latency: float, answer_tokens: int = 80):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.answer_tokens = answer_tokens
+        self.prompt_chars = 0
+        self.calls = 0
+
+    def _tokens(self, prompt: str) -> list:
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        return [f"palabra{i} " for i in range(self.answer_tokens)]
+
+    async def ainvoke(self, prompt):
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.latency + self.token_latency * len(tokens))
+        return AIMessage(content="".join(tokens))
+
+    async def astream(self, prompt):
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.latency)
+        for token in tokens:
+            await asyncio.sleep(self.token_latency)
+            yield AIMessageChunk(content=token)
+
+class FakeMemoryService:
+    # add() stands in for Mem0's extraction call + embedding + write
+    def __init__(self, search_latency: float, add_latency: float):
+        self.search_latency = search_latency
+        self.add_latency = add_latency
+        self.memories = defaultdict(list)
+
+    def add(self, text: str, user_id: str = "default_user", metadata: dict = None):
+        time.sleep(self.add_latency)
+        self.memories[user_id].append({"id": uuid.uuid4().hex, "memory": text[:300]})
+
+    def search(self, query: str, user_id: str = "default_user", limit: int = 5):
+        time.sleep(self.search_latency)
+        return self.memories[user_id][-limit:]
+
+    def get_all(self, user_id: str = "default_user", limit: int = 100):
+        return self.memories[user_id][:limit]
+
+class FakeGeminiClient:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    async def generate_content(self, model_name: str, prompt: str, system_prompt: str = None, history_messages: list = None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return json.dumps({
+            "resumen_conversacion": f"Resumen simulado ({len(prompt)} caracteres de entrada)",
+            "puntos_importantes": ["Punto simulado"],
+            "pasos_desarrollo": [{"descripcion": "Paso simulado", "completado": False}],
+        })
+
+def fake_tavily_transport(latency: float) -> httpx.MockTransport:
+    async def handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(latency)
+        query = json.loads(request.content)["query"]
+        return httpx.Response(200, json={"results": [
+            {"title": f"Resultado {i}", "url": f"https://example.org/{i}", "content": f"Contenido web sobre {query}"}
+            for i in range(5)
+        ]})
+    return httpx.MockTransport(handler)
+
+def _proc_peak_rss_mb(pid: int) -> float:
+    # Linux only: high-water mark of a live process
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+def peak_rss_mb(child_pids=()) -> dict:
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    children = max([_proc_peak_rss_mb(pid) for pid in child_pids], default=0.0)
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale, 1),
+        "parse_process": round(children, 1),
+    }
+
+def summarize_latencies(latencies: list, errors: int, elapsed: float) -> dict:
+    ms = np.asarray(latencies or [0.0]) * 1000
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": round(float(np.percentile(ms, 50)), 1),
+        "p95_ms": round(float(np.percentile(ms, 95)), 1),
+        "p99_ms": round(float(np.percentile(ms, 99)), 1),
+        "mean_ms": round(float(ms.mean()), 1),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+    }
+
+async def run_load(client: httpx.AsyncClient, make_request, total: int, concurrency: int) -> dict:
+    """
+    Sends total requests, concurrency at a time. make_request(i) returns
+    (method, path, kwargs).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def one(i):
+        nonlocal errors
+        method, path, kwargs = make_request(i)
+        async with semaphore:
+            started = time.perf_counter()
+            response = await client.request(method, path, **kwargs)
+            elapsed = time.perf_counter() - started
+        if response.status_code >= 400:
+            errors += 1
+        else:
+            latencies.append(elapsed)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return summarize_latencies(latencies, errors, time.perf_counter() - started)
+
+async def ingest_corpus(client: httpx.AsyncClient, corpus: str) -> dict:
+    files = sorted(
+        os.path.join(corpus, name) for name in os.listdir(corpus)
+        if not name.startswith(".") and os.path.isfile(os.path.join(corpus, name))
+    )
+
+    async def ingest(path):
+        with open(path, "rb") as f:
+            response = await client.post("/ingest", params={"wait": "true"}, files={"file": (os.path.basename(path), f)})
+        response.raise_for_status()
+        return response.json()
+
+    started = time.perf_counter()
+    jobs = await asyncio.gather(*(ingest(path) for path in files))
+    elapsed = time.perf_counter() - started
+    chunks = sum(job["stats"]["added"] for job in jobs)
+    return {
+        "files": [
+            {"file": job["filename"], "chunks": job["stats"]["added"], "seconds": job["stats"]["seconds_total"],
+             "chunks_per_sec": job["stats"]["chunks_per_sec"]}
+            for job in jobs
+        ],
+        "chunks": chunks,
+        "seconds": round(elapsed, 2),
+        "chunks_per_sec": round(chunks / elapsed, 1) if elapsed else 0.0,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "documentos"))
+    parser.add_argument("--requests", type=int, default=200, help="Requests per query endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--users", type=int, default=8, help="Distinct user_ids for /chat and /finalize")
+    parser.add_argument("--web", action="store_true", help="Enable web search context in /chat")
+    parser.add_argument("--answer-cache", action="store_true", help="Keep the semantic answer cache on")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds before the first token")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="Seconds per output token")
+    parser.add_argument("--embed-latency", type=float, default=0.05)
+    parser.add_argument("--search-latency", type=float, default=0.3, help="Tavily stand-in latency")
+    parser.add_argument("--memory-latency", type=float, default=0.05, help="Memory search latency")
+    parser.add_argument("--memory-add-latency", type=float, default=0.8, help="Memory write latency")
+    parser.add_argument("--collection", default="bench_app")
+    parser.add_argument("--skip-ingest", action="store_true")
+    parser.add_argument("--json", default=None, help="Also write the results to this file")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="bench_app_")
+    dims = int(os.getenv("RAG_EMBEDDING_DIM", "768"))
+
+    fake_llm = FakeLLM(args.llm_latency, args.token_latency)
+    rag = RAGService(
+        work_dir=work_dir,
+        embeddings=FakeEmbeddings(dims, args.embed_latency),
+        llm=fake_llm,
+        collection_name=args.collection,
+    )
+    rag.answer_cache.enabled = args.answer_cache
+    if not args.skip_ingest:
+        rag.vector_store.delete_collection()
+        rag.vector_store.create_collection()
+
+    memory = FakeMemoryService(args.memory_latency, args.memory_add_latency)
+    tavily = TavilyService(api_key="bench")
+    await tavily.client.aclose()
+    tavily.client = httpx.AsyncClient(base_url=tavily.base_url, transport=fake_tavily_transport(args.search_latency))
+
+    app.rag_service = rag
+    app.memory_service = memory
+    app.tavily_service = tavily
+    app.gemini_client = FakeGeminiClient(args.llm_latency)
+    app.summarizer = ConversationSummarizer(memory, app.gemini_client, path=os.path.join(work_dir, "summaries.sqlite3"))
+    app.ingest_jobs = IngestJobManager(rag, upload_dir=os.path.join(work_dir, "uploads"))
+    app.memory_writes = MemoryWriteQueue(memory)
+    await app.ingest_jobs.start()
+    await app.memory_writes.start()
+
+    results = {"config": vars(args)}
+    transport = httpx.ASGITransport(app=app.app)
+    try:
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            if not args.skip_ingest:
+                print(f"Ingesting {args.corpus} ...")
+                results["ingest"] = await ingest_corpus(client, args.corpus)
+                # Parse processes are still alive here, so their peak can be read
+                pool = app.ingest_jobs._process_pool
+                results["peak_rss_mb"] = peak_rss_mb(list(pool._processes) if pool else [])
+
+            def api_query(i):
+                return "POST", "/api/query", {"json": {"text": QUESTIONS[i % len(QUESTIONS)]}}
+
+            def chat(i):
+                body = {"text": QUESTIONS[i % len(QUESTIONS)], "user_id": f"user{i % args.users}", "web_search": args.web}
+                return "POST", "/chat", {"json": body}
+
+            def finalize(i):
+                return "POST", "/finalize", {"params": {"user_id": f"user{i % args.users}"}}
+
+            print("Running /api/query ...")
+            results["api_query"] = await run_load(client, api_query, args.requests, args.concurrency)
+            print("Running /chat ...")
+            results["chat"] = await run_load(client, chat, args.requests, args.concurrency)
+            # First pass summarizes every user's history, the second only what changed since
+            print("Running /finalize ...")
+            results["finalize"] = await run_load(client, finalize, args.users, args.concurrency)
+            results["finalize_repeat"] = await run_load(client, finalize, args.users, args.concurrency)
+
+            stats = (await client.get("/stats")).json()
+            results["context_packing"] = stats.get("context_packing")
+            results["llm_calls"] = fake_llm.calls
+            results["avg_prompt_chars"] = round(fake_llm.prompt_chars / fake_llm.calls) if fake_llm.calls else 0
+    finally:
+        await app.memory_writes.stop()
+        await app.ingest_jobs.stop()
+        await tavily.close()
+        if not args.skip_ingest:
+            rag.vector_store.delete_collection()
+        rag.close()
+
+    results["peak_rss_mb"] = {**results.get("peak_rss_mb", {}), "self": peak_rss_mb()["self"]}
+
+    print()
+    if "ingest" in results:
+        ingest = results["ingest"]
+        print(f"Ingest: {ingest['chunks']} chunks in {ingest['seconds']}s ({ingest['chunks_per_sec']} chunks/sec)")
+        for item in ingest["files"]:
+            print(f"  {item['file']}: {item['chunks']} chunks, {item['chunks_per_sec']} chunks/sec")
+    print(f"{'endpoint':<16} {'requests':>8} {'errors':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>8}")
+    for name in ("api_query", "chat", "finalize", "finalize_repeat"):
+        row = results[name]
+        print(
+            f"{name:<16} {row['requests']:>8} {row['errors']:>6} {row['p50_ms']:>7.1f}ms "
+            f"{row['p95_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms {row['throughput_rps']:>8.2f}"
+        )
+    print(f"Average prompt: {results['avg_prompt_chars']} chars over {results['llm_calls']} LLM calls")
+    print(
+        f"Peak RSS: {results['peak_rss_mb']['self']} MB "
+        f"(largest parse process: {results['peak_rss_mb'].get('parse_process', 0.0)} MB)"
+    )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,160 @@
+"""
+Retrieval latency vs corpus size, with and without the ANN index.
+
+Inserts synthetic unit vectors into a throwaway collection of the same
+table RAGService uses, grows it step by step and, at every size, times
+exact similarity searches (index scans disabled) and indexed searches for
+each storage mode: the ANN index on the full vectors, or on halfvec /
+binary-quantized ones with full-precision rerank (RAG_VECTOR_STORAGE).
+Recall@k is measured against the exact results, and the size of each ANN
+index is reported. The indexes the benchmark builds on the table are
+dropped when it ends, leaving the ones that were already there.
+
+Usage:
+    python bench_retrieval.py --sizes 1000,10000,50000 --queries 200
+    python bench_retrieval.py --storage full,halfvec,binary
+"""
+import os
+import time
+import hashlib
+import argparse
+import numpy as np
+from sqlalchemy import create_engine, event, text
+from langchain_core.embeddings import Embeddings
+from langchain_postgres import PGVector
+from db_pool import postgres_connection_string
+from vector_indexes import VectorIndexManager, STORAGE_MODES
+
+class SeededEmbeddings(Embeddings):
+    """
+    Deterministic unit vectors seeded by a hash of the text. The benchmark
+    passes its vectors to PGVector directly; this only stands in for the
+    embeddings object PGVector requires.
+    """
+    def __init__(self, dims):
+        self.dims = dims
+
+    def embed_query(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        return random_unit_vectors(np.random.default_rng(seed), 1, self.dims)[0].tolist()
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+def random_unit_vectors(rng, n, dims):
+    vectors = rng.standard_normal((n, dims)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def percentile(values, p):
+    return float(np.percentile(values, p)) * 1000
+
+def search(store, index_manager, embedding, k):
+    # Same queries as RAGService._vector_search
+    if index_manager is None or index_manager.storage == "full":
+        return {doc.id for doc in store.similarity_search_by_vector(embedding, k=k)}
+    EmbeddingStore = store.EmbeddingStore
+    with store.session_maker() as session:
+        collection = store.get_collection(session)
+        statement = index_manager.rerank_statement(EmbeddingStore, embedding, k, EmbeddingStore.collection_id == collection.uuid)
+        return {row.id for row in session.execute(statement)}
+
+def time_queries(store, queries, k, index_manager=None):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        ids = search(store, index_manager, query.tolist(), k)
+        latencies.append(time.perf_counter() - started)
+        results.append(ids)
+    return latencies, results
+
+def index_megabytes(engine, name):
+    with engine.connect() as conn:
+        size = conn.execute(text("SELECT pg_relation_size(to_regclass(:name))"), {"name": name}).scalar()
+    return (size or 0) / 2**20
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000", help="Comma-separated corpus sizes")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dims", type=int, default=int(os.getenv("RAG_EMBEDDING_DIM", "768")))
+    parser.add_argument("--batch", type=int, default=1000, help="Rows per insert")
+    parser.add_argument("--storage", default="full", help=f"Comma-separated storage modes ({', '.join(STORAGE_MODES)})")
+    parser.add_argument("--collection", default="bench_retrieval")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    storages = [storage.strip() for storage in args.storage.split(",") if storage.strip()]
+
+    # One engine per storage mode: each sets its own ef_search on its connections
+    indexed = {}
+    for storage in storages:
+        engine = create_engine(postgres_connection_string())
+        indexed[storage] = (engine, VectorIndexManager(engine, dimensions=args.dims, storage=storage))
+    exact_engine = create_engine(postgres_connection_string())
+
+    @event.listens_for(exact_engine, "connect")
+    def disable_index_scans(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("SET enable_indexscan = off")
+        cursor.close()
+        dbapi_connection.commit()
+
+    store_args = dict(embeddings=SeededEmbeddings(args.dims), collection_name=args.collection, embedding_length=args.dims, use_jsonb=True)
+    exact_store = PGVector(connection=exact_engine, pre_delete_collection=True, **store_args)
+    stores = {}
+    # Indexes already on the shared table; the others are the benchmark's own
+    existing = VectorIndexManager(exact_engine, dimensions=args.dims).index_names()
+    try:
+        for storage, (engine, index_manager) in indexed.items():
+            stores[storage] = PGVector(connection=engine, **store_args)
+            index_manager.ensure()
+            if index_manager.storage != storage:
+                raise SystemExit(f"Storage mode {storage} is not available on this server")
+
+        corpus = np.empty((0, args.dims), dtype=np.float32)
+        print(f"{'size':>8} {'storage':>8} {'p50':>10} {'p95':>10} {'recall@k':>9} {'index MB':>9}")
+        for size in sizes:
+            while len(corpus) < size:
+                count = min(args.batch, size - len(corpus))
+                vectors = random_unit_vectors(rng, count, args.dims)
+                start = len(corpus)
+                exact_store.add_embeddings(
+                    texts=[f"bench chunk {start + i}" for i in range(count)],
+                    embeddings=vectors.tolist(),
+                    metadatas=[{"source": "bench"} for _ in range(count)],
+                )
+                corpus = np.vstack([corpus, vectors])
+
+            with exact_engine.connect() as conn:
+                conn.exec_driver_sql("ANALYZE langchain_pg_embedding")
+                conn.commit()
+
+            # Queries are perturbed corpus points, so every query has true neighbours
+            picks = corpus[rng.integers(0, len(corpus), args.queries)]
+            queries = picks + 0.05 * random_unit_vectors(rng, args.queries, args.dims)
+
+            exact_latencies, exact_results = time_queries(exact_store, queries, args.k)
+            print(
+                f"{size:>8} {'exact':>8} {percentile(exact_latencies, 50):>8.2f}ms "
+                f"{percentile(exact_latencies, 95):>8.2f}ms {1.0:>9.3f} {'-':>9}"
+            )
+            for storage, (engine, index_manager) in indexed.items():
+                latencies, results = time_queries(stores[storage], queries, args.k, index_manager)
+                recall = np.mean([len(got & truth) / args.k for got, truth in zip(results, exact_results)])
+                print(
+                    f"{size:>8} {storage:>8} {percentile(latencies, 50):>8.2f}ms {percentile(latencies, 95):>8.2f}ms "
+                    f"{recall:>9.3f} {index_megabytes(engine, index_manager.ann_index_name):>9.2f}"
+                )
+    finally:
+        exact_store.delete_collection()
+        for engine, index_manager in indexed.values():
+            created = index_manager.index_names() - existing
+            if created:
+                print(f"Dropping benchmark indexes: {', '.join(sorted(created))}")
+                index_manager.drop(sorted(created))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import os
+import re
+from langchain.docstore.document import Document
+from llm_scheduler import estimate_tokens
+
+class ContextPacker:
+    """
+    Builds the prompt context from the retrieved candidates under a token
+    budget. Candidates are picked MMR-style (relevance by retrieval rank,
+    penalized by similarity to what was already picked); near-duplicates are
+    dropped, text a picked chunk already contains at its edges (the splitter's
+    chunk overlap) is cut, and the last chunk that doesn't fit is truncated.
+    """
+    def __init__(self, budget_tokens: int = None, candidates: int = None):
+        self.enabled = os.getenv("RAG_CONTEXT_PACKING", "true").lower() not in ("0", "false", "no")
+        self.budget_tokens = budget_tokens or int(os.getenv("RAG_CONTEXT_TOKEN_BUDGET", "1200"))
+        self.candidates = candidates or int(os.getenv("RAG_CONTEXT_CANDIDATES", "20"))
+        # Weight of relevance vs. novelty when picking the next chunk
+        self.mmr_lambda = float(os.getenv("RAG_MMR_LAMBDA", "0.7"))
+        # Chunks more similar than this to a picked one are dropped
+        self.duplicate_threshold = float(os.getenv("RAG_DUPLICATE_THRESHOLD", "0.8"))
+        self.min_overlap_chars = 40
+        self.max_overlap_chars = 400
+        self.min_chunk_tokens = 50
+
+        self.packed = 0
+        self.tokens_candidates = 0
+        self.tokens_baseline = 0
+        self.tokens_packed = 0
+        self.duplicates_dropped = 0
+        self.overlap_chars_cut = 0
+
+    @staticmethod
+    def _shingles(text: str, size: int = 3) -> set:
+        words = re.findall(r"\w+", text.lower())
+        if len(words) < size:
+            return {" ".join(words)}
+        return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+    @staticmethod
+    def _similarity(a: set, b: set) -> float:
+        if not a or not b:
+            return 0.0
+        return len(a & b) / len(a | b)
+
+    def _cut_overlap(self, text: str, picked: list) -> str:
+        """
+        Removes a prefix (or suffix) of text that a picked chunk ends (or
+        starts) with.
+        """
+        for other in picked:
+            limit = min(len(text), len(other), self.max_overlap_chars)
+            for size in range(limit, self.min_overlap_chars - 1, -1):
+                if other.endswith(text[:size]):
+                    self.overlap_chars_cut += size
+                    text = text[size:].lstrip()
+                    break
+            limit = min(len(text), len(other), self.max_overlap_chars)
+            for size in range(limit, self.min_overlap_chars - 1, -1):
+                if other.startswith(text[-size:]):
+                    self.overlap_chars_cut += size
+                    text = text[:-size].rstrip()
+                    break
+        return text
+
+    def pack(self, documents: list, top_k: int) -> tuple:
+        """
+        documents are ranked candidates. Returns (packed documents, stats);
+        stats compares against pasting the top_k candidates verbatim.
+        """
+        candidate_tokens = [estimate_tokens(doc.page_content) for doc in documents]
+        baseline = sum(candidate_tokens[:top_k])
+
+        shingles = [self._shingles(doc.page_content) for doc in documents]
+        relevance = [1.0 - rank / max(len(documents), 1) for rank in range(len(documents))]
+        remaining = list(range(len(documents)))
+        picked, picked_texts, packed = [], [], []
+        budget = self.budget_tokens
+        duplicates = 0
+
+        while remaining and budget >= self.min_chunk_tokens:
+            def score(i):
+                novelty_penalty = max((self._similarity(shingles[i], shingles[j]) for j in picked), default=0.0)
+                return self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * novelty_penalty
+
+            best = max(remaining, key=score)
+            remaining.remove(best)
+            if any(self._similarity(shingles[best], shingles[j]) >= self.duplicate_threshold for j in picked):
+                duplicates += 1
+                continue
+
+            text = self._cut_overlap(documents[best].page_content, picked_texts)
+            tokens = estimate_tokens(text)
+            if tokens > budget:
+                # ~4 characters per token, as in estimate_tokens
+                text = text[:(budget - 1) * 4].rsplit(" ", 1)[0] + "..."
+                tokens = estimate_tokens(text)
+            if not text.strip():
+                duplicates += 1
+                continue
+
+            picked.append(best)
+            picked_texts.append(documents[best].page_content)
+            packed.append(Document(id=documents[best].id, page_content=text, metadata=documents[best].metadata))
+            budget -= tokens
+
+        packed_tokens = sum(estimate_tokens(doc.page_content) for doc in packed)
+        self.packed += 1
+        self.tokens_candidates += sum(candidate_tokens)
+        self.tokens_baseline += baseline
+        self.tokens_packed += packed_tokens
+        self.duplicates_dropped += duplicates
+        return packed, {
+            "candidates": len(documents),
+            "chunks": len(packed),
+            "duplicates_dropped": duplicates,
+            "tokens": packed_tokens,
+            "tokens_saved": baseline - packed_tokens,
+        }
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "budget_tokens": self.budget_tokens,
+            "queries": self.packed,
+            "tokens_candidates": self.tokens_candidates,
+            "tokens_top_k": self.tokens_baseline,
+            "tokens_packed": self.tokens_packed,
+            "tokens_saved": self.tokens_baseline - self.tokens_packed,
+            "duplicates_dropped": self.duplicates_dropped,
+            "overlap_chars_cut": self.overlap_chars_cut,
+        }
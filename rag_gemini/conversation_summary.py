@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import threading
+import weakref
+from llm_scheduler import llm_priority, PRIORITY_BACKGROUND
+
+# Bump when the prompt or schema changes: stored summaries of an older
+# format are rebuilt from scratch.
+SUMMARY_FORMAT = 1
+
+SUMMARY_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "resumen_conversacion": {"type": "string"},
+        "puntos_importantes": {"type": "array", "items": {"type": "string"}},
+        "pasos_desarrollo": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "descripcion": {"type": "string"},
+                    "completado": {"type": "boolean"},
+                },
+                "required": ["descripcion", "completado"],
+            },
+        },
+    },
+    "required": ["resumen_conversacion", "puntos_importantes", "pasos_desarrollo"],
+}
+
+SUMMARY_INSTRUCTIONS = """You maintain a running summary of a user's conversation with an assistant, in Spanish.
+You receive the current summary (empty the first time) and the memories extracted from the conversation since it was written.
+Return the updated summary: merge the new information, drop what the removed memories invalidate, and keep the important points and next steps up to date.
+'completado' is always boolean false."""
+
+class ConversationSummarizer:
+    """
+    Keeps a rolling per-user summary of the conversation for /finalize.
+    Each summary is stored with the memories it covers; an update only
+    sends the previous summary plus the memories added, changed or removed
+    since, so the prompt doesn't grow with the conversation. Large deltas
+    are folded in several steps of at most max_delta_chars.
+    """
+    def __init__(self, memory_service, gemini_client, path: str = None, model_name: str = "gemini-2.5-flash"):
+        self.memory_service = memory_service
+        self.gemini_client = gemini_client
+        self.model_name = model_name
+        self.path = path or os.getenv("SUMMARY_STORE_PATH", "./rag_storage/conversation_summaries.sqlite3")
+        self.max_delta_chars = int(os.getenv("SUMMARY_MAX_DELTA_CHARS", "20000"))
+        # Memories fetched per get_all; raised until a user's list isn't cut off
+        self.memory_limit = int(os.getenv("SUMMARY_MEMORY_LIMIT", "1000"))
+
+        self._lock = threading.Lock()
+        # A user's lock lives only while a summarize() holds or waits for it
+        self._user_locks = weakref.WeakValueDictionary()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS summaries ("
+            "user_id TEXT PRIMARY KEY, format INTEGER, version INTEGER, "
+            "memories TEXT, summary TEXT, updated_at REAL)"
+        )
+        self._db.commit()
+
+        self.hits = 0
+        self.updates = 0
+        self.memories_sent = 0
+
+    def _load(self, user_id: str):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT version, memories, summary FROM summaries WHERE user_id = ? AND format = ?",
+                (user_id, SUMMARY_FORMAT),
+            ).fetchone()
+        if not row:
+            return None
+        return {"version": row[0], "memories": json.loads(row[1]), "summary": json.loads(row[2])}
+
+    def _save(self, user_id: str, version: int, memories: dict, summary: dict):
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?, ?, ?, ?)",
+                (user_id, SUMMARY_FORMAT, version, json.dumps(memories, ensure_ascii=False),
+                 json.dumps(summary, ensure_ascii=False), time.time()),
+            )
+            self._db.commit()
+
+    def _user_lock(self, user_id: str) -> asyncio.Lock:
+        lock = self._user_locks.get(user_id)
+        if lock is None:
+            lock = self._user_locks[user_id] = asyncio.Lock()
+        return lock
+
+    async def _all_memories(self, user_id: str) -> list:
+        """
+        Every memory of user_id. Mem0 can't page and returns at most limit
+        memories in no fixed order, so a truncated list (which would make
+        memories look removed and re-added between calls) is fetched again
+        with a larger limit.
+        """
+        limit = self.memory_limit
+        while True:
+            memories = await asyncio.to_thread(self.memory_service.get_all, user_id=user_id, limit=limit)
+            if isinstance(memories, dict):
+                memories = memories.get("results", [])
+            if len(memories) < limit:
+                return memories
+            limit *= 2
+
+    def _delta_steps(self, added: list, removed: list) -> list:
+        """
+        Splits the delta into steps that fit max_delta_chars.
+        Removed memories go in the first step.
+        """
+        steps, current, size = [], {"added": [], "removed": list(removed)}, sum(len(text) for text in removed)
+        for text in added:
+            if current["added"] and size + len(text) > self.max_delta_chars:
+                steps.append(current)
+                current, size = {"added": [], "removed": []}, 0
+            current["added"].append(text)
+            size += len(text)
+        steps.append(current)
+        return steps
+
+    @staticmethod
+    def _build_prompt(summary: dict, added: list, removed: list) -> str:
+        sections = [f"Current summary:\n{json.dumps(summary, ensure_ascii=False) if summary else '(none)'}"]
+        if added:
+            sections.append("New memories:\n" + "\n".join(f"- {text}" for text in added))
+        if removed:
+            sections.append("Removed memories:\n" + "\n".join(f"- {text}" for text in removed))
+        return "\n\n".join(sections)
+
+    async def summarize(self, user_id: str) -> dict:
+        """
+        Returns the up-to-date summary of user_id, updating it with the
+        memories that changed since it was last stored. The result carries the
+        summary version.
+        """
+        async with self._user_lock(user_id):
+            memories = await self._all_memories(user_id)
+            current = {str(m.get("id", m["memory"])): m["memory"] for m in memories}
+
+            stored = await asyncio.to_thread(self._load, user_id)
+            previous = stored["memories"] if stored else {}
+            summary = stored["summary"] if stored else None
+            version = stored["version"] if stored else 0
+
+            added = [text for key, text in current.items() if previous.get(key) != text]
+            removed = [text for key, text in previous.items() if current.get(key) != text]
+            if stored and not added and not removed:
+                self.hits += 1
+                return {**summary, "version": version}
+
+            for step in self._delta_steps(added, removed):
+                prompt = self._build_prompt(summary, step["added"], step["removed"])
+                with llm_priority(PRIORITY_BACKGROUND):
+                    response_text = await self.gemini_client.generate_content(
+                        model_name=self.model_name,
+                        prompt=prompt,
+                        system_prompt=SUMMARY_INSTRUCTIONS,
+                        generation_config={"response_mime_type": "application/json", "response_schema": SUMMARY_SCHEMA},
+                    )
+                try:
+                    summary = json.loads(response_text)
+                except json.JSONDecodeError:
+                    return {"error": "Could not parse JSON", "raw_response": response_text}
+                self.memories_sent += len(step["added"]) + len(step["removed"])
+
+            version += 1
+            self.updates += 1
+            await asyncio.to_thread(self._save, user_id, version, current, summary)
+            return {**summary, "version": version}
+
+    async def refresh(self, user_id: str):
+        # Background update after new memories were written; errors are only logged
+        try:
+            await self.summarize(user_id)
+        except Exception as e:
+            print(f"Failed to refresh conversation summary for {user_id}: {e}")
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "updates": self.updates, "memories_sent": self.memories_sent}
@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, exc
+from sqlalchemy.pool import QueuePool
+
+def postgres_connection_string() -> str:
+    host = os.getenv("POSTGRES_HOST", "localhost")
+    port = os.getenv("POSTGRES_PORT", "5432")
+    user = os.getenv("POSTGRES_USER", "rag_user")
+    password = os.getenv("POSTGRES_PASSWORD", "rag_password")
+    dbname = os.getenv("POSTGRES_DATABASE", "rag_db")
+
+    # psycopg 3: the driver Mem0's pgvector store expects for borrowed connections
+    return f"postgresql+psycopg://{user}:{password}@{host}:{port}/{dbname}"
+
+class MonitoredQueuePool(QueuePool):
+    """
+    QueuePool that records how long checkouts wait for a free connection,
+    how many threads are waiting and how many gave up after pool_timeout.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        with self._stats_lock:
+            self.waiting += 1
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.wait_seconds_total += waited
+                self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+class Mem0ConnectionPool:
+    """
+    Lends connections of the shared pool to Mem0's pgvector store, which
+    takes a psycopg_pool-style object (connection(), or getconn/putconn for
+    psycopg2). Closing is left to the engine.
+    """
+    def __init__(self, engine):
+        self.engine = engine
+
+    @contextmanager
+    def connection(self):
+        connection = self.engine.raw_connection()
+        try:
+            yield connection.driver_connection
+        finally:
+            connection.close()
+
+    def getconn(self):
+        return self.engine.raw_connection()
+
+    def putconn(self, connection):
+        connection.close()
+
+    def close(self):
+        pass
+
+    def closeall(self):
+        pass
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    """
+    Process-wide SQLAlchemy engine, and so connection pool, shared by
+    retrieval, ingestion and Mem0. Blocking calls on it run on the services'
+    thread pools; at most pool_size + max_overflow connections are opened and
+    a checkout waits up to pool_timeout seconds for one to free up.
+    """
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            statement_timeout_ms = int(float(os.getenv("DB_STATEMENT_TIMEOUT", "30")) * 1000)
+            _engine = create_engine(
+                postgres_connection_string(),
+                poolclass=MonitoredQueuePool,
+                pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+                max_overflow=int(os.getenv("DB_POOL_MAX_OVERFLOW", "5")),
+                pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "10")),
+                pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+                connect_args={"options": f"-c statement_timeout={statement_timeout_ms}"},
+            )
+        return _engine
+
+def pool_stats() -> dict:
+    if _engine is None:
+        return {}
+    pool = _engine.pool
+    return {
+        "size": pool.size(),
+        "max_overflow": pool._max_overflow,
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "overflow": max(pool.overflow(), 0),
+        "waiting": pool.waiting,
+        "checkouts": pool.checkouts,
+        "wait_seconds_total": round(pool.wait_seconds_total, 3),
+        "wait_seconds_max": round(pool.wait_seconds_max, 3),
+        "timeouts": pool.timeouts,
+    }
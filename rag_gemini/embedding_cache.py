@@ -0,0 +1,178 @@
+import os
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+class EmbeddingCache:
+    """
+    Bounded LRU cache of embedding vectors keyed by (model, task_type, normalized text).
+    If a path is given, vectors are also persisted to a SQLite file so they
+    survive restarts. Safe to use from executor threads.
+    """
+    def __init__(self, max_entries: int = None, path: str = None):
+        self.max_entries = max_entries or int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "10000"))
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (model TEXT, task_type TEXT, text TEXT, vector BLOB, "
+                "PRIMARY KEY (model, task_type, text))"
+            )
+            self._db.commit()
+
+    @staticmethod
+    def make_key(model: str, task_type: str, text: str) -> tuple:
+        normalized = " ".join(unicodedata.normalize("NFC", text).split())
+        return (model, task_type or "default", normalized)
+
+    def get(self, model: str, task_type: str, text: str):
+        key = self.make_key(model, task_type, text)
+        with self._lock:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vector FROM embeddings WHERE model = ? AND task_type = ? AND text = ?", key
+                ).fetchone()
+                if row:
+                    vector = np.frombuffer(row[0], dtype=np.float32).tolist()
+                    self._store(key, vector)
+                    self.disk_hits += 1
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model: str, task_type: str, text: str, vector: list):
+        self.put_many(model, task_type, [text], [vector])
+
+    def put_many(self, model: str, task_type: str, texts: list, vectors: list):
+        rows = []
+        with self._lock:
+            for text, vector in zip(texts, vectors):
+                key = self.make_key(model, task_type, text)
+                vector = list(vector)
+                self._store(key, vector)
+                rows.append(key + (np.asarray(vector, dtype=np.float32).tobytes(),))
+            if self._db is not None:
+                self._db.executemany("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?)", rows)
+                self._db.commit()
+
+    def _store(self, key: tuple, vector: list):
+        self._entries[key] = vector
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def embed_many(self, model: str, task_type: str, texts: list, embed_fn) -> list:
+        """
+        Returns vectors for texts, calling embed_fn(list_of_texts) only for the
+        ones not cached yet (duplicates within texts are embedded once).
+        """
+        vectors = [self.get(model, task_type, text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, embed_fn(missing)))
+            self.put_many(model, task_type, list(computed), list(computed.values()))
+            vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    async def aembed_many(self, model: str, task_type: str, texts: list, embed_fn) -> list:
+        """
+        Async variant of embed_many; embed_fn is a coroutine function.
+        """
+        vectors = [self.get(model, task_type, text) for text in texts]
+        missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+        if missing:
+            computed = dict(zip(missing, await embed_fn(missing)))
+            self.put_many(model, task_type, list(computed), list(computed.values()))
+            vectors = [vector if vector is not None else computed[text] for text, vector in zip(texts, vectors)]
+        return vectors
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "persistent": self._db is not None,
+        }
+
+_shared_cache = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    """
+    Process-wide cache shared by RAGService, MemoryService and GeminiClient.
+    Set EMBEDDING_CACHE_PATH to persist it on disk.
+    """
+    global _shared_cache
+    if _shared_cache is None:
+        _shared_cache = EmbeddingCache(path=os.getenv("EMBEDDING_CACHE_PATH") or None)
+    return _shared_cache
+
+class CachedEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that goes through the shared cache.
+    Task types follow what GoogleGenerativeAIEmbeddings sends for each method.
+    """
+    def __init__(self, embeddings: Embeddings, model: str, cache: EmbeddingCache = None):
+        self.embeddings = embeddings
+        self.model = model
+        self.cache = cache or get_embedding_cache()
+
+    def embed_query(self, text: str) -> list:
+        vector = self.cache.get(self.model, "retrieval_query", text)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put(self.model, "retrieval_query", text, vector)
+        return vector
+
+    def embed_documents(self, texts: list) -> list:
+        return self.cache.embed_many(self.model, "retrieval_document", texts, self.embeddings.embed_documents)
+
+    def embed_queries(self, texts: list) -> list:
+        # Several queries in one batched call instead of one embed_query each
+        return self.cache.embed_many(self.model, "retrieval_query", texts, self.embeddings.embed_queries)
+
+class CachedMem0Embedder:
+    """
+    Wraps a Mem0 embedder (embed / embed_batch) with the shared cache.
+    Mem0's Gemini embedder sends no task type, so its entries use the default one.
+    """
+    def __init__(self, embedder, model: str, cache: EmbeddingCache = None):
+        self.embedder = embedder
+        self.model = model
+        self.cache = cache or get_embedding_cache()
+        self.config = getattr(embedder, "config", None)
+
+    def embed(self, text, memory_action=None):
+        vector = self.cache.get(self.model, None, text)
+        if vector is None:
+            vector = self.embedder.embed(text, memory_action)
+            self.cache.put(self.model, None, text, vector)
+        return vector
+
+    def embed_batch(self, texts, memory_action="add"):
+        if hasattr(self.embedder, "embed_batch"):
+            embed_fn = lambda missing: self.embedder.embed_batch(missing, memory_action)
+        else:
+            embed_fn = lambda missing: [self.embedder.embed(text, memory_action) for text in missing]
+        return self.cache.embed_many(self.model, None, texts, embed_fn)
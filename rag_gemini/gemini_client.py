@@ -1,6 +1,11 @@
 import os
+import asyncio
+from collections import OrderedDict
 import google.generativeai as genai
 from google.generativeai.types import HarmCategory, HarmBlockThreshold
+from embedding_cache import get_embedding_cache
+from llm_scheduler import get_scheduler, estimate_tokens, OUTPUT_TOKEN_ESTIMATE
+from metrics import metrics
 
 class GeminiClient:
     def __init__(self, api_key: str = None):
@@ -9,6 +14,16 @@ class GeminiClient:
             raise ValueError("GEMINI_API_KEY is not set")
         
         genai.configure(api_key=self.api_key)
+        self.embedding_cache = get_embedding_cache()
+        # batchEmbedContents accepts at most 100 texts per request
+        self.embed_batch_size = int(os.getenv("GEMINI_EMBED_BATCH_SIZE", "100"))
+        self.embed_concurrency = int(os.getenv("GEMINI_EMBED_CONCURRENCY", "4"))
+        self.generation_scheduler = get_scheduler("generation")
+        self.embedding_scheduler = get_scheduler("embedding")
+        # (model_name, system_prompt) -> GenerativeModel, LRU: system prompts
+        # come from callers, so only the most recent few are kept
+        self._models = OrderedDict()
+        self.model_cache_size = int(os.getenv("GEMINI_MODEL_CACHE_SIZE", "8"))
         
         # Default safety settings
         self.safety_settings = {
@@ -18,44 +33,89 @@ class GeminiClient:
             HarmCategory.HARM_CATEGORY_DANGEROUS_CONTENT: HarmBlockThreshold.BLOCK_NONE,
         }
 
+    def _model(self, model_name: str, system_prompt: str = None):
+        key = (model_name, system_prompt)
+        model = self._models.get(key)
+        if model is not None:
+            self._models.move_to_end(key)
+            return model
+        model = genai.GenerativeModel(
+            model_name,
+            system_instruction=system_prompt,
+            safety_settings=self.safety_settings,
+        )
+        self._models[key] = model
+        while len(self._models) > self.model_cache_size:
+            self._models.popitem(last=False)
+        return model
+
+    @staticmethod
+    def _convert_history(history_messages: list) -> tuple:
+        """
+        Converts OpenAI-style {"role", "content"} messages to Gemini contents.
+        System messages can't be turns in Gemini; they are returned separately
+        to be used as system instruction.
+        """
+        contents, system_parts = [], []
+        for message in history_messages or []:
+            role, content = message.get("role", "user"), message.get("content", "")
+            if role == "system":
+                system_parts.append(content)
+            else:
+                contents.append({"role": "model" if role in ("assistant", "model") else "user", "parts": [content]})
+        return contents, system_parts
+
     async def generate_content(self, model_name: str, prompt: str, system_prompt: str = None, history_messages: list = None, **kwargs):
         """
         Generates content using the specified Gemini model.
         Adapts to the interface expected by RAGAnything/LightRAG.
+        history_messages is a list of {"role": "user"|"assistant"|"system", "content": str}.
         """
-        model = genai.GenerativeModel(model_name)
-        
-        messages = []
-        if system_prompt:
-            # Gemini doesn't have a strict 'system' role in the same way as OpenAI in chat history,
-            # but we can prepend it or use system_instruction if supported by the model version.
-            # For simplicity and broad compatibility, we'll prepend to the prompt or use system_instruction.
-             model = genai.GenerativeModel(model_name, system_instruction=system_prompt)
-
-        chat = model.start_chat(history=[])
-        
-        # Convert history_messages if needed, but for RAG usually we just need the prompt
-        # If history is provided, we might need to adapt it.
-        
+        contents, system_parts = self._convert_history(history_messages)
+        if system_parts:
+            system_prompt = "\n\n".join(([system_prompt] if system_prompt else []) + system_parts)
+        contents.append({"role": "user", "parts": [prompt]})
+
+        model = self._model(model_name, system_prompt)
         try:
-            response = await chat.send_message_async(prompt, safety_settings=self.safety_settings, **kwargs)
+            tokens = estimate_tokens([system_prompt or "", prompt]) + OUTPUT_TOKEN_ESTIMATE
+            tokens += estimate_tokens([message.get("content", "") for message in history_messages or []])
+            with metrics.span("gemini_generate"):
+                response = await self.generation_scheduler.run(model.generate_content_async, contents, tokens=tokens, **kwargs)
+            usage = getattr(response, "usage_metadata", None)
+            if usage:
+                metrics.count_tokens("gemini_client", usage.prompt_token_count, usage.candidates_token_count)
+            else:
+                metrics.count_tokens("gemini_client", tokens - OUTPUT_TOKEN_ESTIMATE, estimate_tokens(response.text))
             return response.text
         except Exception as e:
             print(f"Error generating content with Gemini: {e}")
             raise
 
-    async def embed_content(self, model_name: str, texts: list[str]):
+    async def embed_content(self, model_name: str, texts: list[str], task_type: str = "retrieval_document"):
         """
-        Generates embeddings for a list of texts.
+        Generates embeddings for a list of texts. Use task_type="retrieval_query"
+        for search queries. Uncached texts are sent in API-sized batches,
+        a few batches at a time.
         """
-        try:
-            # Gemini embedding model usually 'models/text-embedding-004' or similar
-            result = genai.embed_content(
-                model=model_name,
-                content=texts,
-                task_type="retrieval_document" # or retrieval_query depending on usage
-            )
+        semaphore = asyncio.Semaphore(self.embed_concurrency)
+
+        async def embed_batch(batch):
+            async with semaphore:
+                result = await self.embedding_scheduler.run(
+                    genai.embed_content_async,
+                    model=model_name, content=batch, task_type=task_type, tokens=estimate_tokens(batch),
+                )
             return result['embedding']
+
+        async def embed(missing):
+            batches = [missing[i:i + self.embed_batch_size] for i in range(0, len(missing), self.embed_batch_size)]
+            results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+            return [vector for batch_vectors in results for vector in batch_vectors]
+
+        try:
+            with metrics.span("gemini_embed"):
+                return await self.embedding_cache.aembed_many(model_name, task_type, texts, embed)
         except Exception as e:
             print(f"Error embedding content with Gemini: {e}")
             raise
@@ -1,14 +1,95 @@
 import os
-import requests
 import sys
+import json
+import time
+import argparse
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+class Manifest:
+    """
+    Tracks the state of every file of a folder upload in a JSON file, so an
+    interrupted run can be resumed. A file is considered done only while its
+    size and mtime match what was recorded.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def _signature(file_path):
+        stat = os.stat(file_path)
+        return {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    def state(self, file_path):
+        """
+        Recorded entry for file_path, or None if the file changed since.
+        """
+        entry = self.entries.get(file_path)
+        if entry and all(entry.get(k) == v for k, v in self._signature(file_path).items()):
+            return entry
+        return None
+
+    def update(self, file_path, **fields):
+        with self._lock:
+            entry = self.entries.setdefault(file_path, {})
+            entry.update(self._signature(file_path))
+            entry.update(fields)
+            self._save()
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
 
-def ingest_folder(folder_path, api_url="http://localhost:8005/ingest"):
+def make_session(workers):
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=None)
+    adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def upload_batch(session, api_url, file_paths, folder_path):
+    handles = [open(file_path, "rb") for file_path in file_paths]
+    try:
+        # The path relative to the folder is the document's key on the server,
+        # so files with the same name in different subfolders don't collide
+        files = [
+            ("files", (os.path.relpath(path, folder_path).replace(os.sep, "/"), handle))
+            for path, handle in zip(file_paths, handles)
+        ]
+        response = session.post(f"{api_url}/ingest/batch", files=files)
+    finally:
+        for handle in handles:
+            handle.close()
+    response.raise_for_status()
+    return response.json()["jobs"]
+
+def wait_for_job(session, api_url, job_id, poll_interval=2.0):
+    while True:
+        response = session.get(f"{api_url}/ingest/{job_id}")
+        response.raise_for_status()
+        job = response.json()
+        if job["state"] in ("completed", "failed"):
+            return job
+        time.sleep(poll_interval)
+
+def ingest_folder(folder_path, api_url="http://localhost:8005", workers=4, batch_size=1, manifest_path=None, wait=True):
     if not os.path.exists(folder_path):
         print(f"Error: Folder '{folder_path}' does not exist.")
         return
 
     print(f"Scanning folder: {folder_path}")
-    
+
     files_to_ingest = []
     for root, dirs, files in os.walk(folder_path):
         for file in files:
@@ -17,25 +98,100 @@ def ingest_folder(folder_path, api_url="http://localhost:8005/ingest"):
                 continue
             files_to_ingest.append(os.path.join(root, file))
 
-    print(f"Found {len(files_to_ingest)} files.")
-
+    manifest = Manifest(manifest_path or os.path.join(folder_path, ".ingest_manifest.json"))
+    to_upload, to_track = [], []
     for file_path in files_to_ingest:
-        print(f"Ingesting: {file_path}...")
+        entry = manifest.state(file_path)
+        if entry and entry.get("state") == "done":
+            continue
+        if entry and entry.get("state") == "uploaded" and wait:
+            # Uploaded by an interrupted run: follow the existing job instead of re-sending
+            to_track.append((file_path, entry["job_id"]))
+        else:
+            to_upload.append(file_path)
+    print(f"Found {len(files_to_ingest)} files, {len(to_upload)} to upload, {len(to_track)} already uploaded.")
+
+    api_url = api_url.rstrip("/")
+    session = make_session(workers)
+    batches = [to_upload[i:i + batch_size] for i in range(0, len(to_upload), batch_size)]
+    started = time.perf_counter()
+
+    # track() and process() return how many files failed; they run on worker
+    # threads, so the total is summed from the futures instead of shared state
+    def track(file_path, job_id):
         try:
-            with open(file_path, 'rb') as f:
-                response = requests.post(api_url, files={'file': f})
-                
-            if response.status_code == 200:
-                print(f"✅ Success: {file_path}")
-            else:
-                print(f"❌ Failed: {file_path} - {response.status_code} - {response.text}")
+            job = wait_for_job(session, api_url, job_id)
+        except requests.HTTPError as e:
+            if e.response is not None and e.response.status_code == 404:
+                # The server forgot the job (e.g. it restarted): upload again
+                return process([file_path])
+            manifest.update(file_path, state="failed", error=str(e))
+            print(f"❌ Error waiting for {file_path}: {e}")
+            return 1
         except Exception as e:
-            print(f"❌ Error ingesting {file_path}: {e}")
+            manifest.update(file_path, state="failed", error=str(e))
+            print(f"❌ Error waiting for {file_path}: {e}")
+            return 1
+
+        if job["state"] == "completed":
+            manifest.update(file_path, state="done")
+            print(f"✅ Success: {file_path}")
+            return 0
+        manifest.update(file_path, state="failed", error=job["error"])
+        print(f"❌ Failed: {file_path} - {job['error']}")
+        return 1
+
+    def process(batch):
+        try:
+            jobs = upload_batch(session, api_url, batch, folder_path)
+        except Exception as e:
+            for file_path in batch:
+                manifest.update(file_path, state="failed", error=str(e))
+                print(f"❌ Error uploading {file_path}: {e}")
+            return len(batch)
+
+        failed = 0
+        for file_path, job in zip(batch, jobs):
+            if job["state"] == "failed":
+                # The server couldn't store this file; the rest of the batch is queued
+                manifest.update(file_path, state="failed", error=job["error"])
+                print(f"❌ Error uploading {file_path}: {job['error']}")
+                failed += 1
+                continue
+            manifest.update(file_path, state="uploaded", job_id=job["job_id"], error=None)
+            if wait:
+                failed += track(file_path, job["job_id"])
+            else:
+                print(f"⏫ Queued: {file_path} (job {job['job_id']})")
+        return failed
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(process, batch) for batch in batches]
+        futures += [executor.submit(track, file_path, job_id) for file_path, job_id in to_track]
+        failed = sum(future.result() for future in as_completed(futures))
+
+    elapsed = time.perf_counter() - started
+    print(f"Processed {len(to_upload) + len(to_track)} files in {elapsed:.1f}s ({failed} failed).")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python ingest_folder.py <folder_path>")
+    parser = argparse.ArgumentParser(description="Upload every file of a folder to the RAG /ingest API.")
+    parser.add_argument("folder_path")
+    parser.add_argument("--api-url", default="http://localhost:8005")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent uploads")
+    parser.add_argument("--batch-size", type=int, default=1, help="Files sent per /ingest/batch request")
+    parser.add_argument("--manifest", default=None, help="Manifest path (default: <folder>/.ingest_manifest.json)")
+    parser.add_argument("--no-wait", action="store_true", help="Don't wait for the ingestion jobs to finish")
+    args = parser.parse_args()
+
+    if args.workers < 1 or args.batch_size < 1:
+        print("--workers and --batch-size must be at least 1")
         sys.exit(1)
-    
-    folder = sys.argv[1]
-    ingest_folder(folder)
+
+    ingest_folder(
+        args.folder_path,
+        api_url=args.api_url,
+        workers=args.workers,
+        batch_size=args.batch_size,
+        manifest_path=args.manifest,
+        wait=not args.no_wait,
+    )
@@ -0,0 +1,181 @@
+import os
+import time
+import uuid
+import asyncio
+import posixpath
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from llm_scheduler import set_llm_priority, PRIORITY_BULK
+
+def normalize_source(name: str) -> str:
+    """
+    Key a document is stored under: the client's path relative to the folder
+    it uploads from ("a/Decreto.pdf"), with forward slashes and without
+    leading "/" or ".." parts. Files with the same base name in different
+    folders stay separate documents.
+    """
+    parts = [part for part in posixpath.normpath(name.replace("\\", "/")).split("/") if part not in ("", ".", "..")]
+    return "/".join(parts)
+
+class IngestJob:
+    def __init__(self, job_id: str, filename: str, file_path: str, source: str = None):
+        self.job_id = job_id
+        self.filename = filename
+        self.file_path = file_path
+        self.source = source or filename
+        self.state = "queued"
+        self.error = None
+        self.chunks_done = 0
+        self.chunks_total = None
+        self.stats = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.done = asyncio.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "source": self.source,
+            "state": self.state,
+            "error": self.error,
+            "chunks_done": self.chunks_done,
+            "chunks_total": self.chunks_total,
+            "stats": self.stats,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds_queued": round((self.started_at or time.time()) - self.created_at, 3),
+        }
+
+class IngestJobManager:
+    """
+    Runs ingestion in the background: /ingest stores the upload, creates a job
+    and returns right away, and a small pool of asyncio workers processes the
+    queue. PDF/DOCX parsing goes to a process pool so it doesn't hold the GIL
+    of the API process. Jobs for the same source run one after the other:
+    incremental ingestion diffs against the stored chunks and deletes the
+    stale ones, which two concurrent runs would do on each other's data.
+    """
+    def __init__(self, rag_service, upload_dir: str, workers: int = None, parse_processes: int = None, history: int = None):
+        self.rag_service = rag_service
+        self.upload_dir = upload_dir
+        self.workers = workers or int(os.getenv("INGEST_WORKERS", "2"))
+        self.parse_processes = parse_processes or int(os.getenv("INGEST_PARSE_PROCESSES", "2"))
+        self.history = history or int(os.getenv("INGEST_JOB_HISTORY", "1000"))
+
+        self.jobs = OrderedDict()
+        self.queue = asyncio.Queue()
+        # source -> [lock, jobs holding or waiting for it]
+        self._source_locks = {}
+        self._tasks = []
+        self._process_pool = None
+
+    async def start(self):
+        os.makedirs(self.upload_dir, exist_ok=True)
+        # spawn: the API process runs thread pools, which don't survive fork well
+        self._process_pool = ProcessPoolExecutor(
+            max_workers=self.parse_processes,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._process_pool:
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+            self._process_pool = None
+
+    def create_job(self, filename: str, source: str = None) -> IngestJob:
+        """
+        Creates a job and the path its upload should be written to.
+        Call enqueue() once the file is on disk. The document is stored
+        under source if given, else under the (relative) filename.
+        """
+        job_id = uuid.uuid4().hex
+        safe_name = os.path.basename(filename.replace("\\", "/"))
+        source = normalize_source(source or filename) or safe_name
+        job = IngestJob(job_id, safe_name, os.path.join(self.upload_dir, f"{job_id}_{safe_name}"), source=source)
+        self.jobs[job_id] = job
+        self._prune()
+        return job
+
+    def enqueue(self, job: IngestJob):
+        self.queue.put_nowait(job)
+
+    def fail(self, job: IngestJob, error: str):
+        """
+        Finishes a job that never reached the queue (e.g. its upload could
+        not be stored), so it doesn't stay "queued" forever.
+        """
+        job.state = "failed"
+        job.error = error
+        job.finished_at = time.time()
+        job.done.set()
+        if os.path.exists(job.file_path):
+            os.remove(job.file_path)
+
+    def get(self, job_id: str):
+        return self.jobs.get(job_id)
+
+    def _prune(self):
+        # Forget the oldest finished jobs once history is exceeded
+        finished = [job_id for job_id, job in self.jobs.items() if job.done.is_set()]
+        for job_id in finished[:max(0, len(self.jobs) - self.history)]:
+            del self.jobs[job_id]
+
+    async def _worker(self):
+        # Each worker task has its own context: its embedding calls yield to queries
+        set_llm_priority(PRIORITY_BULK)
+        while True:
+            job = await self.queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: IngestJob):
+        entry = self._source_locks.setdefault(job.source, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                await self._run_locked(job)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._source_locks[job.source]
+
+    async def _run_locked(self, job: IngestJob):
+        job.state = "running"
+        job.started_at = time.time()
+
+        def progress(done, total):
+            job.chunks_done = done
+            job.chunks_total = total
+
+        try:
+            job.stats = await self.rag_service.ingest_file(
+                job.file_path, progress=progress, parse_executor=self._process_pool, source=job.source
+            )
+            job.chunks_total = job.stats["added"]
+            job.chunks_done = job.stats["added"]
+            job.state = "completed"
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            job.done.set()
+            if os.path.exists(job.file_path):
+                os.remove(job.file_path)
+
+    def stats(self) -> dict:
+        states = {}
+        for job in self.jobs.values():
+            states[job.state] = states.get(job.state, 0) + 1
+        return {"queue_depth": self.queue.qsize(), "workers": self.workers, "jobs": states}
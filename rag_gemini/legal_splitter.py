@@ -0,0 +1,163 @@
+import os
+import re
+from collections import Counter
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain.docstore.document import Document
+
+# Structural headings, outermost first. Uppercase only: running text
+# refers to "el artículo 5" or "el capítulo II" in lowercase.
+HEADING_LEVELS = ["LIBRO", "PARTE", "TITULO", "CAPITULO", "SECCION", "SUBSECCION"]
+HEADING_RE = re.compile(r"^(LIBRO|PARTE|T[ÍI]TULO|CAP[ÍI]TULO|SECCI[ÓO]N|SUBSECCI[ÓO]N)\b(.*)$")
+# "ARTÍCULO 7.-", "ARTÍCULO 2.2.1.1.1.1.1.", "Artículo 3°."; the punctuation
+# after the number keeps "Artículo 5 de la Ley..." from matching
+ARTICLE_RE = re.compile(r"^(?:ART[ÍI]CULO|Art[íi]culo)\s+(\d+(?:\.\d+)*[A-Z]?)(?:\s*[°º])?(\s+(?:BIS|bis))?\s*[\.\-–:]")
+PARAGRAPH_RE = re.compile(r"^PAR[ÁA]GRAFO\b")
+# (?<![^\W_]) is \b that also accepts "_" before: "2024_Ley_80_de_1993.pdf"
+LAW_RE = re.compile(r"(?<![^\W_])(ley|decreto|resoluci[óo]n|acuerdo|circular)[\s_-]+(\d+)[\s_-]+de[\s_-]+(\d{4})", re.IGNORECASE)
+# Lines of the first page searched when the file name names no law: the
+# title, not laws the text merely cites
+TITLE_LINES = 5
+
+_UNACCENT = str.maketrans("ÁÉÍÓÚ", "AEIOU")
+
+def detect_law(source: str, text: str = ""):
+    """
+    "Ley 80 de 1993" style name, from the file name or else the title (first
+    lines) of the text.
+    """
+    title = "\n".join([line for line in text.splitlines() if line.strip()][:TITLE_LINES])
+    for candidate in (os.path.basename(source or ""), title):
+        match = LAW_RE.search(candidate)
+        if match:
+            kind, number, year = match.groups()
+            return f"{kind.capitalize()} {number} de {year}"
+    return None
+
+class LegalTextSplitter:
+    """
+    Splits laws and decrees at their structure instead of every N characters:
+    one chunk per article (Artículo), long articles cut at parágrafos and line
+    breaks, no overlap. Chunks carry law, article, section (the enclosing
+    Libro/Parte/Título/Capítulo/Sección headings) and the page where they
+    start. Page headers/footers repeated on most pages are dropped. Documents
+    without article headings (manuals, notes) go through the fallback
+    splitter unchanged.
+    """
+    def __init__(self, chunk_size: int = None, fallback=None):
+        self.chunk_size = chunk_size or int(os.getenv("RAG_LEGAL_CHUNK_SIZE", "2000"))
+        self.fallback = fallback or RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        self._long_lines = RecursiveCharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=0)
+
+    def split_documents(self, documents: list) -> list:
+        groups = {}
+        for doc in documents:
+            groups.setdefault(doc.metadata.get("source"), []).append(doc)
+
+        chunks = []
+        for source, pages in groups.items():
+            lines = self._page_lines(pages)
+            if not any(ARTICLE_RE.match(line) for line, _ in lines):
+                chunks.extend(self.fallback.split_documents(pages))
+                continue
+            law = detect_law(source, pages[0].page_content)
+            for unit in self._units(lines):
+                chunks.extend(self._unit_chunks(unit, pages, law))
+        return chunks
+
+    @staticmethod
+    def _page_lines(pages: list) -> list:
+        """
+        (line, index of its page) for every non-empty line, without the lines
+        that repeat at the top or bottom of most pages (digits ignored, so
+        "Ley 80 de 1993 4 EVA - Gestor Normativo" counts as one line).
+        """
+        split_pages = [[line.strip() for line in page.page_content.splitlines() if line.strip()] for page in pages]
+        boilerplate = set()
+        if len(pages) >= 3:
+            edges = Counter()
+            for page_lines in split_pages:
+                edges.update({re.sub(r"\d+", "#", line) for line in page_lines[:4] + page_lines[-3:]})
+            boilerplate = {line for line, count in edges.items() if count >= len(pages) / 2}
+
+        return [
+            (line, index)
+            for index, page_lines in enumerate(split_pages)
+            for line in page_lines
+            if re.sub(r"\d+", "#", line) not in boilerplate
+        ]
+
+    @staticmethod
+    def _units(lines: list) -> list:
+        """
+        Groups lines into articles (plus the text before the first one or
+        between headings): dicts with article, section and lines.
+        """
+        units, headings = [], {}
+        current = {"article": None, "section": "", "lines": []}
+        naming = None
+        for line, page in lines:
+            heading = HEADING_RE.match(line)
+            article = ARTICLE_RE.match(line)
+            if heading:
+                level = HEADING_LEVELS.index(heading.group(1).translate(_UNACCENT))
+                headings = {lvl: text for lvl, text in headings.items() if lvl < level}
+                headings[level] = line
+                naming = level
+                units.append(current)
+                current = {"article": None, "section": " / ".join(headings[lvl] for lvl in sorted(headings)), "lines": []}
+                continue
+            if naming is not None and not article and line.upper() == line and len(line) < 150:
+                # Heading name on the next line ("SECCIÓN 3" / "GARANTÍAS")
+                headings[naming] = f"{headings[naming]} {line}"
+                current["section"] = " / ".join(headings[lvl] for lvl in sorted(headings))
+                continue
+            naming = None
+            if article:
+                units.append(current)
+                number = article.group(1) + (" bis" if article.group(2) else "")
+                current = {"article": number, "section": current["section"], "lines": []}
+            current["lines"].append((line, page))
+        units.append(current)
+        return [unit for unit in units if unit["lines"]]
+
+    def _pieces(self, lines: list) -> list:
+        """
+        Packs the lines of an article into pieces of at most chunk_size
+        characters, preferring to cut where a parágrafo starts.
+        """
+        pieces, current, size = [], [], 0
+        for line, page in lines:
+            if len(line) > self.chunk_size:
+                parts = self._long_lines.split_text(line)
+            else:
+                parts = [line]
+            for part in parts:
+                at_paragraph = PARAGRAPH_RE.match(part) and size > self.chunk_size / 2
+                if current and (size + len(part) + 1 > self.chunk_size or at_paragraph):
+                    pieces.append(current)
+                    current, size = [], 0
+                current.append((part, page))
+                size += len(part) + 1
+        if current:
+            pieces.append(current)
+        return pieces
+
+    def _unit_chunks(self, unit: dict, pages: list, law: str) -> list:
+        if unit["article"]:
+            label = f"{law}, artículo {unit['article']}" if law else f"Artículo {unit['article']}"
+        else:
+            label = law
+        chunks = []
+        for piece in self._pieces(unit["lines"]):
+            page = pages[piece[0][1]]
+            text = "\n".join(line for line, _ in piece)
+            metadata = dict(page.metadata)
+            if law:
+                metadata["law"] = law
+            if unit["article"]:
+                metadata["article"] = unit["article"]
+            if unit["section"]:
+                metadata["section"] = unit["section"]
+            # The label keeps continuation pieces attributable to their article
+            chunks.append(Document(page_content=f"{label}\n{text}" if label else text, metadata=metadata))
+        return chunks
@@ -0,0 +1,415 @@
+import os
+import time
+import heapq
+import inspect
+import random
+import asyncio
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.embeddings import Embeddings
+
+# Lower value = served first
+PRIORITY_INTERACTIVE = 0  # /chat, /api/query
+PRIORITY_BACKGROUND = 1   # /finalize, memory writes
+PRIORITY_BULK = 2         # ingestion embeddings
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background", PRIORITY_BULK: "bulk"}
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "InternalServerError", "DeadlineExceeded"}
+
+# Per-minute quotas per scheduler (requests, tokens); 0 disables a limit.
+# Defaults follow Gemini's paid tier 1; set them to your project's quota.
+DEFAULT_LIMITS = {"generation": (1000, 1000000), "embedding": (1500, 1000000)}
+
+# Output tokens counted against the TPM bucket for each generation call
+OUTPUT_TOKEN_ESTIMATE = int(os.getenv("LLM_OUTPUT_TOKEN_ESTIMATE", "512"))
+
+_priority = contextvars.ContextVar("llm_priority", default=PRIORITY_INTERACTIVE)
+
+@contextmanager
+def llm_priority(priority: int):
+    """
+    Sets the priority of the LLM calls made in this context (and in the
+    threads/tasks it starts with a copied context).
+    """
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+def set_llm_priority(priority: int):
+    _priority.set(priority)
+
+def estimate_tokens(text) -> int:
+    # ~4 characters per token; good enough for quota accounting
+    if isinstance(text, (list, tuple)):
+        return sum(estimate_tokens(item) for item in text)
+    return len(str(text)) // 4 + 1
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Quota (429) and server (5xx) errors, whichever client raised them. The
+    cause chain is walked since LangChain wraps the Google errors.
+    """
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        status = getattr(exc, "code", None) or getattr(exc, "status_code", None)
+        response = getattr(exc, "response", None)
+        if status is None and response is not None:
+            status = getattr(response, "status_code", None)
+        if isinstance(status, int) and status in RETRYABLE_STATUS:
+            return True
+        if type(exc).__name__ in RETRYABLE_ERRORS:
+            return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+class LLMRateLimited(Exception):
+    """
+    Raised when a call waited longer than the queue timeout for quota.
+    """
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float) -> float:
+        # Seconds until amount is available (0 if it already is)
+        if not self.capacity:
+            return 0.0
+        amount = min(amount, self.capacity)
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount: float):
+        if self.capacity:
+            self.level -= min(amount, self.capacity)
+
+class _Waiter:
+    __slots__ = ("tokens", "granted", "wake")
+
+    def __init__(self, tokens: int, wake):
+        self.tokens = tokens
+        self.granted = False
+        # Set before the waiter is queued: any thread's _grant may call it
+        self.wake = wake
+
+class LLMScheduler:
+    """
+    Shared gate in front of Gemini calls. Calls wait for quota in two token
+    buckets (requests/min and tokens/min) and are admitted by priority, so
+    interactive queries get through before /finalize and ingestion when
+    quota is short. Quota and server errors are retried with jittered
+    exponential backoff.
+
+    Works from coroutines (run, stream) and from worker threads (run_sync).
+    """
+    def __init__(self, name: str, rpm: float = None, tpm: float = None):
+        prefix = f"LLM_{name.upper()}"
+        self.name = name
+        default_rpm, default_tpm = DEFAULT_LIMITS.get(name, (0, 0))
+        self.rpm = rpm if rpm is not None else float(os.getenv(f"{prefix}_RPM", str(default_rpm)))
+        self.tpm = tpm if tpm is not None else float(os.getenv(f"{prefix}_TPM", str(default_tpm)))
+        self.max_retries = int(os.getenv("LLM_MAX_RETRIES", "4"))
+        self.base_delay = float(os.getenv("LLM_RETRY_BASE_DELAY", "1.0"))
+        self.max_delay = float(os.getenv("LLM_RETRY_MAX_DELAY", "30"))
+        # Interactive and background calls give up after this long in the
+        # queue; bulk calls wait as long as needed.
+        self.queue_timeout = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+
+        self._requests = TokenBucket(self.rpm)
+        self._tokens = TokenBucket(self.tpm)
+        self._lock = threading.Lock()
+        self._heap = []
+        self._seq = itertools.count()
+
+        self.calls = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.max_wait_seconds = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.retries = 0
+        self.rejections = 0
+        self.failures = 0
+
+    # -- admission -----------------------------------------------------------
+
+    def _grant(self) -> float:
+        """
+        Admits waiters from the head of the queue while quota allows.
+        Returns the seconds until the head could be admitted.
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._requests.refill(now)
+            self._tokens.refill(now)
+            while self._heap:
+                waiter = self._heap[0][2]
+                delay = max(self._requests.delay(1), self._tokens.delay(waiter.tokens))
+                if delay > 0:
+                    return delay
+                heapq.heappop(self._heap)
+                self._requests.take(1)
+                self._tokens.take(waiter.tokens)
+                waiter.granted = True
+                waiter.wake()
+            return 0.0
+
+    def _enqueue(self, priority: int, tokens: int, wake) -> _Waiter:
+        waiter = _Waiter(tokens, wake)
+        with self._lock:
+            heapq.heappush(self._heap, (priority, next(self._seq), waiter))
+        return waiter
+
+    def _leave(self, waiter: _Waiter) -> bool:
+        # Removes a waiter that gave up; False if it was granted meanwhile
+        with self._lock:
+            if waiter.granted:
+                return False
+            self._heap = [entry for entry in self._heap if entry[2] is not waiter]
+            heapq.heapify(self._heap)
+            return True
+
+    def _deadline(self, priority: int):
+        if priority >= PRIORITY_BULK or not self.queue_timeout:
+            return None
+        return time.monotonic() + self.queue_timeout
+
+    def _admitted(self, priority: int, started: float):
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        waited = time.monotonic() - started
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            self.wait_seconds[name] = self.wait_seconds.get(name, 0.0) + waited
+            self.max_wait_seconds[name] = max(self.max_wait_seconds.get(name, 0.0), waited)
+
+    def _reject(self, priority: int):
+        with self._lock:
+            self.rejections += 1
+        raise LLMRateLimited(
+            f"Gemini {self.name} quota exhausted: waited {self.queue_timeout:g}s "
+            f"({PRIORITY_NAMES.get(priority, priority)} priority)"
+        )
+
+    async def acquire(self, tokens: int = 0, priority: int = None):
+        priority = _priority.get() if priority is None else priority
+        started = time.monotonic()
+        deadline = self._deadline(priority)
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        waiter = self._enqueue(priority, tokens, lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while True:
+                delay = self._grant()
+                if waiter.granted:
+                    break
+                timeout = delay or 1.0
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        if self._leave(waiter):
+                            self._reject(priority)
+                        break
+                    timeout = min(timeout, remaining)
+                try:
+                    await asyncio.wait_for(event.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        except asyncio.CancelledError:
+            self._leave(waiter)
+            raise
+        self._admitted(priority, started)
+
+    def acquire_sync(self, tokens: int = 0, priority: int = None):
+        priority = _priority.get() if priority is None else priority
+        started = time.monotonic()
+        deadline = self._deadline(priority)
+        event = threading.Event()
+        waiter = self._enqueue(priority, tokens, event.set)
+        while True:
+            delay = self._grant()
+            if waiter.granted:
+                break
+            timeout = delay or 1.0
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    if self._leave(waiter):
+                        self._reject(priority)
+                    break
+                timeout = min(timeout, remaining)
+            event.wait(timeout)
+            event.clear()
+        self._admitted(priority, started)
+
+    # -- retries -------------------------------------------------------------
+
+    def _retry_delay(self, exc: Exception, attempt: int):
+        """
+        Backoff before the next attempt, or None if exc shouldn't be retried.
+        """
+        if attempt >= self.max_retries or not is_retryable(exc):
+            with self._lock:
+                self.failures += 1
+            return None
+        with self._lock:
+            self.retries += 1
+        # Full jitter, so clients that failed together don't retry together
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def run(self, func, *args, tokens: int = 0, priority: int = None, **kwargs):
+        """
+        Awaits func(*args, **kwargs) once quota is available, retrying
+        quota/server errors.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(tokens, priority)
+            try:
+                return await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                print(f"Gemini {self.name} call failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def run_sync(self, func, *args, tokens: int = 0, priority: int = None, **kwargs):
+        """
+        Blocking variant of run, for code running in worker threads.
+        """
+        attempt = 0
+        while True:
+            self.acquire_sync(tokens, priority)
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                print(f"Gemini {self.name} call failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+
+    async def stream(self, func, *args, tokens: int = 0, priority: int = None, **kwargs):
+        """
+        Like run for async generators. Only failures before the first item are
+        retried; once output has been yielded the error is raised.
+        """
+        attempt = 0
+        while True:
+            await self.acquire(tokens, priority)
+            started = False
+            try:
+                async for item in func(*args, **kwargs):
+                    started = True
+                    yield item
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                print(f"Gemini {self.name} stream failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            waiting = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _, _ in self._heap:
+                name = PRIORITY_NAMES.get(priority, str(priority))
+                waiting[name] = waiting.get(name, 0) + 1
+            return {
+                "rpm": self.rpm,
+                "tpm": self.tpm,
+                "waiting": waiting,
+                "calls": dict(self.calls),
+                "wait_seconds_total": {k: round(v, 3) for k, v in self.wait_seconds.items()},
+                "wait_seconds_max": {k: round(v, 3) for k, v in self.max_wait_seconds.items()},
+                "retries": self.retries,
+                "rejections": self.rejections,
+                "failures": self.failures,
+            }
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    LangChain Embeddings wrapper that sends every API call through a scheduler.
+    Goes below CachedEmbeddings, so cache hits don't use quota.
+    """
+    def __init__(self, embeddings, scheduler: LLMScheduler):
+        self.embeddings = embeddings
+        self.scheduler = scheduler
+
+    def embed_query(self, text: str) -> list:
+        return self.scheduler.run_sync(self.embeddings.embed_query, text, tokens=estimate_tokens(text))
+
+    def embed_documents(self, texts: list) -> list:
+        return self.scheduler.run_sync(self.embeddings.embed_documents, texts, tokens=estimate_tokens(texts))
+
+    def embed_queries(self, texts: list) -> list:
+        """
+        Embeds several queries in one call: embed_documents with the query
+        task type when the model takes one (Gemini's batchEmbedContents).
+        """
+        embed_documents = self.embeddings.embed_documents
+        if "task_type" in inspect.signature(embed_documents).parameters:
+            return self.scheduler.run_sync(embed_documents, texts, task_type="retrieval_query", tokens=estimate_tokens(texts))
+        # Models without task types embed queries and documents alike
+        return self.scheduler.run_sync(embed_documents, texts, tokens=estimate_tokens(texts))
+
+class ScheduledMem0Embedder:
+    """
+    Wraps a Mem0 embedder (embed / embed_batch) with a scheduler.
+    """
+    def __init__(self, embedder, scheduler: LLMScheduler):
+        self.embedder = embedder
+        self.scheduler = scheduler
+        self.config = getattr(embedder, "config", None)
+
+    def embed(self, text, memory_action=None):
+        return self.scheduler.run_sync(self.embedder.embed, text, memory_action, tokens=estimate_tokens(text))
+
+    def embed_batch(self, texts, memory_action="add"):
+        if not hasattr(self.embedder, "embed_batch"):
+            return [self.embed(text, memory_action) for text in texts]
+        return self.scheduler.run_sync(self.embedder.embed_batch, texts, memory_action, tokens=estimate_tokens(texts))
+
+class ScheduledMem0LLM:
+    """
+    Wraps Mem0's LLM (generate_response) with a scheduler.
+    """
+    def __init__(self, llm, scheduler: LLMScheduler):
+        self.llm = llm
+        self.scheduler = scheduler
+        self.config = getattr(llm, "config", None)
+
+    def generate_response(self, messages, *args, **kwargs):
+        tokens = estimate_tokens([message.get("content", "") for message in messages])
+        return self.scheduler.run_sync(self.llm.generate_response, messages, *args, tokens=tokens, **kwargs)
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def get_scheduler(name: str) -> LLMScheduler:
+    """
+    Process-wide scheduler per quota ("generation", "embedding"), shared by
+    RAGService, GeminiClient and Mem0.
+    """
+    with _schedulers_lock:
+        if name not in _schedulers:
+            _schedulers[name] = LLMScheduler(name)
+        return _schedulers[name]
+
+def scheduler_stats() -> dict:
+    with _schedulers_lock:
+        return {name: scheduler.stats() for name, scheduler in _schedulers.items()}
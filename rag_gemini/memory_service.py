@@ -1,8 +1,18 @@
 import os
-from mem0 import Memory
+import json
+import asyncio
+import functools
+from collections import OrderedDict
+from embedding_cache import CachedMem0Embedder
+from llm_scheduler import get_scheduler, llm_priority, ScheduledMem0LLM, ScheduledMem0Embedder, PRIORITY_BACKGROUND
+from metrics import metrics
+from db_pool import get_engine, Mem0ConnectionPool
 
 class MemoryService:
     def __init__(self):
+        # Imported here: mem0 is slow to import and the write queue below doesn't need it
+        from mem0 import Memory
+
         # Ensure GOOGLE_API_KEY is set for Mem0/Gemini
         if not os.getenv("GOOGLE_API_KEY"):
             os.environ["GOOGLE_API_KEY"] = os.getenv("GEMINI_API_KEY", "")
@@ -40,6 +50,8 @@ class MemoryService:
                     "user": os.getenv("POSTGRES_USER", "rag_user"),
                     "password": os.getenv("POSTGRES_PASSWORD", "rag_password"),
                     "dbname": os.getenv("POSTGRES_DATABASE", "rag_db"),
+                    # Borrow connections from the pool shared with RAGService
+                    "connection_pool": Mem0ConnectionPool(get_engine()),
                 }
             }
         }
@@ -57,16 +69,144 @@ class MemoryService:
                 print(f"Failed to initialize Mem0 completely: {e2}")
                 self.memory = None
 
+        # Route Mem0's embeddings through the cache shared with RAGService/GeminiClient,
+        # and its Gemini calls through the shared schedulers
+        if self.memory and getattr(self.memory, "embedding_model", None):
+            self.memory.embedding_model = CachedMem0Embedder(
+                ScheduledMem0Embedder(self.memory.embedding_model, get_scheduler("embedding")),
+                model=self.config["embedder"]["config"]["model"],
+            )
+        if self.memory and getattr(self.memory, "llm", None):
+            self.memory.llm = ScheduledMem0LLM(self.memory.llm, get_scheduler("generation"))
+
     def add(self, text: str, user_id: str = "default_user", metadata: dict = None):
         if self.memory:
-            self.memory.add(text, user_id=user_id, metadata=metadata)
+            with metrics.span("memory_add"):
+                self.memory.add(text, user_id=user_id, metadata=metadata)
 
     def search(self, query: str, user_id: str = "default_user", limit: int = 5):
         if self.memory:
-            return self.memory.search(query, user_id=user_id, limit=limit)
+            with metrics.span("memory_search"):
+                return self.memory.search(query, user_id=user_id, limit=limit)
         return []
 
-    def get_all(self, user_id: str = "default_user"):
+    def get_all(self, user_id: str = "default_user", limit: int = 100):
+        # Mem0 returns at most limit memories, in no particular order
         if self.memory:
-            return self.memory.get_all(user_id=user_id)
+            return self.memory.get_all(user_id=user_id, limit=limit)
         return []
+
+class MemoryWriteQueue:
+    """
+    Write-behind buffer for MemoryService.add. Interactions are queued per
+    user and written in the background every flush_interval seconds; all the
+    pending interactions of a user (with the same metadata) are joined into a
+    single Mem0 add, so they cost one extraction call instead of one each.
+    """
+    def __init__(self, memory_service: MemoryService, flush_interval: float = None, concurrency: int = None, on_write=None):
+        self.memory_service = memory_service
+        # Optional coroutine function called with the user_id after each write
+        self.on_write = on_write
+        self.flush_interval = flush_interval or float(os.getenv("MEMORY_FLUSH_INTERVAL", "2.0"))
+        self.concurrency = concurrency or int(os.getenv("MEMORY_WRITE_CONCURRENCY", "2"))
+
+        self.pending = OrderedDict()
+        # user_id -> write tasks running for that user
+        self._user_writes = {}
+        self.in_flight = 0
+        self.written = 0
+        self.writes = 0
+        self.failed = 0
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        # Cancel the timer loop, then write whatever is still pending
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def enqueue(self, text: str, user_id: str = "default_user", metadata: dict = None):
+        self.pending.setdefault(user_id, []).append((text, metadata))
+        self._wakeup.set()
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(items) for items in self.pending.values()) + self.in_flight
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Give concurrent requests of the same user a chance to coalesce
+            await asyncio.sleep(self.flush_interval)
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self, user_id: str = None):
+        """
+        Writes the pending interactions now, for one user or for everyone,
+        and waits for their writes already in progress too, so the memories
+        are up to date when it returns.
+        """
+        if user_id is not None:
+            batches = {user_id: self.pending.pop(user_id)} if user_id in self.pending else {}
+        else:
+            batches, self.pending = self.pending, OrderedDict()
+
+        writes = []
+        for uid, items in batches.items():
+            groups = OrderedDict()
+            for text, metadata in items:
+                groups.setdefault(json.dumps(metadata, sort_keys=True, default=str), (metadata, []))[1].append(text)
+            writes += [(uid, metadata, texts) for metadata, texts in groups.values()]
+        for uid, metadata, texts in writes:
+            task = asyncio.ensure_future(self._write(uid, metadata, texts))
+            self._user_writes.setdefault(uid, set()).add(task)
+            task.add_done_callback(functools.partial(self._forget_write, uid))
+
+        if user_id is not None:
+            waiting = list(self._user_writes.get(user_id, ()))
+        else:
+            waiting = [task for tasks in self._user_writes.values() for task in tasks]
+        # Shielded: if the timer loop is cancelled (stop), the writes carry on
+        # and stop()'s own flush waits for them
+        await asyncio.shield(asyncio.gather(*waiting))
+
+    def _forget_write(self, user_id: str, task):
+        tasks = self._user_writes.get(user_id)
+        if tasks is not None:
+            tasks.discard(task)
+            if not tasks:
+                del self._user_writes[user_id]
+
+    async def _write(self, user_id: str, metadata: dict, texts: list):
+        self.in_flight += len(texts)
+        try:
+            async with self._semaphore:
+                # Memory extraction yields quota to interactive queries
+                with llm_priority(PRIORITY_BACKGROUND):
+                    await asyncio.to_thread(self.memory_service.add, "\n\n".join(texts), user_id, metadata)
+            self.written += len(texts)
+            self.writes += 1
+            if self.on_write:
+                await self.on_write(user_id)
+        except Exception as e:
+            self.failed += len(texts)
+            print(f"Failed to write {len(texts)} memories for {user_id}: {e}")
+        finally:
+            self.in_flight -= len(texts)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": self.queue_depth,
+            "users_pending": len(self.pending),
+            "interactions_written": self.written,
+            "mem0_writes": self.writes,
+            "failed": self.failed,
+        }
@@ -0,0 +1,199 @@
+import os
+import re
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Per-request stage timings (stage -> seconds) for the Server-Timing header;
+# None when the current request didn't ask for them.
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+def _labels_key(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format_labels(labels: tuple) -> str:
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{key}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+def _metric_name(*parts) -> str:
+    return re.sub(r"[^a-zA-Z0-9_]", "_", "_".join(str(part) for part in parts if part != ""))
+
+class Metrics:
+    """
+    Minimal in-process metrics registry: counters and histograms updated by
+    the services, plus collectors that read the services' stats() at scrape
+    time. render() produces the Prometheus text format.
+    """
+    def __init__(self):
+        self.enabled = os.getenv("METRICS_ENABLED", "true").lower() not in ("0", "false", "no")
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+        self._collectors = []
+
+    def describe(self, name: str, help_text: str):
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: tuple = STAGE_BUCKETS, **labels):
+        if not self.enabled:
+            return
+        key = (name, _labels_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(histogram["buckets"], value)
+            if index < len(histogram["counts"]):
+                histogram["counts"][index] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @contextmanager
+    def span(self, stage: str):
+        """
+        Times a stage: rag_stage_seconds{stage} histogram, error counter on
+        exceptions, and the request's Server-Timing entry if enabled.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc("rag_stage_errors_total", stage=stage)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.observe("rag_stage_seconds", elapsed, stage=stage)
+            timings = _request_timings.get()
+            if timings is not None:
+                with self._lock:
+                    timings[stage] = timings.get(stage, 0.0) + elapsed
+
+    def count_tokens(self, source: str, prompt_tokens: int, completion_tokens: int):
+        self.inc("rag_llm_tokens_total", prompt_tokens, source=source, kind="prompt")
+        self.inc("rag_llm_tokens_total", completion_tokens, source=source, kind="completion")
+
+    def add_collector(self, name: str, stats_fn):
+        """
+        Exports the numeric values of stats_fn() (nested dicts flattened) as
+        gauges named rag_<name>_<key>.
+        """
+        self._collectors.append((name, stats_fn))
+
+    def _collect(self) -> list:
+        samples = []
+
+        def flatten(prefix, value):
+            if isinstance(value, bool):
+                samples.append((prefix, float(value)))
+            elif isinstance(value, (int, float)):
+                samples.append((prefix, float(value)))
+            elif isinstance(value, dict):
+                for key, item in value.items():
+                    flatten(_metric_name(prefix, key), item)
+
+        for name, stats_fn in self._collectors:
+            try:
+                flatten(_metric_name("rag", name), stats_fn())
+            except Exception as e:
+                print(f"Metrics collector {name} failed: {e}")
+        return samples
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, dict(value, counts=list(value["counts"]))) for key, value in self._histograms.items())
+
+        seen = set()
+        for (name, labels), value in counters:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+
+        for (name, labels), histogram in histograms:
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"], histogram["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', bound),))} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {histogram['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+        for name, value in self._collect():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+metrics.describe("rag_stage_seconds", "Duration of each processing stage")
+metrics.describe("rag_stage_errors_total", "Stages that raised an exception")
+metrics.describe("rag_llm_tokens_total", "LLM tokens, from usage metadata or estimated when missing")
+metrics.describe("http_request_duration_seconds", "HTTP request duration by route")
+
+class TimingMiddleware:
+    """
+    ASGI middleware recording request durations per route. When
+    METRICS_TIMING_HEADERS is set, or the request sends "X-Timing: 1", the
+    stage timings are returned in a Server-Timing header. For streaming
+    responses the header only covers the stages done before the first byte.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.always = os.getenv("METRICS_TIMING_HEADERS", "false").lower() in ("1", "true", "yes")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not metrics.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        wants_timings = self.always or (b"x-timing", b"1") in scope.get("headers", [])
+        timings = {} if wants_timings else None
+        token = _request_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if timings is not None:
+                    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+                    entries.append(f"total;dur={(time.perf_counter() - started) * 1000:.1f}")
+                    message = dict(message, headers=list(message.get("headers", [])) + [(b"server-timing", ", ".join(entries).encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            metrics.observe(
+                "http_request_duration_seconds", time.perf_counter() - started,
+                method=scope["method"], route=path, status=status,
+            )
@@ -1,43 +1,285 @@
 import os
 import shutil
+import time
+import uuid
+import asyncio
+import hashlib
+import functools
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from langchain_google_genai import GoogleGenerativeAIEmbeddings, ChatGoogleGenerativeAI
-from langchain_postgres import PGVector
+from sqlalchemy import Text, cast, func, literal_column, select
+from sqlalchemy.dialects.postgresql import JSONB, TSQUERY
 from langchain_community.document_loaders import PyPDFLoader, Docx2txtLoader
-from langchain_community.document_loaders.csv_loader import CSVLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
 from langchain.docstore.document import Document
 import pandas as pd
+from answer_cache import SemanticCache
+from embedding_cache import CachedEmbeddings
+from vector_indexes import VectorIndexManager, IndexedPGVector, EMBEDDING_TABLE, TSV_COLUMN
+from llm_scheduler import get_scheduler, ScheduledEmbeddings, estimate_tokens, OUTPUT_TOKEN_ESTIMATE, llm_priority, PRIORITY_BACKGROUND
+from context_packer import ContextPacker
+from legal_splitter import LegalTextSplitter
+from metrics import metrics
+from db_pool import get_engine
+
+# Same wording as LangChain's default "stuff" QA prompt, so answers keep the
+# style they had when we went through RetrievalQA.
+QA_PROMPT = PromptTemplate(
+    template="""Use the following pieces of context to answer the question at the end. If you don't know the answer, just say that you don't know, don't try to make up an answer.
+
+{context}
+
+Question: {question}
+Helpful Answer:""",
+    input_variables=["context", "question"],
+)
+
+TABLE_EXTENSIONS = {".csv", ".xlsx", ".xls"}
+
+RETRIEVAL_MODES = {"vector", "lexical", "hybrid"}
+# Query modes from the LightRAG days, still sent by some clients
+LEGACY_MODES = {"naive": "vector", "local": "hybrid", "global": "hybrid", "mix": "hybrid"}
+
+def normalize_mode(mode: str) -> str:
+    mode = LEGACY_MODES.get((mode or "hybrid").lower(), (mode or "hybrid").lower())
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unsupported mode '{mode}', expected one of: {', '.join(sorted(RETRIEVAL_MODES))}")
+    return mode
+
+def reciprocal_rank_fusion(result_lists: list, k: int, rrf_k: int = 60) -> list:
+    """
+    Merges ranked Document lists: each document scores sum(1 / (rrf_k + rank)).
+    """
+    scores, documents = {}, {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            scores[doc.id] = scores.get(doc.id, 0.0) + 1.0 / (rrf_k + rank + 1)
+            documents.setdefault(doc.id, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    return [documents[doc_id] for doc_id in ranked[:k]]
+
+def load_documents(file_path: str) -> list:
+    ext = os.path.splitext(file_path)[1].lower()
+    documents = []
+
+    if ext == ".pdf":
+        loader = PyPDFLoader(file_path)
+        documents = loader.load()
+    elif ext in [".docx", ".doc"]:
+        loader = Docx2txtLoader(file_path)
+        documents = loader.load()
+    elif ext in TABLE_EXTENSIONS:
+        for block in iter_table_documents(file_path):
+            documents.extend(block)
+    elif ext in [".txt", ".md"]:
+        with open(file_path, "r", encoding="utf-8") as f:
+            content = f.read()
+        documents = [Document(page_content=content, metadata={"source": file_path})]
+    else:
+        print(f"Unsupported extension: {ext}")
+
+    return documents
+
+def rows_to_text(df: pd.DataFrame) -> pd.Series:
+    """
+    Vectorized "column: value" rendering of every row, skipping empty cells.
+    """
+    parts = []
+    for column in df.columns:
+        values = df[column]
+        parts.append((f"{column}: " + values.astype(str)).where(values.notna(), ""))
+    if not parts:
+        return pd.Series([], dtype=str)
+    text = parts[0].str.cat(parts[1:], sep="\n") if len(parts) > 1 else parts[0]
+    # Empty cells leave blank lines behind
+    return text.str.replace(r"\n{2,}", "\n", regex=True).str.strip("\n")
+
+def _frame_to_documents(df: pd.DataFrame, file_path: str, sheet: str = None) -> list:
+    texts = rows_to_text(df)
+    documents = []
+    for row, content in zip(df.index, texts):
+        if not content:
+            continue
+        metadata = {"source": file_path, "row": int(row)}
+        if sheet is not None:
+            metadata["sheet"] = sheet
+        documents.append(Document(page_content=content, metadata=metadata))
+    return documents
+
+def _iter_xlsx_frames(file_path: str, chunk_rows: int):
+    from openpyxl import load_workbook
+
+    # read_only streams rows from the file instead of building the whole workbook
+    workbook = load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+            columns = [str(name) if name is not None else f"column_{i + 1}" for i, name in enumerate(header)]
+            block, start = [], 0
+            for values in rows:
+                block.append(values[:len(columns)])
+                if len(block) == chunk_rows:
+                    yield sheet.title, pd.DataFrame(block, columns=columns, index=range(start, start + len(block)))
+                    start += len(block)
+                    block = []
+            if block:
+                yield sheet.title, pd.DataFrame(block, columns=columns, index=range(start, start + len(block)))
+    finally:
+        workbook.close()
+
+def iter_table_documents(file_path: str, chunk_rows: int = None):
+    """
+    Yields lists of one-row Documents, chunk_rows rows at a time, for CSV and
+    Excel files (every sheet), so large spreadsheets are read in bounded memory.
+    """
+    chunk_rows = chunk_rows or int(os.getenv("RAG_TABLE_CHUNK_ROWS", "5000"))
+    ext = os.path.splitext(file_path)[1].lower()
+
+    if ext == ".csv":
+        # dtype=str keeps cell text as written and skips per-chunk type inference
+        reader = pd.read_csv(file_path, chunksize=chunk_rows, dtype=str, encoding="utf-8-sig", encoding_errors="replace")
+        for df in reader:
+            yield _frame_to_documents(df, file_path)
+    elif ext == ".xlsx":
+        for sheet, df in _iter_xlsx_frames(file_path, chunk_rows):
+            yield _frame_to_documents(df, file_path, sheet)
+    elif ext == ".xls":
+        # The legacy format can't be streamed; at least avoid per-row work
+        for sheet, df in pd.read_excel(file_path, sheet_name=None).items():
+            for start in range(0, len(df), chunk_rows):
+                yield _frame_to_documents(df.iloc[start:start + chunk_rows], file_path, str(sheet))
+
+def iter_table_chunks(file_path: str):
+    for documents in iter_table_documents(file_path):
+        # Rows have no articles to follow
+        yield split_documents(documents, splitter="recursive")
+
+SPLITTERS = {"legal", "recursive"}
+
+def splitter_name(name: str = None) -> str:
+    name = (name or os.getenv("RAG_SPLITTER", "legal")).lower()
+    if name not in SPLITTERS:
+        raise ValueError(f"Unsupported RAG_SPLITTER '{name}', expected one of: {', '.join(sorted(SPLITTERS))}")
+    return name
+
+def split_documents(documents: list, splitter: str = None) -> list:
+    """
+    Chunks documents with RAG_SPLITTER: "legal" follows Título/Capítulo/
+    Artículo/Parágrafo boundaries (documents without articles are split as
+    with "recursive"), "recursive" cuts every 1000 characters with overlap.
+    """
+    if splitter_name(splitter) == "legal":
+        text_splitter = LegalTextSplitter()
+    else:
+        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+    return text_splitter.split_documents(documents)
+
+def load_and_split(file_path: str, source: str = None) -> list:
+    # Module-level so it can be sent to a process pool
+    documents = load_documents(file_path)
+    if source:
+        # Uploads are parsed from a temporary "{job_id}_{name}" copy; the
+        # splitter reads the law from the document's real name
+        for doc in documents:
+            doc.metadata["source"] = source
+    return split_documents(documents)
+
+def file_fingerprint(file_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def chunk_id(source: str, page, content_hash: str) -> str:
+    # Deterministic, so re-ingesting the same chunk maps to the same row
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"{source}|{page}|{content_hash}"))
+
+def chunk_position(metadata: dict):
+    if "page" in metadata:
+        return metadata["page"]
+    if "row" in metadata:
+        return f"{metadata.get('sheet', '')}!{metadata['row']}"
+    return ""
 
 class RAGService:
-    def __init__(self, work_dir: str = "./rag_storage"):
+    def __init__(self, work_dir: str = "./rag_storage", max_concurrency: int = None,
+                 embeddings=None, llm=None, collection_name: str = "rag_documents"):
+        """
+        embeddings and llm replace the Gemini models (e.g. with stand-ins for
+        benchmarks); they still go through the caches and schedulers.
+        """
         self.work_dir = work_dir
+
+        # Retrieval goes through psycopg, which is blocking, so it runs on a
+        # dedicated thread pool. The semaphore bounds how many queries are in
+        # flight at once (retrieval + generation).
+        self.max_concurrency = max_concurrency or int(os.getenv("RAG_MAX_CONCURRENCY", "8"))
+        self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="rag")
+        self._query_semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        # Ingestion gets its own pool so large uploads don't starve queries.
+        self.ingest_batch_size = int(os.getenv("RAG_INGEST_BATCH_SIZE", "100"))
+        self.ingest_concurrency = int(os.getenv("RAG_INGEST_CONCURRENCY", "4"))
+        self._ingest_executor = ThreadPoolExecutor(max_workers=self.ingest_concurrency, thread_name_prefix="rag-ingest")
         
         # Ensure GOOGLE_API_KEY is set for LangChain
         if not os.getenv("GOOGLE_API_KEY"):
             os.environ["GOOGLE_API_KEY"] = os.getenv("GEMINI_API_KEY", "")
 
-        self.embeddings = GoogleGenerativeAIEmbeddings(model="models/text-embedding-004")
-        self.llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0)
-        
-        # Postgres Connection String
-        host = os.getenv("POSTGRES_HOST", "localhost")
-        port = os.getenv("POSTGRES_PORT", "5432")
-        user = os.getenv("POSTGRES_USER", "rag_user")
-        password = os.getenv("POSTGRES_PASSWORD", "rag_password")
-        dbname = os.getenv("POSTGRES_DATABASE", "rag_db")
+        # Gemini calls go through the shared schedulers (quota, priority,
+        # retries); the cache sits in front so hits don't use quota.
+        self.embeddings = CachedEmbeddings(
+            ScheduledEmbeddings(
+                embeddings or GoogleGenerativeAIEmbeddings(model="models/text-embedding-004"), get_scheduler("embedding")
+            ),
+            model="models/text-embedding-004",
+        )
+        self.llm_scheduler = get_scheduler("generation")
+        # Retries are left to the scheduler
+        self.llm = llm or ChatGoogleGenerativeAI(model="gemini-2.5-flash", temperature=0, max_retries=1)
         
-        self.connection_string = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{dbname}"
-        self.collection_name = "rag_documents"
+        self.collection_name = collection_name
         
-        self.vector_store = PGVector(
+        self.embedding_dimensions = int(os.getenv("RAG_EMBEDDING_DIM", "768"))
+        # Connection pool shared with Mem0 (see db_pool.py)
+        self.engine = get_engine()
+        self.index_manager = VectorIndexManager(self.engine, dimensions=self.embedding_dimensions)
+
+        self.vector_store = IndexedPGVector(
             embeddings=self.embeddings,
             collection_name=self.collection_name,
-            connection=self.connection_string,
+            connection=self.engine,
+            embedding_length=self.embedding_dimensions,
             use_jsonb=True,
         )
+
+        if os.getenv("RAG_AUTO_INDEX", "true").lower() not in ("0", "false", "no"):
+            try:
+                self.index_manager.ensure()
+            except Exception as e:
+                print(f"Failed to create vector indexes: {e}")
         
+        self.top_k = int(os.getenv("RAG_TOP_K", "5"))
+        self.retrieval_timeout = float(os.getenv("RAG_RETRIEVAL_TIMEOUT", "10"))
+        self.context_packer = ContextPacker()
+        # Each leg of a hybrid search returns this many candidates before fusion
+        self.hybrid_candidates = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+        # When set, hybrid mode ranks by vector distance only inside the
+        # lexical matches (if there are enough of them) instead of fusing.
+        self.lexical_prefilter = os.getenv("RAG_LEXICAL_PREFILTER", "false").lower() in ("1", "true", "yes")
+        self.prefilter_pool = int(os.getenv("RAG_PREFILTER_POOL", "200"))
+
+        self.answer_cache = SemanticCache()
+        self.splitter = splitter_name()
+        # Generations in flight per /api/query/batch request
+        self.batch_concurrency = int(os.getenv("RAG_BATCH_CONCURRENCY", "4"))
+
         self._initialized = True # LangChain setup is mostly sync/lazy
 
     async def initialize(self):
@@ -45,89 +287,572 @@ class RAGService:
         # but we keep method for compatibility with app.py calls
         pass
 
-    async def ingest_file(self, file_path: str):
-        ext = os.path.splitext(file_path)[1].lower()
-        documents = []
-        
+    async def warm_up(self) -> dict:
+        """
+        Opens the database connections queries will use and sends one
+        embedding and one retrieval, so the first real queries don't pay for
+        connection setup or cold index pages.
+        """
+        started = time.perf_counter()
+
+        def open_connections(count):
+            connections = [self.engine.connect() for _ in range(count)]
+            try:
+                for connection in connections:
+                    connection.execute(select(1))
+            finally:
+                for connection in connections:
+                    connection.close()
+
+        size = getattr(self.engine.pool, "size", lambda: 1)()
+        connections = min(size, self.max_concurrency)
+        await self._run_blocking(open_connections, connections)
+        embedding = await self._embed_query("warm-up")
+        await self._retrieve(embedding, "warm-up", "vector", k=1)
+        return {"connections": connections, "seconds": round(time.perf_counter() - started, 3)}
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self._ingest_executor.shutdown(wait=False)
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        # Copy the context so the LLM priority follows the call into the thread
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def ingest_file(self, file_path: str, progress=None, parse_executor=None, source: str = None) -> dict:
+        """
+        Loads, splits, embeds and stores a file. Chunks are embedded in batches
+        of ingest_batch_size, with up to ingest_concurrency batches in flight;
+        each batch is inserted as soon as its embeddings are ready.
+        progress(done_chunks, total_chunks) is called after every batch.
+        Parsing runs on parse_executor if given (e.g. a process pool for
+        CPU-heavy PDF/DOCX files), otherwise on the ingest thread pool.
+
+        Ingestion is incremental per source: an unchanged file is skipped
+        without parsing, and for a changed file only chunks whose (page,
+        content) is new get embedded, while chunks that disappeared are
+        deleted. source must identify the document uniquely (the job manager
+        passes the client's relative path; defaults to the file name), and
+        runs for the same source must not overlap.
+
+        The file's fingerprint (doc_hash) is written to its chunks only once
+        every batch is stored, so a run that fails partway is resumed, not
+        skipped, by the next one.
+        """
+        source = source or os.path.basename(file_path)
         try:
-            if ext == ".pdf":
-                loader = PyPDFLoader(file_path)
-                documents = loader.load()
-            elif ext in [".docx", ".doc"]:
-                loader = Docx2txtLoader(file_path)
-                documents = loader.load()
-            elif ext in [".xlsx", ".xls"]:
-                # Lightweight Excel loading using pandas
-                df = pd.read_excel(file_path)
-                # Convert each row to a document
-                for _, row in df.iterrows():
-                    content = "\n".join([f"{k}: {v}" for k, v in row.items() if pd.notna(v)])
-                    documents.append(Document(page_content=content, metadata={"source": file_path}))
-            elif ext == ".csv":
-                loader = CSVLoader(file_path)
-                documents = loader.load()
-            elif ext in [".txt", ".md"]:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                documents = [Document(page_content=content, metadata={"source": file_path})]
+            started = time.perf_counter()
+            # The splitter is part of the fingerprint: switching it re-chunks unchanged files
+            doc_hash = f"{await self._run_ingest(file_fingerprint, file_path)}:{self.splitter}"
+            stored = await self._run_ingest(self._stored_chunks, source)
+            if stored and all(h == doc_hash for h in stored.values()):
+                print(f"Skipping {source}: unchanged since last ingest")
+                return {
+                    "file": source, "chunks": len(stored), "added": 0, "skipped": len(stored), "deleted": 0,
+                    "unchanged": True, "seconds_total": round(time.perf_counter() - started, 3),
+                }
+
+            if progress is None:
+                progress = lambda done, total: print(f"{source}: {done}/{total} chunks stored")
+
+            if os.path.splitext(file_path)[1].lower() in TABLE_EXTENSIONS:
+                # Spreadsheets are streamed in row blocks to keep memory bounded
+                blocks = self._iter_in_executor(iter_table_chunks(file_path))
             else:
-                print(f"Unsupported extension: {ext}")
-                return
+                blocks = self._parse_whole(file_path, parse_executor, source)
 
-            text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            splits = text_splitter.split_documents(documents)
-            
-            # Add to vector store
-            self.vector_store.add_documents(splits)
-            print(f"Ingested {len(splits)} chunks from {file_path}")
-            
+            seen = set()
+            added = kept = batches = 0
+            embed_seconds = parse_seconds = 0.0
+            waited = time.perf_counter()
+            async for splits in blocks:
+                parse_seconds += time.perf_counter() - waited
+
+                new_ids, new_docs = [], []
+                for doc in splits:
+                    content_hash = hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest()
+                    id_ = chunk_id(source, chunk_position(doc.metadata), content_hash)
+                    if id_ in seen:
+                        continue
+                    seen.add(id_)
+                    # doc_hash is set below, once the whole file is stored
+                    doc.metadata.update({"source": source, "chunk_hash": content_hash})
+                    if id_ in stored:
+                        kept += 1
+                    else:
+                        new_ids.append(id_)
+                        new_docs.append(doc)
+
+                offset = added
+                block_stats = await self._add_in_batches(
+                    new_ids, new_docs, lambda done, total: progress(offset + done, offset + total)
+                )
+                added += len(new_ids)
+                batches += block_stats["batches"]
+                embed_seconds += block_stats["seconds"]
+                waited = time.perf_counter()
+
+            stale_ids = [id_ for id_ in stored if id_ not in seen]
+            if stale_ids:
+                await self._run_ingest(self.vector_store.delete, ids=stale_ids)
+                self.answer_cache.invalidate()
+            if seen:
+                # Marks the file complete: only now can the next run skip it
+                await self._run_ingest(self._update_doc_hash, list(seen), doc_hash)
+
+            stats = {
+                "file": source,
+                "chunks": len(seen),
+                "added": added,
+                "skipped": kept,
+                "deleted": len(stale_ids),
+                "unchanged": False,
+                "batches": batches,
+                "seconds": round(embed_seconds, 3),
+                "chunks_per_sec": round(added / embed_seconds, 2) if embed_seconds > 0 else 0.0,
+                "seconds_parse": round(parse_seconds, 3),
+                "seconds_total": round(time.perf_counter() - started, 3),
+            }
+            print(
+                f"Ingested {source}: {stats['added']} new, {stats['skipped']} unchanged, "
+                f"{stats['deleted']} removed chunks ({stats['chunks_per_sec']} chunks/sec embedding+insert)"
+            )
+            return stats
         except Exception as e:
             print(f"Error ingesting {file_path}: {e}")
             raise
 
-    async def query(self, text: str, mode: str = "hybrid", filters: dict = None) -> str:
-        # Construct retriever with filters if provided
-        # PGVector supports metadata filtering
-        search_kwargs = {"k": 5}
-        if filters:
-            search_kwargs["filter"] = filters
+    def _stored_chunks(self, source: str) -> dict:
+        """
+        Returns {chunk id: doc_hash} for the chunks of source already in the collection.
+        """
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        with self.vector_store.session_maker() as session:
+            collection = self.vector_store.get_collection(session)
+            if not collection:
+                return {}
+            rows = (
+                session.query(EmbeddingStore.id, EmbeddingStore.cmetadata["doc_hash"].astext)
+                .filter(
+                    EmbeddingStore.collection_id == collection.uuid,
+                    EmbeddingStore.cmetadata["source"].astext == source,
+                )
+                .all()
+            )
+        return {row[0]: row[1] for row in rows}
 
-        retriever = self.vector_store.as_retriever(search_kwargs=search_kwargs)
-        
-        # Simple RetrievalQA chain
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=False
+    def _update_doc_hash(self, ids: list, doc_hash: str):
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        with self.vector_store.session_maker() as session:
+            session.query(EmbeddingStore).filter(EmbeddingStore.id.in_(ids)).update(
+                {EmbeddingStore.cmetadata: EmbeddingStore.cmetadata.op("||")(cast({"doc_hash": doc_hash}, JSONB))},
+                synchronize_session=False,
+            )
+            session.commit()
+
+    async def _parse_whole(self, file_path: str, parse_executor=None, source: str = None):
+        loop = asyncio.get_running_loop()
+        yield await loop.run_in_executor(parse_executor or self._ingest_executor, load_and_split, file_path, source)
+
+    async def _iter_in_executor(self, iterator):
+        # Pulls items from a blocking iterator without blocking the event loop
+        done = object()
+        while True:
+            item = await self._run_ingest(next, iterator, done)
+            if item is done:
+                return
+            yield item
+
+    async def _run_ingest(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(self._ingest_executor, functools.partial(context.run, func, *args, **kwargs))
+
+    async def _add_in_batches(self, ids: list, splits: list, progress=None) -> dict:
+        total = len(splits)
+        batches = [
+            (ids[i:i + self.ingest_batch_size], splits[i:i + self.ingest_batch_size])
+            for i in range(0, total, self.ingest_batch_size)
+        ]
+        semaphore = asyncio.Semaphore(self.ingest_concurrency)
+        done = 0
+        failed = False
+        started = time.perf_counter()
+
+        async def add_batch(batch_ids, batch):
+            nonlocal done, failed
+            async with semaphore:
+                # Once a batch failed, the ones not started or not inserted yet are dropped
+                if failed:
+                    return
+                try:
+                    texts = [doc.page_content for doc in batch]
+                    metadatas = [doc.metadata for doc in batch]
+                    with metrics.span("ingest_embed"):
+                        vectors = await self._run_ingest(self.embeddings.embed_documents, texts)
+                    if failed:
+                        return
+                    with metrics.span("ingest_insert"):
+                        await self._run_ingest(self.vector_store.add_embeddings, texts, vectors, metadatas=metadatas, ids=batch_ids)
+                except Exception:
+                    failed = True
+                    raise
+                metrics.inc("rag_ingested_chunks_total", len(batch))
+            self.answer_cache.invalidate()
+            done += len(batch)
+            if progress:
+                progress(done, total)
+
+        # Cancelling the other batches wouldn't stop their executor threads,
+        # so every batch is awaited before the first error is raised: nothing
+        # is inserted once the job has failed and the source lock is released.
+        results = await asyncio.gather(
+            *(add_batch(batch_ids, batch) for batch_ids, batch in batches), return_exceptions=True
         )
-        
-        # Run query synchronously (blocking) as PGVector with psycopg2 is sync
-        result = qa_chain.invoke({"query": text})
-        return result["result"]
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            raise errors[0]
 
-    async def query_json(self, text: str, mode: str = "hybrid", filters: dict = None) -> dict:
-        search_kwargs = {"k": 5}
-        if filters:
-            search_kwargs["filter"] = filters
+        elapsed = time.perf_counter() - started
+        return {
+            "batches": len(batches),
+            "seconds": round(elapsed, 3),
+            "chunks_per_sec": round(total / elapsed, 2) if elapsed > 0 else 0.0,
+        }
 
-        retriever = self.vector_store.as_retriever(search_kwargs=search_kwargs)
-        
-        # We want source documents here
-        qa_chain = RetrievalQA.from_chain_type(
-            llm=self.llm,
-            chain_type="stuff",
-            retriever=retriever,
-            return_source_documents=True
+    async def rebuild_indexes(self) -> dict:
+        status = await self._run_ingest(self.index_manager.rebuild)
+        self.answer_cache.invalidate()
+        return status
+
+    async def index_status(self) -> dict:
+        return await self._run_blocking(self.index_manager.status)
+
+    def _lexical_search(self, text: str, k: int, filters: dict = None) -> list:
+        """
+        Full-text search over chunk text (tsvector + GIN), ranked by ts_rank_cd.
+        Terms are OR-ed so partial matches still rank, with documents matching
+        more of them first.
+        """
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        config = self.index_manager.text_search_config
+        tsv = literal_column(f"{EMBEDDING_TABLE}.{TSV_COLUMN}")
+        tsquery = cast(func.replace(cast(func.plainto_tsquery(config, text), Text), "&", "|"), TSQUERY)
+        rank = func.ts_rank_cd(tsv, tsquery)
+
+        with self.vector_store.session_maker() as session:
+            collection = self.vector_store.get_collection(session)
+            if not collection:
+                return []
+            stmt = (
+                select(EmbeddingStore.id, EmbeddingStore.document, EmbeddingStore.cmetadata)
+                .where(EmbeddingStore.collection_id == collection.uuid, tsv.op("@@")(tsquery))
+                .order_by(rank.desc())
+                .limit(k)
+            )
+            if filters:
+                stmt = stmt.where(self.vector_store._create_filter_clause(filters))
+            rows = session.execute(stmt).all()
+        return [Document(id=row.id, page_content=row.document, metadata=row.cmetadata) for row in rows]
+
+    def _vector_search(self, embedding: list, k: int, filters: dict = None) -> list:
+        """
+        Nearest chunks by cosine distance. With quantized storage
+        (RAG_VECTOR_STORAGE) the ANN index searches the compact vectors and
+        the full-precision ones only rerank its candidates.
+        """
+        if self.index_manager.storage == "full":
+            return self.vector_store.similarity_search_by_vector(embedding, k=k, filter=filters or None)
+
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        with self.vector_store.session_maker() as session:
+            collection = self.vector_store.get_collection(session)
+            if not collection:
+                return []
+            criteria = [EmbeddingStore.collection_id == collection.uuid]
+            if filters:
+                criteria.append(self.vector_store._create_filter_clause(filters))
+            rows = session.execute(self.index_manager.rerank_statement(EmbeddingStore, embedding, k, *criteria)).all()
+        return [Document(id=row.id, page_content=row.document, metadata=row.cmetadata) for row in rows]
+
+    def _vector_search_within(self, embedding: list, ids: list, k: int) -> list:
+        # Exact distance ranking restricted to a small candidate set
+        EmbeddingStore = self.vector_store.EmbeddingStore
+        with self.vector_store.session_maker() as session:
+            rows = session.execute(
+                select(EmbeddingStore.id, EmbeddingStore.document, EmbeddingStore.cmetadata)
+                .where(EmbeddingStore.id.in_(ids))
+                .order_by(EmbeddingStore.embedding.cosine_distance(embedding))
+                .limit(k)
+            ).all()
+        return [Document(id=row.id, page_content=row.document, metadata=row.cmetadata) for row in rows]
+
+    async def _retrieve(self, embedding: list, text: str, mode: str = "hybrid", filters: dict = None, k: int = None) -> list:
+        k = k or self.top_k
+        candidates = max(self.hybrid_candidates, k)
+        if mode == "vector":
+            return await self._run_blocking(self._vector_search, embedding, k, filters)
+        if mode == "lexical":
+            return await self._run_blocking(self._lexical_search, text, k, filters)
+
+        if self.lexical_prefilter:
+            pool = await self._run_blocking(self._lexical_search, text, self.prefilter_pool, filters)
+            if len(pool) >= k:
+                return await self._run_blocking(self._vector_search_within, embedding, [doc.id for doc in pool], k)
+
+        vector_docs, lexical_docs = await asyncio.gather(
+            self._run_blocking(self._vector_search, embedding, candidates, filters),
+            self._run_blocking(self._lexical_search, text, candidates, filters),
         )
-        
-        result = qa_chain.invoke({"query": text})
-        
-        answer = result["result"]
-        source_docs = result.get("source_documents", [])
-        
+        return reciprocal_rank_fusion([vector_docs, lexical_docs], k)
+
+    def _scope(self, mode: str, filters: dict = None, extra: str = "") -> str:
+        # Answers built with extra context (memories, web results) only match that same context
+        if extra:
+            return SemanticCache.make_scope(filters=filters, mode=mode, context=hashlib.sha256(extra.encode("utf-8")).hexdigest())
+        return SemanticCache.make_scope(filters=filters, mode=mode)
+
+    @staticmethod
+    def _build_context(documents: list, extra: str = "") -> str:
+        return "\n\n".join(([extra] if extra else []) + [doc.page_content for doc in documents])
+
+    async def _generate(self, text: str, documents: list, extra: str = "") -> str:
+        prompt = QA_PROMPT.format(context=self._build_context(documents, extra), question=text)
+        tokens = estimate_tokens(prompt) + OUTPUT_TOKEN_ESTIMATE
+        with metrics.span("generation"):
+            response = await self.llm_scheduler.run(self.llm.ainvoke, prompt, tokens=tokens)
+        self._count_tokens(prompt, response.content, getattr(response, "usage_metadata", None))
+        return response.content
+
+    @staticmethod
+    def _count_tokens(prompt: str, completion: str, usage: dict = None):
+        # Gemini's usage metadata when LangChain passes it on, else the chars/4 estimate
+        if usage:
+            metrics.count_tokens("rag", usage.get("input_tokens", 0), usage.get("output_tokens", 0))
+        else:
+            metrics.count_tokens("rag", estimate_tokens(prompt), estimate_tokens(completion))
+
+    async def _generate_stream(self, text: str, documents: list, extra: str = ""):
+        prompt = QA_PROMPT.format(context=self._build_context(documents, extra), question=text)
+        tokens = estimate_tokens(prompt) + OUTPUT_TOKEN_ESTIMATE
+        parts, usage = [], None
+        with metrics.span("generation"):
+            async for chunk in self.llm_scheduler.stream(self.llm.astream, prompt, tokens=tokens):
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        self._count_tokens(prompt, "".join(parts), usage)
+
+    async def _retrieve_context(self, embedding: list, text: str, mode: str, filters: dict = None) -> tuple:
+        """
+        Retrieves the documents for the prompt: extra candidates packed into
+        the token budget, or the top_k chunks if packing is off. Returns
+        (documents, degraded); degraded is True when retrieval timed out and
+        the answer goes without documents, so it must not be cached.
+        """
+        k = self.context_packer.candidates if self.context_packer.enabled else self.top_k
+        try:
+            with metrics.span("retrieval"):
+                documents = await asyncio.wait_for(self._retrieve(embedding, text, mode, filters, k=k), self.retrieval_timeout)
+        except asyncio.TimeoutError:
+            print(f"Retrieval timed out after {self.retrieval_timeout}s, answering without documents")
+            metrics.inc("rag_retrieval_timeouts_total")
+            return [], True
+        if not self.context_packer.enabled:
+            return documents, False
+        with metrics.span("context_packing"):
+            documents, _ = self.context_packer.pack(documents, self.top_k)
+        return documents, False
+
+    async def _embed_query(self, text: str) -> list:
+        with metrics.span("embedding"):
+            return await self._run_blocking(self.embeddings.embed_query, text)
+
+    async def _embed_and_retrieve(self, text: str, mode: str, filters: dict = None) -> tuple:
+        embedding = await self._embed_query(text)
+        return (embedding, *await self._retrieve_context(embedding, text, mode, filters))
+
+    async def _prepare(self, text: str, mode: str, filters: dict = None, extra_context=None) -> tuple:
+        """
+        Embeds the query, checks the semantic cache and retrieves documents.
+        Returns (embedding, scope, extra, cached, documents, degraded);
+        documents is None on a cache hit, degraded as in _retrieve_context.
+
+        extra_context is an optional awaitable resolving to additional context
+        text (memories, web results). It runs concurrently with embedding and
+        retrieval; since the cache scope depends on it, the cache is checked
+        once everything has arrived.
+        """
+        if extra_context is None:
+            embedding = await self._embed_query(text)
+            scope = self._scope(mode, filters)
+            cached = self.answer_cache.get(embedding, scope)
+            if cached is not None:
+                return embedding, scope, "", cached, None, False
+            documents, degraded = await self._retrieve_context(embedding, text, mode, filters)
+            return embedding, scope, "", None, documents, degraded
+
+        (embedding, documents, degraded), extra = await asyncio.gather(
+            self._embed_and_retrieve(text, mode, filters), extra_context
+        )
+        extra = extra or ""
+        scope = self._scope(mode, filters, extra)
+        cached = self.answer_cache.get_exact(text, scope)
+        if cached is None:
+            cached = self.answer_cache.get(embedding, scope)
+        if cached is not None:
+            return embedding, scope, extra, cached, None, False
+        return embedding, scope, extra, None, documents, degraded
+
+    async def _answer(self, text: str, mode: str = "hybrid", filters: dict = None, extra_context=None) -> tuple:
+        mode = normalize_mode(mode)
+        if extra_context is None:
+            cached = self.answer_cache.get_exact(text, self._scope(mode, filters))
+            if cached is not None:
+                return cached
+
+        async with self._query_semaphore:
+            generation = self.answer_cache.generation
+            # Embed once: the vector serves both the cache lookup and retrieval.
+            embedding, scope, extra, cached, documents, degraded = await self._prepare(text, mode, filters, extra_context)
+            if cached is not None:
+                return cached
+            answer = await self._generate(text, documents, extra)
+
+        if not degraded:
+            self.answer_cache.put(text, embedding, scope, (answer, documents), generation=generation)
+        return answer, documents
+
+    async def query(self, text: str, mode: str = "hybrid", filters: dict = None, extra_context=None) -> str:
+        answer, _ = await self._answer(text, mode, filters, extra_context)
+        return answer
+
+    async def query_stream(self, text: str, mode: str = "hybrid", filters: dict = None, extra_context=None):
+        """
+        Same as query, but yields the answer in pieces as Gemini produces them.
+        Cached answers are yielded in one piece.
+        """
+        mode = normalize_mode(mode)
+        cached = None
+        if extra_context is None:
+            cached = self.answer_cache.get_exact(text, self._scope(mode, filters))
+        if cached is None:
+            # The query slot covers retrieval and the start of generation, but
+            # is released before the first token goes out: a slow client
+            # reading the stream mustn't hold it.
+            await self._query_semaphore.acquire()
+            holding = True
+            try:
+                generation = self.answer_cache.generation
+                embedding, scope, extra, cached, documents, degraded = await self._prepare(text, mode, filters, extra_context)
+                if cached is None:
+                    parts = []
+                    async for token in self._generate_stream(text, documents, extra):
+                        if holding:
+                            self._query_semaphore.release()
+                            holding = False
+                        parts.append(token)
+                        yield token
+                    if not degraded:
+                        self.answer_cache.put(text, embedding, scope, ("".join(parts), documents), generation=generation)
+                    return
+            finally:
+                if holding:
+                    self._query_semaphore.release()
+        yield cached[0]
+
+    async def query_json(self, text: str, mode: str = "hybrid", filters: dict = None) -> dict:
+        answer, source_docs = await self._answer(text, mode, filters)
+        return self._format_result(text, answer, source_docs, mode, filters)
+
+    async def query_batch(self, texts: list, mode: str = "hybrid", filters: dict = None):
+        """
+        Answers several questions, yielding (index, query_json-style result)
+        as each one completes. Repeated questions are answered once; the
+        uncached ones are embedded in a single batched call, and at most
+        batch_concurrency of them are retrieved and generated at once, at
+        background priority so interactive queries keep their quota. Each
+        retrieval also takes a slot of the service-wide query semaphore, so a
+        batch can't fill the retrieval thread pool ahead of /chat. A failed
+        question yields {"query", "error"} instead of ending the batch.
+        """
+        mode = normalize_mode(mode)
+        scope = self._scope(mode, filters)
+        # First occurrence of each question -> indexes of all its occurrences
+        questions = {}
+        first = {}
+        for index, text in enumerate(texts):
+            key = " ".join(text.split())
+            first.setdefault(key, text)
+            questions.setdefault(first[key], []).append(index)
+        metrics.inc("rag_batch_queries_total", len(texts))
+
+        def results(text, answer, documents):
+            result = self._format_result(text, answer, documents, mode, filters)
+            return [(index, result) for index in questions[text]]
+
+        def errors(text, error):
+            return [(index, {"query": text, "error": str(error)}) for index in questions[text]]
+
+        pending = []
+        for text in questions:
+            cached = self.answer_cache.get_exact(text, scope)
+            if cached is None:
+                pending.append(text)
+                continue
+            for item in results(text, *cached):
+                yield item
+        if not pending:
+            return
+
+        generation = self.answer_cache.generation
+        semaphore = asyncio.Semaphore(self.batch_concurrency)
+
+        async def answer_one(text, embedding):
+            try:
+                cached = self.answer_cache.get(embedding, scope)
+                if cached is not None:
+                    return results(text, *cached)
+                async with semaphore:
+                    async with self._query_semaphore:
+                        documents, degraded = await self._retrieve_context(embedding, text, mode, filters)
+                    answer = await self._generate(text, documents)
+                if not degraded:
+                    self.answer_cache.put(text, embedding, scope, (answer, documents), generation=generation)
+                return results(text, answer, documents)
+            except Exception as e:
+                return errors(text, e)
+
+        try:
+            with llm_priority(PRIORITY_BACKGROUND), metrics.span("embedding"):
+                embeddings = await self._run_blocking(self.embeddings.embed_queries, pending)
+        except Exception as e:
+            for text in pending:
+                for item in errors(text, e):
+                    yield item
+            return
+
+        # Tasks copy the context, so their calls keep the background priority
+        with llm_priority(PRIORITY_BACKGROUND):
+            tasks = [asyncio.ensure_future(answer_one(text, embedding)) for text, embedding in zip(pending, embeddings)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                for item in await task:
+                    yield item
+        finally:
+            # The client went away: don't keep generating for it
+            for task in tasks:
+                task.cancel()
+
+    def _format_result(self, text: str, answer: str, source_docs: list, mode: str, filters: dict = None) -> dict:
+        # With context packing the prompt may hold more than top_k (trimmed)
+        # chunks; sources keeps the top_k most relevant, as before packing,
+        # while context_tokens counts everything sent
         sources = []
-        for doc in source_docs:
+        for doc in source_docs[:self.top_k]:
             sources.append({
                 "content": doc.page_content[:200] + "...",
                 "metadata": doc.metadata
@@ -137,5 +862,7 @@ class RAGService:
             "query": text,
             "answer": answer,
             "sources": sources,
-            "filters": filters
+            "filters": filters,
+            "mode": normalize_mode(mode),
+            "context_tokens": sum(estimate_tokens(doc.page_content) for doc in source_docs),
         }
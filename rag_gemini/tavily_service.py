@@ -1,15 +1,74 @@
 import os
-from tavily import TavilyClient
+import json
+import time
+import asyncio
+from collections import OrderedDict
+import httpx
+from metrics import metrics
 
 class TavilyService:
-    def __init__(self, api_key: str = None):
+    """
+    Async client for the Tavily search API over a pooled httpx connection.
+    Results are cached for cache_ttl seconds per (query, depth, max_results),
+    and concurrent identical searches share a single outbound request.
+    TAVILY_BASE_URL points it at another server (e.g. a local stand-in);
+    transport replaces the network altogether (e.g. httpx.MockTransport).
+    """
+    def __init__(self, api_key: str = None, base_url: str = None, transport: httpx.AsyncBaseTransport = None):
         self.api_key = api_key or os.getenv("TAVILY_API_KEY")
+        self.base_url = (base_url or os.getenv("TAVILY_BASE_URL", "https://api.tavily.com")).rstrip("/")
+        self.cache_ttl = float(os.getenv("TAVILY_CACHE_TTL", "600"))
+        self.cache_max_entries = int(os.getenv("TAVILY_CACHE_MAX_ENTRIES", "256"))
+
+        self._cache = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
         if not self.api_key:
             # We don't raise error immediately to allow app to start if key is missing
             print("Warning: TAVILY_API_KEY is not set. Search functionality will be disabled.")
             self.client = None
         else:
-            self.client = TavilyClient(api_key=self.api_key)
+            max_connections = int(os.getenv("TAVILY_MAX_CONNECTIONS", "10"))
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=float(os.getenv("TAVILY_TIMEOUT", "10")),
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+                transport=transport,
+            )
+
+    async def close(self):
+        if self.client:
+            await self.client.aclose()
+
+    def _cached(self, key):
+        entry = self._cache.get(key)
+        if entry is None:
+            return None
+        created_at, value = entry
+        if time.monotonic() - created_at > self.cache_ttl:
+            del self._cache[key]
+            return None
+        self._cache.move_to_end(key)
+        return value
+
+    def _store(self, key, value):
+        self._cache[key] = (time.monotonic(), value)
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.cache_max_entries:
+            self._cache.popitem(last=False)
+
+    async def _request(self, query: str, search_depth: str, max_results: int) -> dict:
+        response = await self.client.post("/search", json={
+            "query": query,
+            "search_depth": search_depth,
+            "max_results": max_results,
+        })
+        response.raise_for_status()
+        return response.json()
 
     async def search(self, query: str, search_depth: str = "basic", max_results: int = 5) -> dict:
         """
@@ -17,34 +76,55 @@ class TavilyService:
         """
         if not self.client:
             raise ValueError("Tavily API key is not configured.")
-        
-        # Tavily python client is sync, but we can wrap it or just call it.
-        # For high concurrency, running in executor is better, but for now direct call is fine.
+
+        key = (" ".join(query.split()), search_depth, max_results)
+        cached = self._cached(key)
+        if cached is not None:
+            self.hits += 1
+            return cached
+
+        task = self._inflight.get(key)
+        if task:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+            task = asyncio.ensure_future(self._request(query, search_depth, max_results))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+
         try:
-            response = self.client.search(
-                query=query,
-                search_depth=search_depth,
-                max_results=max_results
-            )
-            return response
+            # Shielded: a caller timing out must not cancel the request the others are waiting on
+            with metrics.span("web_search"):
+                response = await asyncio.shield(task)
         except Exception as e:
             print(f"Error searching with Tavily: {e}")
             raise
+        self._store(key, response)
+        return response
 
-    async def get_search_context(self, query: str, search_depth: str = "basic", max_tokens: int = 4000) -> str:
+    async def get_search_context(self, query: str, search_depth: str = "basic", max_tokens: int = 4000, max_results: int = 5) -> str:
         """
-        Gets a context string from search results suitable for LLM context.
+        Gets a context string from search results suitable for LLM context:
+        a JSON list of {url, content}, trimmed to roughly max_tokens.
         """
-        if not self.client:
-            raise ValueError("Tavily API key is not configured.")
+        response = await self.search(query, search_depth=search_depth, max_results=max_results)
 
-        try:
-            context = self.client.get_search_context(
-                query=query,
-                search_depth=search_depth,
-                max_tokens=max_tokens
-            )
-            return context
-        except Exception as e:
-            print(f"Error getting search context with Tavily: {e}")
-            raise
+        # ~4 characters per token
+        budget = max_tokens * 4
+        sources = []
+        for result in response.get("results", []):
+            source = {"url": result.get("url"), "content": result.get("content", "")}
+            budget -= len(json.dumps(source, ensure_ascii=False))
+            if budget < 0:
+                break
+            sources.append(source)
+        return json.dumps(sources, ensure_ascii=False)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }
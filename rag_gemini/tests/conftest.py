@@ -0,0 +1,17 @@
+import os
+import sys
+import time
+import pytest
+
+# The service modules import each other as top-level modules (they run from
+# rag_gemini/), so the tests need that directory on the path too
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Frozen time.monotonic; advance it with clock[0] += seconds.
+    """
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    return now
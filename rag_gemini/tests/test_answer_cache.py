@@ -0,0 +1,57 @@
+import pytest
+from answer_cache import SemanticCache
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    return SemanticCache(threshold=0.95, max_entries=3, ttl=60)
+
+SCOPE = SemanticCache.make_scope(mode="vector", filters=None)
+
+def test_similar_query_hits_within_scope(cache):
+    cache.put("¿Qué es un contrato estatal?", [1.0, 0.0, 0.0], SCOPE, "respuesta")
+    assert cache.get([0.99, 0.05, 0.0], SCOPE) == "respuesta"
+    assert cache.get([0.0, 1.0, 0.0], SCOPE) is None
+    assert cache.get([1.0, 0.0, 0.0], SemanticCache.make_scope(mode="hybrid", filters=None)) is None
+    assert cache.stats()["hits"] == 1
+
+def test_exact_lookup_normalizes_text(cache):
+    cache.put("¿Qué es un contrato  estatal?", [1.0, 0.0], SCOPE, "respuesta")
+    assert cache.get_exact("  ¿qué es un CONTRATO estatal? ", SCOPE) == "respuesta"
+    assert cache.get_exact("otra pregunta", SCOPE) is None
+
+def test_entries_expire_after_ttl(cache, clock):
+    cache.put("pregunta", [1.0, 0.0], SCOPE, "respuesta")
+    clock[0] += 59
+    assert cache.get_exact("pregunta", SCOPE) == "respuesta"
+    clock[0] += 2
+    assert cache.get_exact("pregunta", SCOPE) is None
+    assert cache.get([1.0, 0.0], SCOPE) is None
+    assert cache.stats()["entries"] == 0
+
+def test_least_recently_used_entry_is_evicted(cache):
+    for n in range(3):
+        cache.put(f"pregunta {n}", [1.0, float(n)], SCOPE, n)
+    assert cache.get_exact("pregunta 0", SCOPE) == 0
+    cache.put("pregunta 3", [1.0, 3.0], SCOPE, 3)
+    assert cache.get_exact("pregunta 1", SCOPE) is None
+    assert cache.get_exact("pregunta 0", SCOPE) == 0
+    assert cache.stats()["evictions"] == 1
+
+def test_answers_from_an_older_generation_are_not_stored(cache):
+    generation = cache.generation
+    cache.put("pregunta", [1.0, 0.0], SCOPE, "vieja")
+    cache.invalidate()
+    assert cache.get_exact("pregunta", SCOPE) is None
+    # A query that started before the invalidation finishes afterwards
+    cache.put("pregunta", [1.0, 0.0], SCOPE, "vieja", generation=generation)
+    assert cache.get_exact("pregunta", SCOPE) is None
+    cache.put("pregunta", [1.0, 0.0], SCOPE, "nueva", generation=cache.generation)
+    assert cache.get_exact("pregunta", SCOPE) == "nueva"
+
+def test_disabled_cache_stores_nothing(monkeypatch):
+    monkeypatch.setenv("RAG_CACHE_ENABLED", "false")
+    cache = SemanticCache(threshold=0.95, max_entries=3, ttl=60)
+    cache.put("pregunta", [1.0, 0.0], SCOPE, "respuesta")
+    assert cache.get_exact("pregunta", SCOPE) is None
+    assert cache.get([1.0, 0.0], SCOPE) is None
@@ -0,0 +1,28 @@
+import asyncio
+import pytest
+import app
+
+class FakeMemoryService:
+    def __init__(self, result):
+        self.result = result
+
+    def search(self, query, user_id="default_user", limit=5):
+        if isinstance(self.result, Exception):
+            raise self.result
+        return self.result
+
+def extra_context(monkeypatch, memory_result):
+    monkeypatch.setattr(app, "memory_service", FakeMemoryService(memory_result))
+    monkeypatch.setattr(app, "tavily_service", None)
+    return asyncio.run(app.fetch_extra_context(app.QueryRequest(text="¿Qué dice la Ley 80?", user_id="ana")))
+
+@pytest.mark.parametrize("result", [
+    [{"memory": "Trabaja en contratación pública"}],
+    {"results": [{"memory": "Trabaja en contratación pública"}]},
+])
+def test_memories_in_either_mem0_shape(monkeypatch, result):
+    assert extra_context(monkeypatch, result) == "Relevant Memory:\nTrabaja en contratación pública"
+
+@pytest.mark.parametrize("result", [RuntimeError("mem0 down"), [{"text": "sin clave memory"}], {"results": None}])
+def test_memory_failures_degrade_to_no_context(monkeypatch, result):
+    assert extra_context(monkeypatch, result) == ""
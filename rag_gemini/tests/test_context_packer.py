@@ -0,0 +1,48 @@
+from langchain.docstore.document import Document
+from context_packer import ContextPacker
+from llm_scheduler import estimate_tokens
+
+def doc(text, id=None):
+    return Document(id=id, page_content=text, metadata={"source": id})
+
+def words(prefix, count):
+    return " ".join(f"{prefix}{n}" for n in range(count))
+
+def test_near_duplicates_are_dropped():
+    text = words("contrato", 60)
+    documents = [doc(text, "a"), doc(text + " fin", "b"), doc(words("garantia", 60), "c")]
+    packed, stats = ContextPacker(budget_tokens=2000).pack(documents, top_k=3)
+    assert [d.id for d in packed] == ["a", "c"]
+    assert stats["duplicates_dropped"] == 1
+
+def test_chunk_overlap_is_cut():
+    shared = words("traslape", 20)
+    first = words("inicio", 40) + " " + shared
+    second = shared + " " + words("final", 40)
+    packer = ContextPacker(budget_tokens=2000)
+    packed, _ = packer.pack([doc(first, "a"), doc(second, "b")], top_k=2)
+    assert packed[0].page_content == first
+    assert packed[1].page_content == words("final", 40)
+    assert packer.overlap_chars_cut == len(shared)
+
+def test_budget_is_respected_and_last_chunk_truncated():
+    documents = [doc(words(f"d{i}x", 100), str(i)) for i in range(5)]
+    packed, stats = ContextPacker(budget_tokens=400).pack(documents, top_k=5)
+    assert stats["tokens"] <= 400
+    assert packed[-1].page_content.endswith("...")
+    assert stats["tokens_saved"] == sum(estimate_tokens(d.page_content) for d in documents) - stats["tokens"]
+
+def test_relevance_order_is_kept_for_distinct_chunks():
+    documents = [doc(words(f"tema{i}x", 30), str(i)) for i in range(4)]
+    packed, stats = ContextPacker(budget_tokens=2000).pack(documents, top_k=4)
+    assert [d.id for d in packed] == ["0", "1", "2", "3"]
+    assert stats["duplicates_dropped"] == 0
+    assert packed[0].metadata == {"source": "0"}
+
+def test_stats_accumulate_across_queries():
+    packer = ContextPacker(budget_tokens=2000)
+    packer.pack([doc(words("a", 30), "a")], top_k=1)
+    packer.pack([doc(words("b", 30), "b")], top_k=1)
+    stats = packer.stats()
+    assert stats["queries"] == 2
+    assert stats["tokens_saved"] == 0
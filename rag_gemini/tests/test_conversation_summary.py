@@ -0,0 +1,106 @@
+import gc
+import json
+import random
+import asyncio
+import pytest
+from conversation_summary import ConversationSummarizer
+
+class FakeMemoryService:
+    """
+    Mem0 stand-in: get_all returns at most limit memories, in random order.
+    """
+    def __init__(self, wrap_results=False):
+        self.memories = {}
+        self.wrap_results = wrap_results
+
+    def add(self, user_id, memory_id, text):
+        self.memories.setdefault(user_id, {})[memory_id] = text
+
+    def get_all(self, user_id="default_user", limit=100):
+        items = [{"id": key, "memory": text} for key, text in self.memories.get(user_id, {}).items()]
+        random.shuffle(items)
+        items = items[:limit]
+        return {"results": items} if self.wrap_results else items
+
+class FakeGeminiClient:
+    def __init__(self):
+        self.prompts = []
+
+    async def generate_content(self, model_name, prompt, system_prompt=None, generation_config=None):
+        self.prompts.append(prompt)
+        return json.dumps({
+            "resumen_conversacion": f"resumen {len(self.prompts)}",
+            "puntos_importantes": [],
+            "pasos_desarrollo": [],
+        })
+
+@pytest.fixture
+def make_summarizer(tmp_path, monkeypatch):
+    monkeypatch.delenv("SUMMARY_MAX_DELTA_CHARS", raising=False)
+    monkeypatch.delenv("SUMMARY_MEMORY_LIMIT", raising=False)
+
+    def make(memory_service=None):
+        return ConversationSummarizer(
+            memory_service or FakeMemoryService(), FakeGeminiClient(), path=str(tmp_path / "summaries.sqlite3")
+        )
+    return make
+
+def test_only_changed_memories_are_sent(make_summarizer):
+    summarizer = make_summarizer()
+    memories, gemini = summarizer.memory_service, summarizer.gemini_client
+    memories.add("ana", "1", "Trabaja en contratación pública")
+    memories.add("ana", "2", "Prepara una licitación")
+
+    first = asyncio.run(summarizer.summarize("ana"))
+    assert first["version"] == 1
+    assert "Trabaja en contratación pública" in gemini.prompts[0]
+
+    assert asyncio.run(summarizer.summarize("ana"))["version"] == 1
+    assert len(gemini.prompts) == 1
+
+    memories.add("ana", "2", "Prepara una licitación de obra")
+    memories.add("ana", "3", "Necesita la Ley 80 de 1993")
+    assert asyncio.run(summarizer.summarize("ana"))["version"] == 2
+    prompt = gemini.prompts[1]
+    assert "resumen 1" in prompt
+    assert "Trabaja en contratación pública" not in prompt
+    assert "- Prepara una licitación de obra\n" in prompt
+    assert "- Necesita la Ley 80 de 1993" in prompt
+    assert prompt.endswith("Removed memories:\n- Prepara una licitación")
+    assert summarizer.stats() == {"hits": 1, "updates": 2, "memories_sent": 5}
+
+def test_all_memories_are_read_past_the_mem0_limit(make_summarizer, monkeypatch):
+    # More memories than Mem0's default limit (100) and than the first request asks for
+    monkeypatch.setenv("SUMMARY_MEMORY_LIMIT", "64")
+    summarizer = make_summarizer(FakeMemoryService(wrap_results=True))
+    for n in range(150):
+        summarizer.memory_service.add("ana", str(n), f"memoria {n}")
+
+    asyncio.run(summarizer.summarize("ana"))
+    assert all(f"- memoria {n}\n" in summarizer.gemini_client.prompts[0] + "\n" for n in range(150))
+    # Unordered, truncated lists would flip memories between added and removed
+    for _ in range(5):
+        assert asyncio.run(summarizer.summarize("ana"))["version"] == 1
+    assert len(summarizer.gemini_client.prompts) == 1
+
+def test_large_deltas_are_folded_in_steps(make_summarizer, monkeypatch):
+    monkeypatch.setenv("SUMMARY_MAX_DELTA_CHARS", "50")
+    summarizer = make_summarizer()
+    for n in range(6):
+        # 20 characters each: two per step
+        summarizer.memory_service.add("ana", str(n), f"memoria {n} " + "x" * 10)
+
+    assert asyncio.run(summarizer.summarize("ana"))["version"] == 1
+    assert len(summarizer.gemini_client.prompts) == 3
+    # Each step builds on the summary of the previous one
+    assert "resumen 2" in summarizer.gemini_client.prompts[2]
+
+def test_user_locks_are_not_kept(make_summarizer):
+    summarizer = make_summarizer()
+
+    async def scenario():
+        await asyncio.gather(*(summarizer.summarize(f"user{n}") for n in range(50)))
+
+    asyncio.run(scenario())
+    gc.collect()
+    assert len(summarizer._user_locks) == 0
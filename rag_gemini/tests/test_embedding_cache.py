@@ -0,0 +1,77 @@
+import asyncio
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+
+class CountingEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return [float(len(text)), 0.0]
+
+def test_keys_normalize_whitespace_and_unicode():
+    cache = EmbeddingCache(max_entries=10)
+    cache.put("m", "retrieval_query", "contrato  estatal\n", [1.0])
+    assert cache.get("m", "retrieval_query", " contrato estatal") == [1.0]
+    # "\u00e9" composed vs. "e" + combining accent
+    cache.put("m", None, "caf\u00e9", [2.0])
+    assert cache.get("m", None, "cafe\u0301") == [2.0]
+    assert cache.get("m", "retrieval_document", "contrato estatal") is None
+    assert cache.get("otro", "retrieval_query", "contrato estatal") is None
+
+def test_lru_eviction():
+    cache = EmbeddingCache(max_entries=2)
+    cache.put("m", None, "a", [1.0])
+    cache.put("m", None, "b", [2.0])
+    cache.get("m", None, "a")
+    cache.put("m", None, "c", [3.0])
+    assert cache.get("m", None, "b") is None
+    assert cache.get("m", None, "a") == [1.0]
+    assert cache.stats()["entries"] == 2
+
+def test_embed_many_only_embeds_missing_texts_once():
+    cache = EmbeddingCache(max_entries=10)
+    cache.put("m", None, "a", [9.0])
+    calls = []
+
+    def embed_fn(texts):
+        calls.append(texts)
+        return [[float(len(text))] for text in texts]
+
+    vectors = cache.embed_many("m", None, ["a", "bb", "ccc", "bb"], embed_fn)
+    assert vectors == [[9.0], [2.0], [3.0], [2.0]]
+    assert calls == [["bb", "ccc"]]
+    assert cache.embed_many("m", None, ["ccc"], embed_fn) == [[3.0]]
+    assert len(calls) == 1
+
+def test_aembed_many():
+    cache = EmbeddingCache(max_entries=10)
+
+    async def embed_fn(texts):
+        return [[float(len(text))] for text in texts]
+
+    assert asyncio.run(cache.aembed_many("m", None, ["a", "bb", "a"], embed_fn)) == [[1.0], [2.0], [1.0]]
+    assert cache.stats()["misses"] == 3
+
+def test_vectors_survive_a_restart_with_a_path(tmp_path):
+    path = str(tmp_path / "cache" / "embeddings.sqlite")
+    EmbeddingCache(max_entries=10, path=path).put("m", "retrieval_query", "texto", [0.5, 0.25])
+    cache = EmbeddingCache(max_entries=10, path=path)
+    assert cache.get("m", "retrieval_query", "texto") == [0.5, 0.25]
+    assert cache.get("m", "retrieval_query", "texto") == [0.5, 0.25]
+    stats = cache.stats()
+    assert (stats["disk_hits"], stats["hits"], stats["persistent"]) == (1, 1, True)
+
+def test_cached_embeddings_wrapper():
+    inner = CountingEmbeddings()
+    embeddings = CachedEmbeddings(inner, "m", cache=EmbeddingCache(max_entries=10))
+    assert embeddings.embed_documents(["uno", "dos"]) == [[3.0, 1.0], [3.0, 1.0]]
+    assert embeddings.embed_documents(["dos", "tres"]) == [[3.0, 1.0], [4.0, 1.0]]
+    assert embeddings.embed_query("uno") == [3.0, 0.0]
+    assert embeddings.embed_query("uno") == [3.0, 0.0]
+    # Queries and documents use different task types, so "uno" is embedded twice
+    assert inner.calls == [["uno", "dos"], ["tres"], ["uno"]]
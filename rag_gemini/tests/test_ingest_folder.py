@@ -0,0 +1,51 @@
+import os
+import json
+from ingest_folder import Manifest
+
+def write(path, content):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+
+def test_unknown_files_have_no_state(tmp_path):
+    document = tmp_path / "Ley_80.pdf"
+    write(document, "uno")
+
+    assert Manifest(str(tmp_path / "manifest.json")).state(str(document)) is None
+
+def test_recorded_state_survives_a_restart(tmp_path):
+    document, manifest_path = tmp_path / "Ley_80.pdf", str(tmp_path / "manifest.json")
+    write(document, "uno")
+
+    Manifest(manifest_path).update(str(document), state="uploaded", job_id="abc")
+    entry = Manifest(manifest_path).state(str(document))
+
+    assert entry["state"] == "uploaded" and entry["job_id"] == "abc"
+    assert not os.path.exists(f"{manifest_path}.tmp")
+    with open(manifest_path, encoding="utf-8") as f:
+        assert json.load(f)[str(document)]["state"] == "uploaded"
+
+def test_updates_merge_into_the_entry(tmp_path):
+    document = tmp_path / "Ley_80.pdf"
+    write(document, "uno")
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+
+    manifest.update(str(document), state="uploaded", job_id="abc")
+    manifest.update(str(document), state="done")
+
+    assert manifest.state(str(document))["job_id"] == "abc"
+    assert manifest.state(str(document))["state"] == "done"
+
+def test_a_changed_file_is_uploaded_again(tmp_path):
+    document, resized, touched = (tmp_path / name for name in ("a.pdf", "b.pdf", "c.pdf"))
+    manifest = Manifest(str(tmp_path / "manifest.json"))
+    for path in (document, resized, touched):
+        write(path, "uno")
+        manifest.update(str(path), state="done")
+
+    write(resized, "uno dos")
+    stat = os.stat(touched)
+    os.utime(touched, (stat.st_atime, stat.st_mtime + 10))
+
+    assert manifest.state(str(document))["state"] == "done"
+    assert manifest.state(str(resized)) is None
+    assert manifest.state(str(touched)) is None
@@ -0,0 +1,65 @@
+import io
+import os
+import asyncio
+import pytest
+import app
+from ingest_jobs import IngestJobManager, normalize_source
+
+class FailingFile(io.BytesIO):
+    def read(self, *args):
+        raise OSError("disk full")
+
+class Upload:
+    def __init__(self, filename, file):
+        self.filename = filename
+        self.file = file
+
+@pytest.mark.parametrize("name, expected", [
+    ("a/Decreto.pdf", "a/Decreto.pdf"),
+    ("a\\b\\Decreto.pdf", "a/b/Decreto.pdf"),
+    ("/srv/docs/./Ley 80.pdf", "srv/docs/Ley 80.pdf"),
+    ("../../etc/Decreto.pdf", "etc/Decreto.pdf"),
+    ("a/../b/Decreto.pdf", "b/Decreto.pdf"),
+    ("..", ""),
+])
+def test_normalize_source(name, expected):
+    assert normalize_source(name) == expected
+
+def test_jobs_keep_the_relative_source_but_store_under_the_base_name(tmp_path):
+    manager = IngestJobManager(None, str(tmp_path))
+
+    job = manager.create_job("../a\\Decreto.pdf")
+    other = manager.create_job("b/Decreto.pdf")
+
+    assert (job.source, other.source) == ("a/Decreto.pdf", "b/Decreto.pdf")
+    assert job.filename == "Decreto.pdf"
+    assert os.path.dirname(job.file_path) == str(tmp_path)
+    assert job.file_path != other.file_path
+
+def test_an_explicit_source_wins_over_the_filename(tmp_path):
+    manager = IngestJobManager(None, str(tmp_path))
+
+    assert manager.create_job("upload.pdf", source="leyes/Ley_80.pdf").source == "leyes/Ley_80.pdf"
+
+def batch(monkeypatch, tmp_path, uploads):
+    manager = IngestJobManager(None, str(tmp_path))
+    monkeypatch.setattr(app, "rag_service", object())
+    monkeypatch.setattr(app, "ingest_jobs", manager)
+    return manager, asyncio.run(app.ingest_documents(uploads))
+
+def test_batch_reports_files_that_could_not_be_stored(monkeypatch, tmp_path):
+    manager, response = batch(monkeypatch, tmp_path, [
+        Upload("a/Ley_80.pdf", io.BytesIO(b"uno")),
+        Upload("b/Decreto.pdf", FailingFile()),
+        Upload("c/Ley_1150.pdf", io.BytesIO(b"tres")),
+    ])
+
+    states = [(job["source"], job["state"]) for job in response["jobs"]]
+    assert states == [("a/Ley_80.pdf", "queued"), ("b/Decreto.pdf", "failed"), ("c/Ley_1150.pdf", "queued")]
+    assert "disk full" in response["jobs"][1]["error"]
+    assert manager.queue.qsize() == 2
+
+    failed = manager.get(response["jobs"][1]["job_id"])
+    assert failed.done.is_set() and failed.finished_at is not None
+    assert not os.path.exists(failed.file_path)
+    assert manager.stats()["jobs"] == {"queued": 2, "failed": 1}
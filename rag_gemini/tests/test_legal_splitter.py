@@ -0,0 +1,75 @@
+from langchain.docstore.document import Document
+from legal_splitter import LegalTextSplitter, detect_law
+
+def page(text, number=0, source="documentos/Ley_80_de_1993.pdf"):
+    return Document(page_content=text, metadata={"source": source, "page": number})
+
+def test_detect_law_from_file_name_then_text():
+    assert detect_law("docs/ley_80_de_1993.pdf") == "Ley 80 de 1993"
+    assert detect_law("docs/contratos.pdf", "DECRETO 1082 DE 2015 por medio del cual...") == "Decreto 1082 de 2015"
+    assert detect_law("docs/contratos.pdf", "Sin referencia") is None
+
+def test_detect_law_from_upload_paths():
+    # Uploads are parsed from rag_storage/uploads/{job_id}_{name}
+    assert detect_law("rag_storage/uploads/3f2c9a1e_Ley_80_de_1993.pdf") == "Ley 80 de 1993"
+    assert detect_law("2024_decreto-1082-de-2015.pdf") == "Decreto 1082 de 2015"
+    assert detect_law("milley_80_de_1993.pdf") is None
+
+def test_laws_cited_in_the_text_are_not_the_document_law():
+    text = "\n".join(["MANUAL DE CONTRATACIÓN", "Entidad", "2023", "Versión 2", "Introducción"])
+    text += "\nSegún la Ley 80 de 1993, las entidades..."
+    assert detect_law("docs/manual.pdf", text) is None
+
+def test_one_chunk_per_article_with_metadata():
+    text = "\n".join([
+        "TÍTULO I",
+        "DISPOSICIONES GENERALES",
+        "ARTÍCULO 1.- Del objeto. La presente ley tiene por objeto...",
+        "conforme al artículo 5 de la Ley 1150.",
+        "CAPÍTULO II",
+        "ARTÍCULO 2.- De las entidades estatales.",
+        "ARTÍCULO 2 BIS.- Adicionado.",
+    ])
+    chunks = LegalTextSplitter().split_documents([page(text)])
+
+    assert [chunk.metadata.get("article") for chunk in chunks] == ["1", "2", "2 bis"]
+    first, second, _ = chunks
+    assert first.metadata["law"] == "Ley 80 de 1993"
+    assert first.metadata["section"] == "TÍTULO I DISPOSICIONES GENERALES"
+    assert second.metadata["section"] == "TÍTULO I DISPOSICIONES GENERALES / CAPÍTULO II"
+    # Lowercase references to other articles don't start a new chunk
+    assert "conforme al artículo 5" in first.page_content
+    assert first.page_content.startswith("Ley 80 de 1993, artículo 1\n")
+
+def test_chunks_start_on_the_page_of_their_article():
+    pages = [
+        page("ARTÍCULO 1.- Primero.\nTexto del primero.", 0),
+        page("Sigue el primero.\nARTÍCULO 2.- Segundo.", 1),
+    ]
+    chunks = LegalTextSplitter().split_documents(pages)
+    assert [(chunk.metadata["article"], chunk.metadata["page"]) for chunk in chunks] == [("1", 0), ("2", 1)]
+    assert "Sigue el primero." in chunks[0].page_content
+
+def test_repeated_page_headers_are_dropped():
+    bodies = ["Del objeto.", "De las entidades.", "De los servidores.", "De los contratistas."]
+    pages = [
+        page(f"Ley 80 de 1993 {number} EVA - Gestor Normativo\nARTÍCULO {number}.- {body}", number)
+        for number, body in enumerate(bodies, start=1)
+    ]
+    chunks = LegalTextSplitter().split_documents(pages)
+    assert [chunk.metadata["article"] for chunk in chunks] == ["1", "2", "3", "4"]
+    assert not any("Gestor Normativo" in chunk.page_content for chunk in chunks)
+
+def test_long_articles_are_cut_at_chunk_size():
+    lines = ["ARTÍCULO 3.- Largo."] + [f"Numeral {n} " + "x" * 80 for n in range(20)]
+    chunks = LegalTextSplitter(chunk_size=300).split_documents([page("\n".join(lines))])
+    assert len(chunks) > 1
+    assert all(chunk.metadata["article"] == "3" for chunk in chunks)
+    label = "Ley 80 de 1993, artículo 3\n"
+    assert all(len(chunk.page_content) - len(label) <= 300 for chunk in chunks)
+
+def test_documents_without_articles_use_the_fallback():
+    text = "Manual de uso.\n" + "Texto corrido sin estructura. " * 100
+    chunks = LegalTextSplitter().split_documents([page(text, source="documentos/manual.pdf")])
+    assert len(chunks) > 1
+    assert not any("article" in chunk.metadata for chunk in chunks)
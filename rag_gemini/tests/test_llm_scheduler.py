@@ -0,0 +1,150 @@
+import asyncio
+import threading
+import pytest
+import llm_scheduler
+from llm_scheduler import (
+    LLMRateLimited, LLMScheduler, TokenBucket, PRIORITY_BACKGROUND, PRIORITY_BULK, PRIORITY_INTERACTIVE,
+    is_retryable,
+)
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setenv("LLM_RETRY_BASE_DELAY", "0")
+    monkeypatch.setenv("LLM_MAX_RETRIES", "2")
+
+class QuotaError(Exception):
+    code = 429
+
+def test_token_bucket_refills_up_to_capacity(clock):
+    bucket = TokenBucket(per_minute=60)
+    bucket.take(60)
+    assert bucket.delay(1) == pytest.approx(1.0)
+    clock[0] += 30
+    bucket.refill(clock[0])
+    assert bucket.level == pytest.approx(30)
+    clock[0] += 3600
+    bucket.refill(clock[0])
+    assert bucket.level == 60
+    # More than the whole capacity is capped instead of waiting forever
+    assert bucket.delay(1000) == 0.0
+
+def test_token_bucket_without_limit_never_waits():
+    bucket = TokenBucket(per_minute=0)
+    bucket.take(10 ** 6)
+    assert bucket.delay(10 ** 6) == 0.0
+
+def test_higher_priority_is_admitted_first(clock):
+    scheduler = LLMScheduler("test", rpm=60, tpm=0)
+    scheduler._requests.take(60)
+    admitted = []
+    for priority in (PRIORITY_BULK, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE):
+        scheduler._enqueue(priority, 0, lambda priority=priority: admitted.append(priority))
+
+    assert scheduler._grant() == pytest.approx(1.0)
+    assert admitted == []
+    clock[0] += 1
+    scheduler._grant()
+    assert admitted == [PRIORITY_INTERACTIVE]
+    clock[0] += 2
+    scheduler._grant()
+    assert admitted == [PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND, PRIORITY_BULK]
+
+def test_token_quota_holds_back_large_calls(clock):
+    scheduler = LLMScheduler("test", rpm=0, tpm=600)
+    scheduler._tokens.take(600)
+    admitted = []
+    scheduler._enqueue(PRIORITY_INTERACTIVE, 100, lambda: admitted.append(100))
+    assert scheduler._grant() == pytest.approx(10.0)
+    clock[0] += 10
+    scheduler._grant()
+    assert admitted == [100]
+    assert scheduler._tokens.level == pytest.approx(0)
+
+def test_interactive_calls_give_up_after_queue_timeout(monkeypatch):
+    monkeypatch.setenv("LLM_QUEUE_TIMEOUT", "0.2")
+    scheduler = LLMScheduler("test", rpm=1, tpm=0)
+    scheduler._requests.take(1)
+
+    with pytest.raises(LLMRateLimited):
+        asyncio.run(scheduler.acquire(priority=PRIORITY_INTERACTIVE))
+    stats = scheduler.stats()
+    assert stats["rejections"] == 1
+    assert stats["waiting"]["interactive"] == 0
+
+def test_retryable_errors_are_retried():
+    scheduler = LLMScheduler("test", rpm=0, tpm=0)
+    attempts = []
+
+    async def call():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise QuotaError("429 Too Many Requests")
+        return "ok"
+
+    assert asyncio.run(scheduler.run(call)) == "ok"
+    assert scheduler.stats()["retries"] == 2
+    assert scheduler.stats()["calls"]["interactive"] == 3
+
+def test_other_errors_and_exhausted_retries_are_raised():
+    scheduler = LLMScheduler("test", rpm=0, tpm=0)
+
+    def bad_request():
+        raise ValueError("invalid argument")
+
+    def quota():
+        raise QuotaError("quota")
+
+    with pytest.raises(ValueError):
+        scheduler.run_sync(bad_request)
+    with pytest.raises(QuotaError):
+        scheduler.run_sync(quota)
+    assert scheduler.stats()["failures"] == 2
+    assert scheduler.stats()["retries"] == 2
+
+def test_is_retryable_follows_the_cause_chain():
+    try:
+        try:
+            raise QuotaError("quota")
+        except QuotaError as e:
+            raise RuntimeError("wrapped by the client") from e
+    except RuntimeError as e:
+        assert is_retryable(e)
+    assert not is_retryable(ValueError("bad request"))
+
+def test_waiters_can_be_woken_as_soon_as_they_are_queued(monkeypatch):
+    scheduler = LLMScheduler("test", rpm=0, tpm=0)
+    # Another caller's _grant runs right after the push, before acquire_sync
+    # gets the lock back
+    scheduler._lock = threading.RLock()
+    push = llm_scheduler.heapq.heappush
+
+    def push_then_grant(heap, item):
+        push(heap, item)
+        scheduler._grant()
+
+    monkeypatch.setattr(llm_scheduler.heapq, "heappush", push_then_grant)
+    scheduler.acquire_sync()
+    assert scheduler.stats()["calls"]["interactive"] == 1
+
+def test_threads_contending_for_quota_are_all_admitted():
+    # Plenty of quota: every thread's _grant admits other threads' waiters,
+    # which must already be able to wake up when they are queued
+    scheduler = LLMScheduler("test", rpm=10 ** 9, tpm=0)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(2000):
+                scheduler.run_sync(lambda: None)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    stats = scheduler.stats()
+    assert stats["calls"]["interactive"] == 16000
+    assert stats["waiting"]["interactive"] == 0
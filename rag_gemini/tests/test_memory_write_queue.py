@@ -0,0 +1,91 @@
+import time
+import asyncio
+from memory_service import MemoryWriteQueue
+
+class FakeMemoryService:
+    """
+    Records MemoryService.add calls (made from a worker thread).
+    """
+    def __init__(self, delay=0.0, fail_for=()):
+        self.delay = delay
+        self.fail_for = set(fail_for)
+        self.calls = []
+
+    def add(self, text, user_id="default_user", metadata=None):
+        time.sleep(self.delay)
+        if user_id in self.fail_for:
+            raise RuntimeError("mem0 unavailable")
+        self.calls.append((user_id, text, metadata))
+
+def test_pending_interactions_are_joined_per_user_and_metadata():
+    service = FakeMemoryService()
+
+    async def scenario():
+        queue = MemoryWriteQueue(service, flush_interval=60, concurrency=2)
+        queue.enqueue("uno", "ana")
+        queue.enqueue("dos", "ana")
+        queue.enqueue("tres", "ana", {"source": "finalize"})
+        queue.enqueue("cuatro", "luis")
+        assert queue.queue_depth == 4
+        await queue.flush()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert sorted(service.calls, key=str) == sorted([
+        ("ana", "uno\n\ndos", None),
+        ("ana", "tres", {"source": "finalize"}),
+        ("luis", "cuatro", None),
+    ], key=str)
+    stats = queue.stats()
+    assert (stats["interactions_written"], stats["mem0_writes"], stats["queue_depth"]) == (4, 3, 0)
+
+def test_flush_of_one_user_leaves_the_others_pending():
+    service = FakeMemoryService()
+
+    async def scenario():
+        queue = MemoryWriteQueue(service, flush_interval=60)
+        queue.enqueue("uno", "ana")
+        queue.enqueue("dos", "luis")
+        await queue.flush("ana")
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert service.calls == [("ana", "uno", None)]
+    assert list(queue.pending) == ["luis"]
+
+def test_flush_waits_for_writes_already_in_progress():
+    service = FakeMemoryService(delay=0.2)
+
+    async def scenario():
+        queue = MemoryWriteQueue(service, flush_interval=0.01)
+        await queue.start()
+        queue.enqueue("uno", "ana")
+        # Let the timer loop pick the interaction up, then flush with nothing pending
+        await asyncio.sleep(0.05)
+        assert not queue.pending
+        await queue.flush("ana")
+        written = list(service.calls)
+        await queue.stop()
+        return written
+
+    assert asyncio.run(scenario()) == [("ana", "uno", None)]
+
+def test_failed_writes_are_counted_and_on_write_is_called():
+    service = FakeMemoryService(fail_for={"luis"})
+    notified = []
+
+    async def on_write(user_id):
+        notified.append(user_id)
+
+    async def scenario():
+        queue = MemoryWriteQueue(service, flush_interval=60, on_write=on_write)
+        queue.enqueue("uno", "ana")
+        queue.enqueue("dos", "luis")
+        queue.enqueue("tres", "luis")
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(scenario())
+    assert notified == ["ana"]
+    assert queue.stats()["failed"] == 2
+    assert queue.stats()["interactions_written"] == 1
@@ -0,0 +1,149 @@
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from answer_cache import SemanticCache
+from rag_service import RAGService
+
+class FakeVectorStore:
+    """
+    In-memory stand-in for the PGVector collection: {id: (text, metadata)}.
+    """
+    def __init__(self):
+        self.rows = {}
+
+    def add_embeddings(self, texts, embeddings, metadatas=None, ids=None):
+        for id_, text, metadata in zip(ids, texts, metadatas):
+            self.rows[id_] = (text, dict(metadata))
+
+    def delete(self, ids=None):
+        for id_ in ids:
+            self.rows.pop(id_, None)
+
+class FakeEmbeddings:
+    def __init__(self, fail_after=None):
+        self.fail_after = fail_after
+        self.embedded = 0
+
+    def embed_documents(self, texts):
+        if self.fail_after is not None and self.embedded >= self.fail_after:
+            raise RuntimeError("429 quota exhausted")
+        self.embedded += len(texts)
+        return [[1.0, 0.0] for _ in texts]
+
+class InMemoryRAGService(RAGService):
+    """
+    RAGService with the database replaced by FakeVectorStore.
+    """
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+        self.vector_store = FakeVectorStore()
+        self.answer_cache = SemanticCache()
+        self.splitter = "legal"
+        self.ingest_batch_size = 1
+        self.ingest_concurrency = 1
+        self._ingest_executor = ThreadPoolExecutor(max_workers=1)
+
+    def _stored_chunks(self, source):
+        return {
+            id_: metadata.get("doc_hash")
+            for id_, (_, metadata) in self.vector_store.rows.items()
+            if metadata["source"] == source
+        }
+
+    def _update_doc_hash(self, ids, doc_hash):
+        for id_ in ids:
+            self.vector_store.rows[id_][1]["doc_hash"] = doc_hash
+
+def write_law(path, articles):
+    path.write_text("\n".join(f"ARTÍCULO {n}.- {text}" for n, text in enumerate(articles, start=1)), encoding="utf-8")
+    return str(path)
+
+def ingest(service, file_path):
+    return asyncio.run(service.ingest_file(file_path, progress=lambda done, total: None, source="leyes/ley_80_de_1993.txt"))
+
+ARTICLES = ["Del objeto.", "De las entidades.", "De los servidores.", "De los contratistas."]
+
+def test_unchanged_file_is_skipped(tmp_path):
+    service = InMemoryRAGService(FakeEmbeddings())
+    file_path = write_law(tmp_path / "ley.txt", ARTICLES)
+    first = ingest(service, file_path)
+    assert (first["added"], first["unchanged"]) == (4, False)
+
+    second = ingest(service, file_path)
+    assert (second["unchanged"], second["skipped"]) == (True, 4)
+    assert service.embeddings.embedded == 4
+
+def test_changed_file_only_embeds_new_chunks(tmp_path):
+    service = InMemoryRAGService(FakeEmbeddings())
+    ingest(service, write_law(tmp_path / "ley.txt", ARTICLES))
+
+    stats = ingest(service, write_law(tmp_path / "ley.txt", ARTICLES[:2] + ["De los particulares.", "De los contratistas."]))
+    assert (stats["added"], stats["skipped"], stats["deleted"]) == (1, 3, 1)
+    assert service.embeddings.embedded == 5
+    texts = sorted(text for text, _ in service.vector_store.rows.values())
+    assert any("De los particulares." in text for text in texts)
+    assert not any("De los servidores." in text for text in texts)
+    assert len({metadata["doc_hash"] for _, metadata in service.vector_store.rows.values()}) == 1
+
+def test_partial_ingest_is_resumed_not_skipped(tmp_path):
+    service = InMemoryRAGService(FakeEmbeddings(fail_after=2))
+    file_path = write_law(tmp_path / "ley.txt", ARTICLES)
+    with pytest.raises(RuntimeError):
+        ingest(service, file_path)
+    assert len(service.vector_store.rows) == 2
+
+    service.embeddings.fail_after = None
+    stats = ingest(service, file_path)
+    assert stats["unchanged"] is False
+    # The chunks stored before the failure are kept, not embedded again
+    assert (stats["added"], stats["skipped"]) == (2, 2)
+    assert len(service.vector_store.rows) == 4
+    assert ingest(service, file_path)["unchanged"] is True
+
+class FlakyEmbeddings(FakeEmbeddings):
+    """
+    Fails only the given call; the others take a little time.
+    """
+    def __init__(self, fail_call):
+        super().__init__()
+        self.fail_call = fail_call
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls += 1
+            call = self.calls
+        time.sleep(0.01)
+        if call == self.fail_call:
+            raise RuntimeError("503 service unavailable")
+        return super().embed_documents(texts)
+
+def test_failed_batch_stops_the_other_batches(tmp_path):
+    service = InMemoryRAGService(FlakyEmbeddings(fail_call=3))
+    service.ingest_concurrency = 2
+    service._ingest_executor = ThreadPoolExecutor(max_workers=2)
+    file_path = write_law(tmp_path / "ley.txt", ARTICLES * 5)
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await service.ingest_file(file_path, progress=lambda done, total: None, source="ley.txt")
+        stored = len(service.vector_store.rows)
+        # Nothing keeps inserting after ingest_file has failed
+        await asyncio.sleep(0.3)
+        return stored
+
+    stored = asyncio.run(scenario())
+    assert stored == len(service.vector_store.rows) < 20
+
+def test_upload_copies_are_labelled_with_the_law_of_their_name(tmp_path):
+    service = InMemoryRAGService(FakeEmbeddings())
+    file_path = tmp_path / "3f2c9a1e_Ley_80_de_1993.txt"
+    file_path.write_text(
+        "ARTÍCULO 1.- Conforme al Decreto 1082 de 2015.\nARTÍCULO 2.- De las entidades.", encoding="utf-8"
+    )
+    asyncio.run(service.ingest_file(str(file_path), progress=lambda done, total: None, source="leyes/Ley_80_de_1993.txt"))
+    assert {metadata["law"] for _, metadata in service.vector_store.rows.values()} == {"Ley 80 de 1993"}
+    assert {metadata["source"] for _, metadata in service.vector_store.rows.values()} == {"leyes/Ley_80_de_1993.txt"}
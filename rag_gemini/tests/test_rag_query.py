@@ -0,0 +1,191 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from langchain.docstore.document import Document
+from langchain_core.messages import AIMessage, AIMessageChunk
+from answer_cache import SemanticCache
+from context_packer import ContextPacker
+from llm_scheduler import LLMScheduler
+from rag_service import RAGService
+
+class FakeEmbeddings:
+    def __init__(self):
+        self.calls = []
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return self._vector(text)
+
+    def embed_queries(self, texts):
+        self.calls.append(list(texts))
+        return [self._vector(text) for text in texts]
+
+    @staticmethod
+    def _vector(text):
+        # Orthogonal per question, so the semantic cache never mixes them up
+        vector = [0.0] * 64
+        vector[hash(text) % 64] = 1.0
+        return vector
+
+class FakeLLM:
+    def __init__(self, tokens=3):
+        self.tokens = tokens
+        self.prompts = []
+
+    async def ainvoke(self, prompt):
+        self.prompts.append(prompt)
+        return AIMessage(content="respuesta")
+
+    async def astream(self, prompt):
+        self.prompts.append(prompt)
+        for n in range(self.tokens):
+            yield AIMessageChunk(content=f"t{n} ")
+
+class StubRAGService(RAGService):
+    """
+    RAGService with Gemini and the database replaced by stand-ins.
+    """
+    def __init__(self, max_concurrency=2, batch_concurrency=2, retrieval_delay=0.0):
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(max_workers=4)
+        self._query_semaphore = asyncio.Semaphore(max_concurrency)
+        self.embeddings = FakeEmbeddings()
+        self.llm = FakeLLM()
+        self.llm_scheduler = LLMScheduler("test", rpm=0, tpm=0)
+        self.answer_cache = SemanticCache(threshold=0.95, max_entries=100, ttl=0)
+        self.context_packer = ContextPacker()
+        self.context_packer.enabled = False
+        self.top_k = 2
+        self.retrieval_timeout = 5
+        self.batch_concurrency = batch_concurrency
+        self.retrieval_delay = retrieval_delay
+        self.retrievals = 0
+        self.active_retrievals = 0
+        self.max_active_retrievals = 0
+
+    async def _retrieve(self, embedding, text, mode="hybrid", filters=None, k=None):
+        self.retrievals += 1
+        self.active_retrievals += 1
+        self.max_active_retrievals = max(self.max_active_retrievals, self.active_retrievals)
+        try:
+            await asyncio.sleep(self.retrieval_delay)
+        finally:
+            self.active_retrievals -= 1
+        return [Document(id=f"{text}-{n}", page_content=f"fragmento {n} de {text}") for n in range(3)]
+
+def test_stream_releases_its_query_slot_before_the_client_reads(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService(max_concurrency=1)
+
+    async def scenario():
+        stream = service.query_stream("¿Qué es un contrato estatal?", mode="vector")
+        assert await stream.__anext__() == "t0 "
+        # The stream's client stalls; other queries still get the only slot
+        answer = await asyncio.wait_for(service.query("¿Qué es una licitación?", mode="vector"), 1)
+        rest = [token async for token in stream]
+        return answer, rest
+
+    answer, rest = asyncio.run(scenario())
+    assert answer == "respuesta"
+    assert rest == ["t1 ", "t2 "]
+    assert service._query_semaphore._value == 1
+
+def test_abandoned_stream_gives_its_slot_back(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService(max_concurrency=1)
+
+    async def scenario():
+        stream = service.query_stream("¿Qué es un contrato estatal?", mode="vector")
+        await stream.__anext__()
+        await stream.aclose()
+        # Another query gets the only slot once the stream is closed
+        return [token async for token in service.query_stream("¿Qué es una licitación?", mode="vector")]
+
+    assert asyncio.run(scenario()) == ["t0 ", "t1 ", "t2 "]
+    assert service._query_semaphore._value == 1
+
+def run_batch(service, texts, mode="vector"):
+    async def collect():
+        return {index: result async for index, result in service.query_batch(texts, mode=mode)}
+
+    results = asyncio.run(collect())
+    return [results[index] for index in range(len(texts))]
+
+def test_batch_answers_repeated_questions_once(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService()
+
+    results = run_batch(service, ["¿Qué es un contrato?", "  ¿Qué es  un contrato? ", "¿Qué es una licitación?", "¿Qué es un contrato?"])
+
+    assert [result["query"] for result in results] == ["¿Qué es un contrato?"] * 2 + ["¿Qué es una licitación?", "¿Qué es un contrato?"]
+    assert all(result["answer"] == "respuesta" for result in results)
+    # Both distinct questions embedded in one call, each retrieved and generated once
+    assert service.embeddings.calls == [["¿Qué es un contrato?", "¿Qué es una licitación?"]]
+    assert service.retrievals == 2
+    assert len(service.llm.prompts) == 2
+
+def test_batch_serves_cached_answers_without_embedding(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService()
+    first = run_batch(service, ["¿Qué es un contrato?", "¿Qué es una licitación?"])
+    service.embeddings.calls.clear()
+
+    again = run_batch(service, ["¿Qué es una licitación?", "¿Qué es un contrato?"])
+
+    assert again == first[::-1]
+    assert service.embeddings.calls == []
+    assert service.retrievals == 2
+
+def test_batch_retrieves_at_most_batch_concurrency_questions_at_once(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService(max_concurrency=8, batch_concurrency=2, retrieval_delay=0.02)
+
+    results = run_batch(service, [f"Pregunta {n}" for n in range(6)])
+
+    assert [result["query"] for result in results] == [f"Pregunta {n}" for n in range(6)]
+    assert service.retrievals == 6
+    assert service.max_active_retrievals == 2
+
+def test_batch_retrievals_share_the_query_slots(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService(max_concurrency=1, batch_concurrency=4, retrieval_delay=0.02)
+
+    run_batch(service, [f"Pregunta {n}" for n in range(4)])
+
+    assert service.max_active_retrievals == 1
+    assert service._query_semaphore._value == 1
+
+def test_a_failed_question_does_not_end_the_batch(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService()
+    generate = service._generate
+
+    async def flaky_generate(text, documents, extra=""):
+        if text == "¿Qué es una licitación?":
+            raise RuntimeError("Gemini no disponible")
+        return await generate(text, documents, extra)
+
+    service._generate = flaky_generate
+
+    results = run_batch(service, ["¿Qué es un contrato?", "¿Qué es una licitación?", "¿Qué es una licitación?"])
+
+    assert results[0]["answer"] == "respuesta"
+    assert results[1] == results[2] == {"query": "¿Qué es una licitación?", "error": "Gemini no disponible"}
+    # Errors aren't cached: the question is tried again next time
+    service._generate = generate
+    assert run_batch(service, ["¿Qué es una licitación?"])[0]["answer"] == "respuesta"
+
+def test_failed_embedding_fails_every_pending_question(monkeypatch):
+    monkeypatch.delenv("RAG_CACHE_ENABLED", raising=False)
+    service = StubRAGService()
+    run_batch(service, ["¿Qué es un contrato?"])
+
+    def embed_queries(texts):
+        raise RuntimeError("cuota agotada")
+
+    service.embeddings.embed_queries = embed_queries
+
+    results = run_batch(service, ["¿Qué es un contrato?", "¿Qué es una licitación?"])
+
+    assert results[0]["answer"] == "respuesta"
+    assert results[1] == {"query": "¿Qué es una licitación?", "error": "cuota agotada"}
+    assert service.retrievals == 1
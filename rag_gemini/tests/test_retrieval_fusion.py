@@ -0,0 +1,30 @@
+import pytest
+from langchain.docstore.document import Document
+from rag_service import normalize_mode, reciprocal_rank_fusion
+
+def docs(*ids):
+    return [Document(id=doc_id, page_content=f"texto {doc_id}") for doc_id in ids]
+
+def test_documents_found_by_both_retrievers_rank_first():
+    vector = docs("a", "b", "c")
+    lexical = docs("c", "d", "a")
+    fused = reciprocal_rank_fusion([vector, lexical], k=4)
+    assert [doc.id for doc in fused] == ["a", "c", "b", "d"]
+
+def test_fusion_keeps_the_first_copy_and_cuts_at_k():
+    vector = docs("a", "b")
+    lexical = [Document(id="b", page_content="otra copia"), *docs("e", "f")]
+    fused = reciprocal_rank_fusion([vector, lexical], k=2)
+    assert [doc.id for doc in fused] == ["b", "a"]
+    assert fused[0].page_content == "texto b"
+
+def test_a_single_list_keeps_its_order():
+    assert [doc.id for doc in reciprocal_rank_fusion([docs("x", "y", "z")], k=10)] == ["x", "y", "z"]
+
+def test_modes_and_legacy_aliases():
+    assert normalize_mode(None) == "hybrid"
+    assert normalize_mode("Vector") == "vector"
+    assert normalize_mode("naive") == "vector"
+    assert normalize_mode("mix") == "hybrid"
+    with pytest.raises(ValueError):
+        normalize_mode("graph")
@@ -0,0 +1,53 @@
+import pandas as pd
+from rag_service import rows_to_text, iter_table_documents
+
+def test_rows_render_as_column_value_lines():
+    df = pd.DataFrame({"Norma": ["Ley 80", "Decreto 1082"], "Año": [1993, 2015]})
+
+    assert list(rows_to_text(df)) == ["Norma: Ley 80\nAño: 1993", "Norma: Decreto 1082\nAño: 2015"]
+
+def test_empty_cells_leave_no_lines_behind():
+    df = pd.DataFrame({
+        "Norma": ["Ley 80", None, None],
+        "Tema": [None, "Contratos", None],
+        "Año": ["1993", None, None],
+    })
+
+    assert list(rows_to_text(df)) == ["Norma: Ley 80\nAño: 1993", "Tema: Contratos", ""]
+
+def test_a_single_column_and_no_columns():
+    assert list(rows_to_text(pd.DataFrame({"Norma": ["Ley 80"]}))) == ["Norma: Ley 80"]
+    assert list(rows_to_text(pd.DataFrame())) == []
+
+def test_csv_is_read_in_chunks_and_empty_rows_are_skipped(tmp_path):
+    path = tmp_path / "normas.csv"
+    path.write_text("\ufeffNorma,Año\nLey 80,1993\n,\nDecreto 1082,2015\nLey 1150,007\n", encoding="utf-8")
+
+    chunks = list(iter_table_documents(str(path), chunk_rows=2))
+
+    assert [[doc.metadata["row"] for doc in chunk] for chunk in chunks] == [[0], [2, 3]]
+    assert chunks[0][0].page_content == "Norma: Ley 80\nAño: 1993"
+    # Cells are read as written, not as numbers
+    assert chunks[1][1].page_content == "Norma: Ley 1150\nAño: 007"
+    assert chunks[0][0].metadata == {"source": str(path), "row": 0}
+
+def test_every_xlsx_sheet_is_read_with_its_name(tmp_path):
+    from openpyxl import Workbook
+
+    workbook = Workbook()
+    leyes = workbook.active
+    leyes.title = "Leyes"
+    for row in (["Norma", None], ["Ley 80", 1993], ["Ley 1150", 2007], ["Ley 1474", 2011]):
+        leyes.append(row)
+    workbook.create_sheet("Decretos").append(["Norma"])
+    workbook["Decretos"].append(["Decreto 1082"])
+    path = tmp_path / "normas.xlsx"
+    workbook.save(path)
+
+    documents = [doc for chunk in iter_table_documents(str(path), chunk_rows=2) for doc in chunk]
+
+    assert [(doc.metadata["sheet"], doc.metadata["row"]) for doc in documents] == [
+        ("Leyes", 0), ("Leyes", 1), ("Leyes", 2), ("Decretos", 0),
+    ]
+    assert documents[0].page_content == "Norma: Ley 80\ncolumn_2: 1993"
+    assert documents[3].page_content == "Norma: Decreto 1082"
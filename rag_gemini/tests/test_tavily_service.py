@@ -0,0 +1,94 @@
+import json
+import asyncio
+from types import SimpleNamespace
+import httpx
+import pytest
+import tavily_service
+from tavily_service import TavilyService
+
+class StandInTavily:
+    """
+    Tavily stand-in for httpx.MockTransport: counts requests and answers
+    after a short delay, so concurrent searches overlap.
+    """
+    def __init__(self, status_code=200):
+        self.status_code = status_code
+        self.requests = []
+
+    async def __call__(self, request):
+        self.requests.append((request.headers["Authorization"], json.loads(request.content)))
+        await asyncio.sleep(0.05)
+        if self.status_code != 200:
+            return httpx.Response(self.status_code, json={"detail": "error"})
+        query = json.loads(request.content)["query"]
+        return httpx.Response(200, json={"results": [{"url": "https://example.org", "content": f"sobre {query}"}]})
+
+@pytest.fixture
+def make_service(monkeypatch):
+    monkeypatch.setenv("TAVILY_CACHE_TTL", "60")
+    monkeypatch.delenv("TAVILY_BASE_URL", raising=False)
+
+    def make(server):
+        return TavilyService(api_key="test-key", transport=httpx.MockTransport(server))
+    return make
+
+def test_concurrent_identical_searches_share_one_request(make_service):
+    server = StandInTavily()
+    service = make_service(server)
+
+    async def scenario():
+        results = await asyncio.gather(*(service.search("Ley 80 de 1993") for _ in range(5)))
+        results.append(await service.search("  Ley 80   de 1993 "))
+        await service.close()
+        return results
+
+    results = asyncio.run(scenario())
+    assert len(server.requests) == 1
+    assert server.requests[0] == ("Bearer test-key", {"query": "Ley 80 de 1993", "search_depth": "basic", "max_results": 5})
+    assert all(result == results[0] for result in results)
+    assert service.stats() == {"entries": 1, "hits": 1, "misses": 1, "coalesced": 4, "inflight": 0}
+
+def test_search_is_repeated_after_the_ttl(make_service, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(tavily_service, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    server = StandInTavily()
+    service = make_service(server)
+
+    async def scenario():
+        await service.search("Ley 80 de 1993")
+        now[0] += 59
+        await service.search("Ley 80 de 1993")
+        now[0] += 2
+        await service.search("Ley 80 de 1993")
+        await service.close()
+
+    asyncio.run(scenario())
+    assert len(server.requests) == 2
+    assert (service.hits, service.misses) == (1, 2)
+
+def test_failed_searches_are_not_cached(make_service):
+    server = StandInTavily(status_code=503)
+    service = make_service(server)
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await service.search("Ley 80 de 1993")
+        await service.close()
+
+    asyncio.run(scenario())
+    assert len(server.requests) == 2
+    assert service.stats()["entries"] == 0
+
+def test_context_is_trimmed_to_the_token_budget(make_service):
+    service = make_service(StandInTavily())
+
+    async def scenario():
+        wide = await service.get_search_context("Ley 80 de 1993")
+        narrow = await service.get_search_context("Ley 80 de 1993", max_tokens=5)
+        await service.close()
+        return wide, narrow
+
+    wide, narrow = asyncio.run(scenario())
+    assert json.loads(wide) == [{"url": "https://example.org", "content": "sobre Ley 80 de 1993"}]
+    assert json.loads(narrow) == []
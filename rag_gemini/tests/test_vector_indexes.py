@@ -0,0 +1,54 @@
+from types import SimpleNamespace
+import pytest
+from sqlalchemy import create_engine
+from vector_indexes import VectorIndexManager
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.commits = 0
+
+    def cursor(self):
+        return SimpleNamespace(execute=self.statements.append, close=lambda: None)
+
+    def commit(self):
+        self.commits += 1
+
+class RecordingManager(VectorIndexManager):
+    """
+    Records which pooled connections it was asked to configure.
+    """
+    def _configure_connection(self, dbapi_connection, connection_record, connection_proxy=None):
+        connection_record.info.setdefault("configured", 0)
+        connection_record.info["configured"] += 1
+
+@pytest.fixture(autouse=True)
+def index_env(monkeypatch):
+    for name in ("RAG_INDEX_TYPE", "RAG_VECTOR_STORAGE", "RAG_HNSW_EF_SEARCH", "RAG_IVFFLAT_PROBES", "RAG_RERANK_CANDIDATES"):
+        monkeypatch.delenv(name, raising=False)
+
+def test_search_settings_are_set_once_per_connection():
+    manager = VectorIndexManager(create_engine("sqlite://"))
+    connection, record = FakeConnection(), SimpleNamespace(info={})
+    manager._configure_connection(connection, record)
+    manager._configure_connection(connection, record)
+    assert connection.statements == ["SET hnsw.ef_search = 40"]
+    assert connection.commits == 1
+
+def test_quantized_storage_searches_all_rerank_candidates(monkeypatch):
+    monkeypatch.setenv("RAG_INDEX_TYPE", "ivfflat")
+    assert VectorIndexManager(create_engine("sqlite://")).session_settings() == {"ivfflat.probes": 10}
+    monkeypatch.setenv("RAG_INDEX_TYPE", "hnsw")
+    manager = VectorIndexManager(create_engine("sqlite://"), storage="halfvec")
+    assert manager.session_settings() == {"hnsw.ef_search": 40}
+    monkeypatch.setenv("RAG_RERANK_CANDIDATES", "100")
+    manager = VectorIndexManager(create_engine("sqlite://"), storage="binary")
+    assert manager.session_settings() == {"hnsw.ef_search": 100}
+
+def test_connections_pooled_before_the_manager_are_configured(tmp_path):
+    # The engine is shared: Mem0 may open connections before RAGService exists
+    engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite'}", pool_size=1)
+    engine.connect().close()
+    RecordingManager(engine)
+    with engine.connect() as connection:
+        assert connection.connection._connection_record.info["configured"] == 1
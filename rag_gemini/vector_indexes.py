@@ -0,0 +1,270 @@
+import os
+import re
+from contextlib import contextmanager
+from sqlalchemy import event, text, cast, func, select
+from pgvector.sqlalchemy import VECTOR, HALFVEC, BIT
+from langchain_postgres import PGVector
+
+EMBEDDING_TABLE = "langchain_pg_embedding"
+# Full-text vector of each chunk, kept up to date by Postgres itself
+TSV_COLUMN = "document_tsv"
+# What the ANN index is built on: the full-precision vectors, or a compact
+# copy (half-precision floats, or one bit per dimension) with full-precision
+# rerank of the candidates
+STORAGE_MODES = ("full", "halfvec", "binary")
+
+class IndexedPGVector(PGVector):
+    """
+    PGVector whose equality filters ({"law": "Ley 80 de 1993"}, or with
+    "$eq") compile to cmetadata @> '{"law": ...}', which the jsonb_path_ops
+    GIN index serves. LangChain's own jsonb_path_match() form can't use any
+    index, so every filtered query was a sequential scan. Other operators
+    keep LangChain's translation ($in and $like go through ->>, and so
+    through the RAG_METADATA_INDEX_KEYS indexes).
+    """
+    def _handle_field_filter(self, field, value):
+        if isinstance(value, dict) and list(value) == ["$eq"]:
+            value = value["$eq"]
+        if isinstance(value, (str, int, float, bool)) and isinstance(field, str) and field.isidentifier():
+            return self.EmbeddingStore.cmetadata.contains({field: value})
+        return super()._handle_field_filter(field, value)
+
+class VectorIndexManager:
+    """
+    Creates and maintains the indexes PGVector doesn't build on its own:
+    an ANN index (HNSW by default, or IVFFlat) on the embedding column, a
+    generated tsvector column with its GIN index for lexical search, and
+    expression indexes on metadata keys looked up through ->> (ingestion's
+    per-source lookup, $in/$like filters). The JSONB GIN index LangChain
+    declares, which serves equality filters (see IndexedPGVector), is also
+    ensured, for tables created by older versions.
+
+    With a quantized storage mode the ANN index is an expression index on
+    embedding::halfvec or binary_quantize(embedding), 2x or 32x smaller than
+    one on the full vectors; those stay in the table and are only read to
+    rerank the index's candidates (see rerank_statement).
+    """
+    def __init__(self, engine, dimensions: int = 768, storage: str = None):
+        self.engine = engine
+        self.dimensions = dimensions
+        self.index_type = os.getenv("RAG_INDEX_TYPE", "hnsw").lower()
+        self.storage = (storage or os.getenv("RAG_VECTOR_STORAGE", "full")).lower()
+        self.rerank_candidates = int(os.getenv("RAG_RERANK_CANDIDATES", "40"))
+        self.hnsw_m = int(os.getenv("RAG_HNSW_M", "16"))
+        self.hnsw_ef_construction = int(os.getenv("RAG_HNSW_EF_CONSTRUCTION", "64"))
+        self.hnsw_ef_search = int(os.getenv("RAG_HNSW_EF_SEARCH", "40"))
+        self.ivfflat_lists = int(os.getenv("RAG_IVFFLAT_LISTS", "100"))
+        self.ivfflat_probes = int(os.getenv("RAG_IVFFLAT_PROBES", "10"))
+        self.text_search_config = os.getenv("RAG_TEXT_SEARCH_CONFIG", "spanish")
+        self.metadata_keys = [
+            key.strip() for key in os.getenv("RAG_METADATA_INDEX_KEYS", "source").split(",") if key.strip()
+        ]
+
+        if not re.fullmatch(r"[a-z_]+", self.text_search_config):
+            raise ValueError(f"Invalid RAG_TEXT_SEARCH_CONFIG: {self.text_search_config}")
+        if self.index_type not in ("hnsw", "ivfflat", "none"):
+            raise ValueError(f"Unsupported RAG_INDEX_TYPE: {self.index_type}")
+        if self.storage not in STORAGE_MODES:
+            raise ValueError(f"Unsupported RAG_VECTOR_STORAGE: {self.storage}")
+
+        # Search-time knobs are per session. The engine is shared and may have
+        # opened connections before this manager existed (e.g. for Mem0), so
+        # they are applied on checkout, once per pooled connection.
+        event.listen(self.engine, "checkout", self._configure_connection)
+
+    def session_settings(self) -> dict:
+        if self.index_type == "hnsw":
+            # HNSW returns at most ef_search rows, and reranking needs all the candidates
+            ef_search = self.hnsw_ef_search if self.storage == "full" else max(self.hnsw_ef_search, self.rerank_candidates)
+            return {"hnsw.ef_search": ef_search}
+        if self.index_type == "ivfflat":
+            return {"ivfflat.probes": self.ivfflat_probes}
+        return {}
+
+    def _configure_connection(self, dbapi_connection, connection_record, connection_proxy=None):
+        settings = self.session_settings()
+        if not settings or connection_record.info.get("ann_settings") == settings:
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in settings.items():
+                cursor.execute(f"SET {name} = {int(value)}")
+        finally:
+            cursor.close()
+        dbapi_connection.commit()
+        connection_record.info["ann_settings"] = settings
+
+    @property
+    def ann_index_name(self) -> str:
+        if self.storage == "full":
+            return f"ix_{EMBEDDING_TABLE}_{self.index_type}"
+        return f"ix_{EMBEDDING_TABLE}_{self.index_type}_{self.storage}"
+
+    def _ann_target(self) -> tuple:
+        # (indexed expression, operator class); queries must use the same expression
+        if self.storage == "halfvec":
+            return f"(embedding::halfvec({self.dimensions}))", "halfvec_cosine_ops"
+        if self.storage == "binary":
+            return f"(binary_quantize(embedding)::bit({self.dimensions}))", "bit_hamming_ops"
+        return "embedding", "vector_cosine_ops"
+
+    @property
+    def text_index_name(self) -> str:
+        return f"ix_{EMBEDDING_TABLE}_{TSV_COLUMN}"
+
+    @staticmethod
+    def _metadata_index_name(key: str) -> str:
+        return f"ix_{EMBEDDING_TABLE}_meta_{re.sub(r'[^a-zA-Z0-9_]', '_', key)}"
+
+    def _index_statements(self, include_ann: bool = True) -> list:
+        statements = [
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_cmetadata_gin ON {EMBEDDING_TABLE} "
+            f"USING gin (cmetadata jsonb_path_ops)",
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.text_index_name} ON {EMBEDDING_TABLE} "
+            f"USING gin ({TSV_COLUMN})",
+        ]
+        for key in self.metadata_keys:
+            statements.append(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self._metadata_index_name(key)} "
+                f"ON {EMBEDDING_TABLE} ((cmetadata ->> '{key.replace(chr(39), chr(39) * 2)}'))"
+            )
+        if not include_ann:
+            return statements
+        expression, opclass = self._ann_target()
+        if self.index_type == "hnsw":
+            statements.append(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.ann_index_name} ON {EMBEDDING_TABLE} "
+                f"USING hnsw ({expression} {opclass}) "
+                f"WITH (m = {self.hnsw_m}, ef_construction = {self.hnsw_ef_construction})"
+            )
+        elif self.index_type == "ivfflat":
+            statements.append(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {self.ann_index_name} ON {EMBEDDING_TABLE} "
+                f"USING ivfflat ({expression} {opclass}) WITH (lists = {self.ivfflat_lists})"
+            )
+        return statements
+
+    def rerank_statement(self, EmbeddingStore, embedding: list, k: int, *criteria):
+        """
+        Nearest-neighbour query for quantized storage: the ANN index picks
+        rerank_candidates rows by their halfvec/binary vector, and those are
+        ranked by exact cosine distance on the full-precision column.
+        """
+        query = cast(embedding, VECTOR(self.dimensions))
+        if self.storage == "halfvec":
+            approximate = cast(EmbeddingStore.embedding, HALFVEC(self.dimensions)).op("<=>")(cast(query, HALFVEC(self.dimensions)))
+        else:
+            approximate = cast(func.binary_quantize(EmbeddingStore.embedding), BIT(self.dimensions)).op("<~>")(func.binary_quantize(query))
+
+        candidates = (
+            select(EmbeddingStore.id, EmbeddingStore.document, EmbeddingStore.cmetadata, EmbeddingStore.embedding)
+            .where(*criteria)
+            .order_by(approximate)
+            .limit(max(k, self.rerank_candidates))
+            .subquery()
+        )
+        return (
+            select(candidates.c.id, candidates.c.document, candidates.c.cmetadata)
+            .order_by(candidates.c.embedding.cosine_distance(embedding))
+            .limit(k)
+        )
+
+    def _supports_storage(self, conn) -> bool:
+        # halfvec, bit_hamming_ops and binary_quantize arrived in pgvector 0.7
+        if self.storage == "full":
+            return True
+        version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar() or "0"
+        if tuple(int(part) for part in re.findall(r"\d+", version)[:2]) >= (0, 7):
+            return True
+        print(f"RAG_VECTOR_STORAGE={self.storage} needs pgvector 0.7+ (installed: {version}), using full-precision vectors")
+        self.storage = "full"
+        return False
+
+    def _ensure_typed_column(self, conn) -> bool:
+        """
+        ANN indexes need a fixed dimension. Tables created without
+        embedding_length have an untyped vector column; pin it if every row
+        already has the expected dimension.
+        """
+        typmod = conn.execute(text(
+            "SELECT atttypmod FROM pg_attribute "
+            "WHERE attrelid = CAST(:table AS regclass) AND attname = 'embedding'"
+        ), {"table": EMBEDDING_TABLE}).scalar()
+        if typmod == self.dimensions:
+            return True
+
+        mismatched = conn.execute(text(
+            f"SELECT count(*) FROM {EMBEDDING_TABLE} WHERE vector_dims(embedding) <> :dims"
+        ), {"dims": self.dimensions}).scalar()
+        if mismatched:
+            print(f"Not indexing embeddings: {mismatched} rows are not {self.dimensions}-dimensional")
+            return False
+
+        conn.execute(text(f"ALTER TABLE {EMBEDDING_TABLE} ALTER COLUMN embedding TYPE vector({self.dimensions})"))
+        return True
+
+    def _ensure_tsv_column(self, conn):
+        conn.execute(text(
+            f"ALTER TABLE {EMBEDDING_TABLE} ADD COLUMN IF NOT EXISTS {TSV_COLUMN} tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{self.text_search_config}', coalesce(document, ''))) STORED"
+        ))
+
+    @contextmanager
+    def _ddl_connection(self):
+        # CREATE INDEX CONCURRENTLY can't run inside a transaction, and index
+        # builds may take longer than the pool's statement_timeout
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text("SET statement_timeout = 0"))
+            try:
+                yield conn
+            finally:
+                conn.execute(text("RESET statement_timeout"))
+
+    def ensure(self):
+        with self._ddl_connection() as conn:
+            self._ensure_tsv_column(conn)
+            self._supports_storage(conn)
+            include_ann = self.index_type != "none" and self._ensure_typed_column(conn)
+            for statement in self._index_statements(include_ann):
+                conn.execute(text(statement))
+
+    def rebuild(self) -> dict:
+        """
+        Drops and recreates the managed indexes, picking up the current
+        parameters (m, ef_construction, lists...).
+        """
+        names = [
+            f"ix_{EMBEDDING_TABLE}_{index_type}" + ("" if storage == "full" else f"_{storage}")
+            for index_type in ("hnsw", "ivfflat") for storage in STORAGE_MODES
+        ]
+        names.append(self.text_index_name)
+        names += [self._metadata_index_name(key) for key in self.metadata_keys]
+        self.drop(names)
+        self.ensure()
+        return self.status()
+
+    def index_names(self) -> set:
+        with self.engine.connect() as conn:
+            return set(conn.execute(
+                text("SELECT indexname FROM pg_indexes WHERE tablename = :table"), {"table": EMBEDDING_TABLE}
+            ).scalars())
+
+    def drop(self, names):
+        with self._ddl_connection() as conn:
+            for name in names:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    def status(self) -> dict:
+        with self.engine.connect() as conn:
+            rows = conn.execute(text(
+                "SELECT indexname, indexdef, pg_relation_size(CAST(quote_ident(indexname) AS regclass)) "
+                "FROM pg_indexes WHERE tablename = :table ORDER BY indexname"
+            ), {"table": EMBEDDING_TABLE}).all()
+        return {
+            "index_type": self.index_type,
+            "storage": self.storage,
+            "rerank_candidates": self.rerank_candidates,
+            "hnsw": {"m": self.hnsw_m, "ef_construction": self.hnsw_ef_construction, "ef_search": self.hnsw_ef_search},
+            "ivfflat": {"lists": self.ivfflat_lists, "probes": self.ivfflat_probes},
+            "indexes": [{"name": name, "definition": definition, "bytes": size} for name, definition, size in rows],
+        }